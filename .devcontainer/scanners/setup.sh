@@ -81,6 +81,10 @@ for service in "${!SERVICE_PYTHON[@]}"; do
   "$svc_dir/.venv/bin/pip" install --quiet --upgrade pip
   "$svc_dir/.venv/bin/pip" install --quiet -r "$svc_dir/requirements.txt"
 
+  # Modules shared between services are copied into their images at build time, make them importable locally
+  site_packages="$("$svc_dir/.venv/bin/python" -c 'import sysconfig; print(sysconfig.get_paths()["purelib"])')"
+  echo "$REPO_ROOT/shared/arango" > "$site_packages/tracker-shared.pth"
+
   # Copy .env.example → .env if no .env exists yet
   if [ ! -f "$svc_dir/.env" ] && [ -f "$svc_dir/.env.example" ]; then
     cp "$svc_dir/.env.example" "$svc_dir/.env"
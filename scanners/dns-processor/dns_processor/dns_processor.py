@@ -1,13 +1,35 @@
 import json
 import os
 import datetime
+from types import MappingProxyType
 from dotenv import load_dotenv
 
 load_dotenv()
 
 current_directory = os.path.dirname(os.path.realpath(__file__))
-guidance_file = open(f"{current_directory}/dns-guidance.json")
-guidance = json.load(guidance_file)
+with open(f"{current_directory}/dns-guidance.json") as guidance_file:
+    guidance = json.load(guidance_file)
+
+GUIDANCE_TAG_CATEGORIES = {
+    "pass": "positive_tags",
+    "fail": "negative_tags",
+    "info": "neutral_tags",
+}
+
+
+def build_tag_categories(scan_guidance):
+    # Map each tag of a scan type's guidance to the processed tag lists it belongs in
+    tag_categories = {}
+    for guidance_category, tag_category in GUIDANCE_TAG_CATEGORIES.items():
+        for tag in scan_guidance.get(guidance_category, []):
+            tag_categories[tag] = tag_categories.get(tag, ()) + (tag_category,)
+    return MappingProxyType(tag_categories)
+
+
+# Compiled once at import, tag classification is a single dict lookup per tag
+TAG_CATEGORIES = MappingProxyType(
+    {scan_type: build_tag_categories(guidance[scan_type]) for scan_type in guidance}
+)
 
 
 def get_dkim_tag_status(selector_tag_list, sends_email):
@@ -36,12 +58,8 @@ def get_dkim_tag_status(selector_tag_list, sends_email):
         }
 
         for tag in tags:
-            if tag in guidance["dkim"]["pass"]:
-                selector_tags[dkim_selector]["positive_tags"].append(tag)
-            if tag in guidance["dkim"]["fail"]:
-                selector_tags[dkim_selector]["negative_tags"].append(tag)
-            if tag in guidance["dkim"]["info"]:
-                selector_tags[dkim_selector]["neutral_tags"].append(tag)
+            for tag_category in TAG_CATEGORIES["dkim"].get(tag, ()):
+                selector_tags[dkim_selector][tag_category].append(tag)
 
         if len(selector_tags[dkim_selector]["negative_tags"]) > 0:
             dkim_statuses.append("fail")
@@ -115,12 +133,8 @@ def process_spf(spf_results):
     def get_spf_tag_status(tags):
         processed_spf = {"positive_tags": [], "negative_tags": [], "neutral_tags": []}
         for tag in tags:
-            if tag in guidance["spf"]["pass"]:
-                processed_spf["positive_tags"].append(tag)
-            if tag in guidance["spf"]["fail"]:
-                processed_spf["negative_tags"].append(tag)
-            if tag in guidance["spf"]["info"]:
-                processed_spf["neutral_tags"].append(tag)
+            for tag_category in TAG_CATEGORIES["spf"].get(tag, ()):
+                processed_spf[tag_category].append(tag)
 
         if (
             "spf12" in processed_spf["positive_tags"]
@@ -190,12 +204,8 @@ def process_dmarc(dmarc_results):
         processed_dmarc = {"positive_tags": [], "negative_tags": [], "neutral_tags": []}
 
         for tag in tags:
-            if tag in guidance["dmarc"]["pass"]:
-                processed_dmarc["positive_tags"].append(tag)
-            if tag in guidance["dmarc"]["fail"]:
-                processed_dmarc["negative_tags"].append(tag)
-            if tag in guidance["dmarc"]["info"]:
-                processed_dmarc["neutral_tags"].append(tag)
+            for tag_category in TAG_CATEGORIES["dmarc"].get(tag, ()):
+                processed_dmarc[tag_category].append(tag)
 
         if (
             "dmarc10" in processed_dmarc["positive_tags"]
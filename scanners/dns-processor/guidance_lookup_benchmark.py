@@ -0,0 +1,61 @@
+import argparse
+import timeit
+
+from dns_processor.dns_processor import TAG_CATEGORIES, get_dkim_tag_status, guidance
+
+
+def list_tag_categories(scan_type, tag):
+    # Previous implementation: scans each guidance list for every tag
+    tag_categories = []
+    if tag in guidance[scan_type]["pass"]:
+        tag_categories.append("positive_tags")
+    if tag in guidance[scan_type]["fail"]:
+        tag_categories.append("negative_tags")
+    if tag in guidance[scan_type]["info"]:
+        tag_categories.append("neutral_tags")
+    return tag_categories
+
+
+def lookup_tag_categories(scan_type, tag):
+    return list(TAG_CATEGORIES[scan_type].get(tag, ()))
+
+
+def build_scan_tags(scan_type):
+    # Every tag in the guidance for the scan type plus one unknown tag
+    return [
+        tag for category in guidance[scan_type].values() for tag in category
+    ] + [f"{scan_type}0"]
+
+
+def time_per_call(fn, args_list, number):
+    def run():
+        for args in args_list:
+            fn(*args)
+
+    seconds = min(timeit.repeat(run, number=number, repeat=5))
+    return seconds / (number * len(args_list)) * 1_000_000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare list and lookup table classification of DNS scan tags."
+    )
+    parser.add_argument("--number", "-n", type=int, default=2000,
+                        help="Number of iterations per measurement.")
+    args = parser.parse_args()
+
+    for scan_type in guidance:
+        tag_args = [(scan_type, tag) for tag in build_scan_tags(scan_type)]
+        assert [list_tag_categories(*a) for a in tag_args] == [
+            lookup_tag_categories(*a) for a in tag_args
+        ]
+        list_us = time_per_call(list_tag_categories, tag_args, args.number)
+        lookup_us = time_per_call(lookup_tag_categories, tag_args, args.number)
+        print(
+            f"{scan_type} tag: list {list_us:.3f} us, lookup table {lookup_us:.3f} us "
+            f"({list_us / lookup_us:.1f}x)"
+        )
+
+    selector_tags = {f"selector{i}": build_scan_tags("dkim") for i in range(3)}
+    dkim_us = time_per_call(get_dkim_tag_status, [(selector_tags, "true")], args.number)
+    print(f"get_dkim_tag_status (3 selectors): {dkim_us:.1f} us per result")
@@ -1,12 +1,10 @@
 import asyncio
+import copy
 import datetime
 import ipaddress
 import json
 import logging
-import time
-from dataclasses import dataclass
-
-from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 
 import nats
 import os
@@ -14,12 +12,12 @@ import re
 import signal
 import sys
 import traceback
-from arango import ArangoClient, DocumentUpdateError
 from dotenv import load_dotenv
 from nats.js import JetStreamContext
 from nats.js.api import RetentionPolicy, AckPolicy, ConsumerConfig
 from nats.errors import TimeoutError as NatsTimeoutError
 
+from async_arango import ArangoError, AsyncArangoDatabase
 from dns_processor.dns_processor import process_results
 from notify.send_mx_diff_email_alerts import send_mx_diff_email_alerts
 
@@ -61,10 +59,23 @@ CNAME_MONITOR_ONLY_LIST = os.getenv("CNAME_MONITOR_ONLY_LIST", "").split(",")
 SERVICE_ACCOUNT_EMAIL = os.getenv("SERVICE_ACCOUNT_EMAIL")
 
 SCAN_THREAD_COUNT = int(os.getenv("SCAN_THREAD_COUNT", 1))
-
-# Establish DB connection
-arango_client = ArangoClient(hosts=DB_URL)
-db = arango_client.db(DB_NAME, username=DB_USER, password=DB_PASS)
+# Number of batches processed concurrently on the event loop
+MAX_IN_FLIGHT_BATCHES = int(os.getenv("MAX_IN_FLIGHT_BATCHES", SCAN_THREAD_COUNT))
+# Maximum number of open connections to the database, other requests wait for a free one.
+# Each batch sends one request at a time, so by default every batch in flight has a connection.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", MAX_IN_FLIGHT_BATCHES))
+DB_POOL_STATS_INTERVAL = int(os.getenv("DB_POOL_STATS_INTERVAL", 300))
+# Number of messages fetched and written to the database together
+PROCESS_BATCH_SIZE = int(os.getenv("PROCESS_BATCH_SIZE", 1))
+# Publish domain status changes for the incremental summaries consumer
+PUBLISH_STATUS_CHANGES = os.getenv("PUBLISH_STATUS_CHANGES", "false").lower() == "true"
+STATUS_CHANGE_SUBJECT = "scans.domain_status_changes"
+# Statuses counted in chart and organization summaries
+SUMMARY_STATUS_CATEGORIES = ("https", "hsts", "ssl", "dmarc", "spf", "dkim")
+
+# DB connection pool, opened on the event loop in run()
+# DB_URL can list several coordinators separated by commas
+db = AsyncArangoDatabase(DB_URL, DB_NAME, DB_USER, DB_PASS, pool_size=DB_POOL_SIZE)
 
 
 def to_camelcase(string):
@@ -92,25 +103,45 @@ def snake_to_camel(d):
         }
 
 
-def check_mx_diff(processed_results, domain_id):
-    new_mx = processed_results.get("mx_records").get("hosts")
-    mx_record_diff = False
-    # fetch most recent scan of domain
-    last_mx_cursor = db.aql.execute(
+def mx_hosts(mx_records):
+    # MX hosts kept on the domain document to compare with the next scan
+    # A scan without MX records has no hosts, so that hosts added later are reported as a change
+    if mx_records is None:
+        return []
+    return [
+        {"hostname": host["hostname"], "preference": host["preference"]}
+        for host in mx_records.get("hosts") or []
+    ]
+
+
+async def get_last_mx(domain_id):
+    # Domains stored before latestMxHosts was added need the MX records of their most recent scan
+    last_mx = await db.aql(
         """
             FOR v, e IN 1..1 OUTBOUND @domain_id domainsDNS
                 SORT v.timestamp DESC
                 LIMIT 1
-                RETURN v
+                RETURN v.mxRecords.hosts
             """,
         bind_vars={"domain_id": domain_id},
     )
+    # None only if there is no previous scan, a previous scan without MX records has no hosts
+    if len(last_mx) == 0:
+        return None
+    return last_mx[0] or []
+
+
+async def check_mx_diff(processed_results, domain):
+    new_mx = processed_results.get("mx_records").get("hosts")
+    mx_record_diff = False
+    if "latestMxHosts" in domain:
+        last_mx = domain["latestMxHosts"] or []
+    else:
+        last_mx = await get_last_mx(domain["_id"])
     # if no previous scan, return False as we can't compare records
-    if last_mx_cursor.empty():
+    if last_mx is None:
         return False
 
-    last_mx = last_mx_cursor.next().get("mxRecords", {}).get("hosts", [])
-
     # compare mx_records to most recent scan
     # if different, set mx_records_diff to True
     # check number of hosts
@@ -127,24 +158,24 @@ def check_mx_diff(processed_results, domain_id):
         if set(hostnames_new) != set(hostnames_last):
             mx_record_diff = True
 
-    # fetch domain org, filter by verified and externally managed
-    domain_org_cursor = db.aql.execute(
-        """
-            FOR v, e IN 1..1 INBOUND @domain_id claims
-                FILTER v.verified == true
-                LIMIT 1
-                RETURN v
-            """,
-        bind_vars={"domain_id": domain_id},
-    )
-    # if no org, return early
-    if domain_org_cursor.empty():
-        return mx_record_diff
-
-    domain_org = domain_org_cursor.next()
-
     # send alerts if true
     if mx_record_diff and os.getenv("ALERT_SUBS"):
+        # fetch domain org, filter by verified and externally managed
+        domain_orgs = await db.aql(
+            """
+                FOR v, e IN 1..1 INBOUND @domain_id claims
+                    FILTER v.verified == true
+                    LIMIT 1
+                    RETURN v
+                """,
+            bind_vars={"domain_id": domain["_id"]},
+        )
+        # if no org, return early
+        if len(domain_orgs) == 0:
+            return mx_record_diff
+
+        domain_org = domain_orgs[0]
+
         current_val = []
         for host in new_mx:
             current_val.append(f"{host['hostname']} {host['preference']}")
@@ -162,7 +193,9 @@ def check_mx_diff(processed_results, domain_id):
         else:
             prev_val = ";".join(prev_val)
 
-        send_mx_diff_email_alerts(
+        # The notification client is blocking, keep it off the event loop
+        await asyncio.to_thread(
+            send_mx_diff_email_alerts,
             domain=processed_results.get("domain"),
             record_type="MX",
             org=domain_org,
@@ -185,286 +218,528 @@ def is_cname_target(resolve_chain, domains):
     return False
 
 
-def process_msg(msg):
-    subject = msg.subject
-    reply = msg.reply
-    data = msg.data.decode()
-    logger.info(f"Received a message on '{subject} {reply}': {data}")
-    payload = json.loads(msg.data)
+def summary_snapshot(domain):
+    # Fields of a domain that chart and organization summaries are computed from
+    status = domain.get("status") or {}
+    negative_tags = domain.get("negativeTags") or {}
+    # Web tags are counted once per web scan reporting them, domains updated before
+    # webScanNegativeTags was stored fall back to the distinct tags until their next web scan
+    web_negative_tags = domain.get("webScanNegativeTags")
+    if web_negative_tags is None:
+        web_negative_tags = negative_tags.get("web") or []
+    return {
+        "status": {category: status.get(category) for category in SUMMARY_STATUS_CATEGORIES},
+        "phase": domain.get("phase"),
+        "negative_tags": sorted((negative_tags.get("dns") or []) + web_negative_tags),
+        "ignored": domain.get("archived") is True
+        or domain.get("blocked") is True
+        or domain.get("rcode") == "NXDOMAIN",
+    }
 
-    scan_results = payload.get("results")
-    domain_key = payload.get("domain_key")
-    user_key = payload.get("user_key")
-    shared_id = payload.get("shared_id")
+
+async def get_claiming_org_ids(domain_ids):
+    """
+    Fetch the organizations with an approved claim on each domain
+    :return: Dict of domain _id to a list of organization _ids
+    """
+    claims = await db.aql(
+        """
+            FOR claim IN claims
+                FILTER claim._to IN @domain_ids
+                FILTER claim.assetState == "approved"
+                RETURN { domain_id: claim._to, org_id: claim._from }
+            """,
+        bind_vars={"domain_ids": list(domain_ids)},
+    )
+    org_ids = {}
+    for claim in claims:
+        org_ids.setdefault(claim["domain_id"], []).append(claim["org_id"])
+    return org_ids
+
+
+def status_change_msg_id(status_change, msg):
+    # A redelivered scan message publishes its status change under the same id, JetStream drops the duplicate
+    return f"{status_change['domain_id']}:{msg.metadata.sequence.stream}"
+
+
+async def add_status_changes(entries):
+    changed = [
+        entry
+        for entry in entries
+        if not entry.failed
+        and entry.domain_updated
+        and summary_snapshot(entry.domain) != entry.previous_snapshot
+    ]
+    if len(changed) == 0:
+        return
 
     try:
-        domain = db.collection("domains").get({"_key": domain_key})
+        org_ids = await get_claiming_org_ids({entry.domain["_id"] for entry in changed})
     except Exception as e:
-        logger.error(
-            f"Error while fetching domain for received message: {msg}: {str(e)}"
-        )
+        logger.error(f"Error while fetching claims for status changes: {str(e)}")
         return
 
-    scan_results["sends_email"] = domain.get("sendsEmail", "unknown")
+    for entry in changed:
+        entry.status_change = {
+            "domain_id": entry.domain["_id"],
+            "domain": entry.domain["domain"],
+            "org_ids": org_ids.get(entry.domain["_id"], []),
+            "old": entry.previous_snapshot,
+            "new": summary_snapshot(entry.domain),
+            "timestamp": entry.processed_results["timestamp"],
+        }
+
+
+@dataclass
+class BatchEntry:
+    msg: object
+    payload: dict
+    domain: dict = None
+    processed_results: dict = None
+    dns_entry: dict = None
+    web_entry: dict = None
+    web_scan_ips: list = field(default_factory=list)
+    web_scans: list = field(default_factory=list)
+    formatted_scan_data_array: list = field(default_factory=list)
+    previous_snapshot: dict = None
+    domain_patch: dict = None
+    domain_updated: bool = False
+    status_change: dict = None
+    failed: bool = False
+
+    def fail(self, error):
+        logger.error(
+            f"Error while inserting processed results for received message: {self.msg}: {error}"
+        )
+        self.failed = True
+
+
+async def bulk_insert(collection_name, entries, docs_for_entry):
+    """
+    Insert the documents built by docs_for_entry for every live entry with a
+    single insert_many call. Returns the inserted document metadata for each
+    entry, in the same order as entries. Entries with a failed insert are marked
+    as failed and get an empty list.
+    """
+    owners = []
+    docs = []
+    for i, entry in enumerate(entries):
+        if entry.failed:
+            continue
+        for doc in docs_for_entry(entry):
+            owners.append(i)
+            docs.append(doc)
+
+    inserted = [[] for _ in entries]
+    if len(docs) == 0:
+        return inserted
 
-    processed_results = process_results(scan_results)
     try:
-        if processed_results.get("mx_records") is not None:
-            mx_record_diff = check_mx_diff(
-                processed_results=processed_results,
-                domain_id=f"domains/{domain_key}",
-            )
-            processed_results["mx_records"].update({"diff": mx_record_diff})
+        results = await db.insert_many(collection_name, docs)
     except Exception as e:
-        logger.error(f"Checking MX diff for received message {msg}: {str(e)}")
+        for i in set(owners):
+            entries[i].fail(f"Bulk insert into '{collection_name}' failed: {str(e)}")
+        return inserted
+
+    for i, res in zip(owners, results):
+        if isinstance(res, Exception):
+            entries[i].fail(f"Insert into '{collection_name}' failed: {str(res)}")
+            continue
+        inserted[i].append(res)
+    return inserted
+
+
+# Patches are merged into the stored domain, leaving the fields other services own untouched
+UPDATE_DOMAINS_QUERY = """
+    FOR patch IN @patches
+        UPDATE patch._key WITH patch.fields IN domains
+"""
+
+
+def merge_patch(document, patch):
+    # Apply a patch locally the way UPDATE merges it into the stored document
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(document.get(key), dict):
+            merge_patch(document[key], value)
+        else:
+            document[key] = value
 
-    dmarc_location = processed_results.get("dmarc").get("location")
-    dmarc_status = processed_results.get("dmarc").get("status")
-    spf_status = processed_results.get("spf").get("status")
-    dkim_status = processed_results.get("dkim").get("status")
 
-    rcode = processed_results.get("rcode", None)
+async def update_domain(entry):
+    try:
+        await db.aql(
+            UPDATE_DOMAINS_QUERY,
+            bind_vars={"patches": [{"_key": entry.domain["_key"], "fields": entry.domain_patch}]},
+        )
+        return True
+    except ArangoError as e:
+        logger.error(
+            f"Error while updating domain for received message: {entry.msg}: {str(e)}"
+        )
+        return False
 
-    formatted_scan_data_array = []
 
-    if user_key is None:
-        try:
-            dns_entry = db.collection("dns").insert(snake_to_camel(processed_results))
-            domain.update({"latestDnsScan": dns_entry["_id"]})
-
-            db.collection("domainsDNS").insert(
-                {
-                    "_from": domain["_id"],
-                    "timestamp": processed_results["timestamp"],
-                    "_to": dns_entry["_id"],
-                }
-            )
+async def bulk_update_domains(entries):
+    live = [entry for entry in entries if not entry.failed]
+    if len(live) == 0:
+        return
 
-            web_entry = db.collection("web").insert(
-                {
-                    "timestamp": str(datetime.datetime.now().astimezone()),
-                    "domain": processed_results["domain"],
-                }
+    try:
+        await db.aql(
+            UPDATE_DOMAINS_QUERY,
+            bind_vars={
+                "patches": [
+                    {"_key": entry.domain["_key"], "fields": entry.domain_patch}
+                    for entry in live
+                ]
+            },
+        )
+    except ArangoError as e:
+        # The query is a single transaction, retry each patch on its own so one conflict does not fail the batch
+        logger.error(f"Bulk domain update failed, updating individually: {str(e)}")
+        for entry in live:
+            entry.domain_updated = await update_domain(entry)
+        return
+
+    for entry in live:
+        entry.domain_updated = True
+
+
+def build_domain_patch(entry):
+    """
+    Build the fields of the domain document set by the DNS processor
+    :return: Dict merged into the stored domain
+    """
+    domain = entry.domain
+    processed_results = entry.processed_results
+    scan_results = entry.payload.get("results")
+
+    status = {
+        "dmarc": processed_results.get("dmarc").get("status"),
+        "spf": processed_results.get("spf").get("status"),
+        "dkim": processed_results.get("dkim").get("status"),
+    }
+    if domain.get("status", None) is None:
+        status = {
+            "certificates": "info",
+            "ciphers": "info",
+            "curves": "info",
+            "hsts": "info",
+            "https": "info",
+            "protocols": "info",
+            "ssl": "info",
+            **status,
+        }
+
+    dns_negative_tags = (
+        processed_results.get("spf", {"negative_tags": []}).get("negative_tags", []) +
+        processed_results.get("dmarc", {"negative_tags": []}).get("negative_tags", []) +
+        processed_results.get("dkim", {"negative_tags": []}).get("negative_tags", [])
+    )
+
+    patch = {
+        "latestDnsScan": entry.dns_entry["_id"],
+        "latestMxHosts": mx_hosts(processed_results.get("mx_records")),
+        "status": status,
+        "dmarcLocation": processed_results.get("dmarc").get("location"),
+        "phase": processed_results.get("dmarc").get("phase"),
+        "wildcardSibling": processed_results.get("wildcard_sibling"),
+        "wildcardEntry": processed_results.get("wildcard_entry"),
+        "rcode": processed_results.get("rcode", None),
+        "hasCyberRua": processed_results.get("dmarc").get("has_cyber_rua"),
+        "negativeTags": {"dns": dns_negative_tags},
+        "webScanPending": True,
+    }
+
+    # If we have no public IPs, we can't do web scans. Set all web statuses to info
+    all_ips_private = all(is_private_ip for _, is_private_ip in entry.web_scan_ips)
+    if not scan_results.get("resolve_ips", None) or all_ips_private:
+        patch.update({"webScanPending": False, "blocked": False})
+        status.update(
+            {
+                "https": "info",
+                "ssl": "info",
+                "certificates": "info",
+                "ciphers": "info",
+                "curves": "info",
+                "hsts": "info",
+                "policy": "info",
+                "protocols": "info",
+            }
+        )
+
+    return patch
+
+
+async def update_monitor_only_claims(domain, processed_results, msg):
+    try:
+        # Use resolve chain instead of CNAME as some domains have CNAMEs that point to other CNAMEs before reaching the final target domain
+        is_cname_target_in_monitor_only_list = is_cname_target(
+            resolve_chain=processed_results.get("resolve_chain", []),
+            domains=CNAME_MONITOR_ONLY_LIST,
+        )
+
+        if not is_cname_target_in_monitor_only_list:
+            return
+
+        # Get current claim asset states of domain
+        approved_state_claims = await db.aql(
+            """
+                FOR v, e IN 1..1 INBOUND @domain_id claims
+                    FILTER v.verified == true
+                    FILTER e.assetState == "approved"
+                    RETURN e
+            """,
+            bind_vars={"domain_id": domain["_id"]},
+        )
+        if len(approved_state_claims) == 0:
+            logger.debug(
+                f"No approved claims for domain with CNAME in monitor-only list for received message: {msg}"
             )
-            db.collection("domainsWeb").insert(
-                {
-                    "_from": domain["_id"],
-                    "timestamp": processed_results["timestamp"],
-                    "_to": web_entry["_id"],
+            return
+
+        for claim in approved_state_claims:
+            try:
+                logger.info(f"Domain with CNAME in monitor-only list has approved claim, updating claim state to monitor-only for claim: {claim}")
+                claim["assetState"] = "monitor-only"
+                await db.update("claims", claim)
+
+                insert_activity = {
+                    "timestamp": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[
+                                     :-3
+                                 ]
+                                 + "Z",
+                    "initiatedBy": {
+                        "id": "dns-processor",
+                        "userName": SERVICE_ACCOUNT_EMAIL,
+                        "role": "service",
+                    },
+                    "target": {
+                        "resource": domain["domain"],
+                        "updatedProperties": [
+                            {
+                                "name": "assetState",
+                                "oldValue": "approved",
+                                "newValue": "monitor-only",
+                            }
+                        ],
+                        "organization": {"id": claim["_from"].split("/")[1]},
+                        "resourceType": "domain",
+                    },
+                    "action": "update",
+                    "reason": None,
                 }
-            )
+                await db.insert("auditLogs", insert_activity)
 
-            if domain.get("status", None) is None:
-                domain.update(
-                    {
-                        "status": {
-                            "certificates": "info",
-                            "ciphers": "info",
-                            "curves": "info",
-                            "dkim": "info",
-                            "dmarc": "info",
-                            "hsts": "info",
-                            "https": "info",
-                            "protocols": "info",
-                            "spf": "info",
-                            "ssl": "info",
-                        }
-                    }
+            except Exception as e:
+                logger.error(
+                    f"Error while processing claim with approved state for domain with CNAME in monitor-only list for received message: {msg}: {str(e)}"
                 )
+                continue
+
+    except Exception as e:
+        logger.error(
+            f"Error while parsing CNAME record for received message: {msg}: {str(e)}"
+        )
+
+
+def build_web_doc(entry):
+    # Counted down by the web processor, which updates the domain once every scan is in
+    pending_scans = sum(1 for _, is_private_ip in entry.web_scan_ips if not is_private_ip)
+    web_doc = {
+        "timestamp": str(datetime.datetime.now().astimezone()),
+        "domain": entry.processed_results["domain"],
+        "pendingScans": pending_scans,
+    }
+    if pending_scans > 0:
+        # Swept by the web processor if some of the scans never come back
+        web_doc["pendingSince"] = datetime.datetime.now().timestamp()
+    return web_doc
+
 
-            if "dmarcLocation" not in domain.keys():
-                domain.update({"dmarcLocation": dmarc_location})
-            elif domain.get("dmarcLocation", None) != dmarc_location:
-                domain.update({"dmarcLocation": dmarc_location})
-
-            for key, val in {
-                "dmarc": dmarc_status,
-                "spf": spf_status,
-                "dkim": dkim_status,
-            }.items():
-                domain["status"][key] = val
-
-            dmarc_phase = processed_results.get("dmarc").get("phase")
-            wildcard_sibling = processed_results.get("wildcard_sibling")
-            wildcard_entry = processed_results.get("wildcard_entry")
-
-            domain.update({"phase": dmarc_phase})
-            domain.update({"wildcardSibling": wildcard_sibling})
-            domain.update({"wildcardEntry": wildcard_entry})
-            domain.update({"rcode": rcode})
-            domain.update(
-                {"hasCyberRua": processed_results.get("dmarc").get("has_cyber_rua")}
+async def prepare_entry(entry):
+    payload = entry.payload
+    scan_results = payload.get("results")
+
+    scan_results["sends_email"] = entry.domain.get("sendsEmail", "unknown")
+
+    processed_results = process_results(scan_results)
+    try:
+        if processed_results.get("mx_records") is not None:
+            mx_record_diff = await check_mx_diff(
+                processed_results=processed_results,
+                domain=entry.domain,
             )
+            processed_results["mx_records"].update({"diff": mx_record_diff})
+    except Exception as e:
+        logger.error(f"Checking MX diff for received message {entry.msg}: {str(e)}")
+
+    entry.processed_results = processed_results
 
-            dns_negative_tags = (
-                processed_results.get("spf", {"negative_tags": []}).get("negative_tags", []) +
-                processed_results.get("dmarc", {"negative_tags": []}).get("negative_tags", []) +
-                processed_results.get("dkim", {"negative_tags": []}).get("negative_tags", [])
+    for ip in scan_results.get("resolve_ips", []) or []:
+        try:
+            is_private_ip = ipaddress.ip_address(ip).is_private
+        except ValueError:
+            logger.error(
+                f"Invalid IP address: {ip} for received message: {entry.msg}"
             )
-            domain.update({"negativeTags": {"dns": dns_negative_tags}})
+            continue
+        entry.web_scan_ips.append((ip, is_private_ip))
+
+
+async def process_batch(msgs):
+    """
+    Process a batch of DNS scan results, writing each collection with a single
+    bulk request for the whole batch.
+
+    Returns a list aligned with msgs. Each element is a tuple of the web scan
+    requests and the domain status change (or None) to publish for that
+    message, or None if the message could not be stored and must not be
+    acknowledged.
+    """
+    entries = []
+    for msg in msgs:
+        logger.info(
+            f"Received a message on '{msg.subject} {msg.reply}': {msg.data.decode()}"
+        )
+        entries.append(BatchEntry(msg=msg, payload=json.loads(msg.data)))
 
-            domain.update({"webScanPending": True})
+    domain_keys = {entry.payload.get("domain_key") for entry in entries}
+    try:
+        domains = {
+            domain["_key"]: domain
+            for domain in await db.get_many("domains", list(domain_keys))
+        }
+    except Exception as e:
+        logger.error(f"Error while fetching domains for batch of {len(msgs)} messages: {str(e)}")
+        return [None] * len(msgs)
 
-            all_ips_private = True
+    for entry in entries:
+        domain = domains.get(entry.payload.get("domain_key"))
+        if domain is None:
+            logger.error(
+                f"Error while fetching domain for received message: {entry.msg}: domain not found"
+            )
+            entry.failed = True
+            continue
+        # Copy so that several scans of the same domain in one batch do not share state
+        entry.domain = copy.deepcopy(domain)
+        try:
+            await prepare_entry(entry)
+        except Exception as e:
+            entry.fail(f"{str(e)} \n\nFull traceback: {traceback.format_exc()}")
 
-            for ip in scan_results.get("resolve_ips", []) or []:
-                try:
-                    is_private_ip = ipaddress.ip_address(ip).is_private
-                except ValueError:
-                    logger.error(
-                        f"Invalid IP address: {ip} for received message: {msg}"
-                    )
-                    continue
+    # Results for user initiated scans are processed but not stored
+    for entry in entries:
+        if entry.payload.get("user_key") is not None:
+            entry.failed = True
 
-                all_ips_private = all_ips_private and is_private_ip
+    dns_entries = await bulk_insert(
+        "dns", entries, lambda entry: [snake_to_camel(entry.processed_results)]
+    )
+    web_entries = await bulk_insert(
+        "web",
+        entries,
+        lambda entry: [build_web_doc(entry)],
+    )
+    for entry, dns_entry, web_entry in zip(entries, dns_entries, web_entries):
+        if not entry.failed:
+            entry.dns_entry = dns_entry[0]
+            entry.web_entry = web_entry[0]
+
+    await bulk_insert(
+        "domainsDNS",
+        entries,
+        lambda entry: [
+            {
+                "_from": entry.domain["_id"],
+                "timestamp": entry.processed_results["timestamp"],
+                "_to": entry.dns_entry["_id"],
+            }
+        ],
+    )
+    await bulk_insert(
+        "domainsWeb",
+        entries,
+        lambda entry: [
+            {
+                "_from": entry.domain["_id"],
+                "timestamp": entry.processed_results["timestamp"],
+                "_to": entry.web_entry["_id"],
+            }
+        ],
+    )
 
-                web_scan_status = "pending" if not is_private_ip else "complete"
+    web_scans = await bulk_insert(
+        "webScan",
+        entries,
+        lambda entry: [
+            {
+                "status": "pending" if not is_private_ip else "complete",
+                "ipAddress": ip,
+                "isPrivateIp": is_private_ip,
+            }
+            for ip, is_private_ip in entry.web_scan_ips
+        ],
+    )
+    for entry, entry_web_scans in zip(entries, web_scans):
+        entry.web_scans = entry_web_scans
+
+    await bulk_insert(
+        "webToWebScans",
+        entries,
+        lambda entry: [
+            {
+                "_from": entry.web_entry["_id"],
+                "_to": web_scan["_id"],
+            }
+            for web_scan in entry.web_scans
+        ],
+    )
 
-                web_scan = db.collection("webScan").insert(
-                    {
-                        "status": web_scan_status,
-                        "ipAddress": ip,
-                        "isPrivateIp": is_private_ip,
-                    }
-                )
-                db.collection("webToWebScans").insert(
+    for entry in entries:
+        if entry.failed:
+            continue
+        for (ip, is_private_ip), web_scan in zip(entry.web_scan_ips, entry.web_scans):
+            if not is_private_ip:
+                entry.formatted_scan_data_array.append(
                     {
-                        "_from": web_entry["_id"],
-                        "_to": web_scan["_id"],
+                        "user_key": entry.payload.get("user_key"),
+                        "domain": entry.domain["domain"],
+                        "domain_key": entry.payload.get("domain_key"),
+                        "shared_id": entry.payload.get("shared_id"),
+                        "ip_address": ip,
+                        "web_scan_key": web_scan["_key"],
                     }
                 )
+        try:
+            entry.previous_snapshot = summary_snapshot(entry.domain)
+            entry.domain_patch = build_domain_patch(entry)
+            # Keep the local copy in step with the stored domain for the status change
+            merge_patch(entry.domain, entry.domain_patch)
+        except Exception as e:
+            entry.fail(f"{str(e)} \n\nFull traceback: {traceback.format_exc()}")
 
-                if not is_private_ip:
-                    formatted_scan_data_array.append(
-                        {
-                            "user_key": user_key,
-                            "domain": domain["domain"],
-                            "domain_key": domain_key,
-                            "shared_id": shared_id,
-                            "ip_address": ip,
-                            "web_scan_key": web_scan["_key"],
-                        }
-                    )
-
-            # If we have no IPs, we can't do web scans. Set all web statuses to info
-            if not scan_results.get("resolve_ips", None) or all_ips_private:
-                domain.update({"webScanPending": False})
-                domain.update({"blocked": False})
-                domain["status"].update(
-                    {
-                        "https": "info",
-                        "ssl": "info",
-                        "certificates": "info",
-                        "ciphers": "info",
-                        "curves": "info",
-                        "hsts": "info",
-                        "policy": "info",
-                        "protocols": "info",
-                    }
-                )
+    await bulk_update_domains(entries)
 
-            del domain["_rev"]
-            try:
-                db.collection("domains").update(domain)
-            except DocumentUpdateError as e:
-                error_str = str(e)
-                start_retry = time.monotonic()
-                document_updated = False
-                # Retry for 5 seconds in case another process is updating the same document
-                while time.monotonic() - start_retry < 5:
-                    try:
-                        db.collection("domains").update(domain)
-                        document_updated = True
-                        break
-                    except DocumentUpdateError as while_e:
-                        time.sleep(0.1)
-                        error_str = str(while_e)
-                        continue
-                if not document_updated:
-                    logger.error(
-                        f"Error while updating domain after retrying for received message: {msg}: {error_str}"
-                    )
-
-            if processed_results.get("cname_record") is not None and CNAME_MONITOR_ONLY_LIST:
-                try:
-                    # Use resolve chain instead of CNAME as some domains have CNAMEs that point to other CNAMEs before reaching the final target domain
-                    is_cname_target_in_monitor_only_list = is_cname_target(
-                        resolve_chain=processed_results.get("resolve_chain", []),
-                        domains=CNAME_MONITOR_ONLY_LIST,
-                    )
-
-                    if is_cname_target_in_monitor_only_list:
-                        # Get current claim asset states of domain
-                        approved_state_claims_cursor = db.aql.execute(
-                            """
-                                FOR v, e IN 1..1 INBOUND @domain_id claims
-                                    FILTER v.verified == true
-                                    FILTER e.assetState == "approved"
-                                    RETURN e
-                            """,
-                            bind_vars={"domain_id": domain["_id"]},
-                        )
-                        if approved_state_claims_cursor.empty():
-                            logger.debug(
-                                f"No approved claims for domain with CNAME in monitor-only list for received message: {msg}"
-                            )
-                        else:
-                            approved_state_claims = [claim for claim in approved_state_claims_cursor]
-                            for claim in approved_state_claims:
-                                try:
-                                    logger.info(f"Domain with CNAME in monitor-only list has approved claim, updating claim state to monitor-only for claim: {claim}")
-                                    claim["assetState"] = "monitor-only"
-                                    db.collection("claims").update(claim)
-
-                                    insert_activity = {
-                                        "timestamp": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[
-                                                         :-3
-                                                     ]
-                                                     + "Z",
-                                        "initiatedBy": {
-                                            "id": "dns-processor",
-                                            "userName": SERVICE_ACCOUNT_EMAIL,
-                                            "role": "service",
-                                        },
-                                        "target": {
-                                            "resource": domain["domain"],
-                                            "updatedProperties": [
-                                                {
-                                                    "name": "assetState",
-                                                    "oldValue": "approved",
-                                                    "newValue": "monitor-only",
-                                                }
-                                            ],
-                                            "organization": {"id": claim["_from"].split("/")[1]},
-                                            "resourceType": "domain",
-                                        },
-                                        "action": "update",
-                                        "reason": None,
-                                    }
-                                    db.collection("auditLogs").insert(insert_activity)
-
-                                except Exception as e:
-                                    logger.error(
-                                        f"Error while processing claim with approved state for domain with CNAME in monitor-only list for received message: {msg}: {str(e)}"
-                                    )
-                                    continue
-
-                except Exception as e:
-                    logger.error(
-                        f"Error while parsing CNAME record for received message: {msg}: {str(e)}"
-                    )
+    if PUBLISH_STATUS_CHANGES:
+        await add_status_changes(entries)
 
-        except Exception as e:
-            logger.error(
-                f"Error while inserting processed results for received message: {msg}: {str(e)} \n\nFull traceback: {traceback.format_exc()}"
-            )
-            return
+    results = []
+    for entry in entries:
+        if entry.failed:
+            results.append(None)
+            continue
+
+        if entry.processed_results.get("cname_record") is not None and CNAME_MONITOR_ONLY_LIST:
+            await update_monitor_only_claims(entry.domain, entry.processed_results, entry.msg)
 
         logger.info(
-            f"DNS Scans inserted into database: {json.dumps(processed_results)}"
+            f"DNS Scans inserted into database: {json.dumps(entry.processed_results)}"
         )
+        results.append((entry.formatted_scan_data_array, entry.status_change))
 
-        return formatted_scan_data_array
+    return results
 
 
 async def run():
@@ -477,6 +752,8 @@ async def run():
 
     context = Context()
 
+    await db.connect()
+
     async def error_cb(error):
         logger.error(f"Uncaught error in callback: {error}")
 
@@ -521,102 +798,133 @@ async def run():
             lambda: asyncio.create_task(ask_exit(signal_name)),
         )
 
-    async def handle_finished_scan(fut, original_msg, semaphore):
-        try:
-            await fut
-            res = fut.result()
-            if isinstance(res, Exception):
+    async def log_pool_stats():
+        while not context.should_exit:
+            await asyncio.sleep(DB_POOL_STATS_INTERVAL)
+            logger.info(f"Database connection pool statistics: {db.pool_stats()}")
+
+    loop.create_task(log_pool_stats())
+
+    async def publish_results(scan_data_array, status_change, original_msg):
+        logger.debug(f"Scan data array: {scan_data_array}")
+        for scan_data in scan_data_array:
+            logger.debug(f"Publishing results: {scan_data}")
+            try:
+                original_headers = original_msg.headers
+                subject = "scans.dns_processor_results"
+                if original_headers.get("priority") == "high":
+                    subject = "scans.dns_processor_results_priority"
+                await js.publish(
+                    stream="SCANS",
+                    subject=subject,
+                    payload=json.dumps(scan_data).encode(),
+                    headers=original_headers,
+                )
+            except TimeoutError as e:
                 logger.error(
-                    f"Uncaught scan error for received message: {original_msg}: {res}"
+                    f"Timeout while publishing results: {scan_data}: for received message: {original_msg}: {e} \n\nFull traceback: {traceback.format_exc()}"
                 )
                 return
 
-            scan_data_array = res
-            logger.debug(f"Scan data array: {scan_data_array}")
-            for scan_data in scan_data_array:
-                logger.debug(f"Publishing results: {scan_data}")
-                try:
-                    original_headers = original_msg.headers
-                    subject = "scans.dns_processor_results"
-                    if original_headers.get("priority") == "high":
-                        subject = "scans.dns_processor_results_priority"
-                    await js.publish(
-                        stream="SCANS",
-                        subject=subject,
-                        payload=json.dumps(scan_data).encode(),
-                        headers=original_headers,
-                    )
-                except TimeoutError as e:
-                    logger.error(
-                        f"Timeout while publishing results: {scan_data}: for received message: {original_msg}: {e} \n\nFull traceback: {traceback.format_exc()}"
-                    )
-                    return
+        if status_change is not None:
+            try:
+                await js.publish(
+                    stream="SCANS",
+                    subject=STATUS_CHANGE_SUBJECT,
+                    payload=json.dumps(status_change).encode(),
+                    headers={
+                        "Nats-Msg-Id": status_change_msg_id(status_change, original_msg)
+                    },
+                )
+            except Exception as e:
+                # Summaries are recomputed daily, a missed change must not block the scan
+                logger.error(
+                    f"Error while publishing status change: {status_change}: for received message: {original_msg}: {e}"
+                )
+
+        try:
+            logger.debug(f"Acknowledging message: {original_msg}")
+            await original_msg.ack()
+        except Exception as e:
+            logger.error(
+                f"Error while acknowledging message for received message: {original_msg}: {e}"
+            )
 
+    async def handle_batch(original_msgs, semaphore):
+        try:
             try:
-                logger.debug(f"Acknowledging message: {original_msg}")
-                await original_msg.ack()
+                res = await process_batch(original_msgs)
             except Exception as e:
                 logger.error(
-                    f"Error while acknowledging message for received message: {original_msg}: {e}"
+                    f"Uncaught scan error for received messages: {original_msgs}: {e}"
                 )
+                return
+
+            # Messages are only acknowledged once the batch has been written
+            for original_msg, result in zip(original_msgs, res):
+                if result is None:
+                    continue
+                scan_data_array, status_change = result
+                await publish_results(scan_data_array, status_change, original_msg)
         finally:
             logger.debug("Releasing semaphore...")
             try:
                 semaphore.release()
             except Exception as e:
                 logger.error(
-                    f"Error while releasing semaphore for received message: {original_msg}: {e}"
+                    f"Error while releasing semaphore for received messages: {original_msgs}: {e}"
                 )
 
-    sem = asyncio.BoundedSemaphore(SCAN_THREAD_COUNT)
+    sem = asyncio.BoundedSemaphore(MAX_IN_FLIGHT_BATCHES)
+    # Keep references to running batches so they are not garbage collected
+    tasks = set()
 
-    with ThreadPoolExecutor() as executor:
-        while True:
-            if context.should_exit:
-                break
-            if nc.is_closed:
-                logger.error("Connection to NATS is closed.")
-                break
+    while True:
+        if context.should_exit:
+            break
+        if nc.is_closed:
+            logger.error("Connection to NATS is closed.")
+            break
 
-            await sem.acquire()
+        await sem.acquire()
 
-            if context.should_exit:
-                break
-            if nc.is_closed:
-                logger.error("Connection to NATS is closed.")
-                break
+        if context.should_exit:
+            break
+        if nc.is_closed:
+            logger.error("Connection to NATS is closed.")
+            break
 
+        try:
+            logger.debug("Fetching messages...")
+            msgs = await context.sub.fetch(batch=PROCESS_BATCH_SIZE, timeout=1)
+            logger.debug(f"Received {len(msgs)} messages: {msgs}")
+        except NatsTimeoutError:
+            logger.debug("No messages available...")
             try:
-                logger.debug("Fetching message...")
-                msgs = await context.sub.fetch(batch=1, timeout=1)
-                msg = msgs[0]
-                logger.debug(f"Received message: {msg}")
-            except NatsTimeoutError:
-                logger.debug("No messages available...")
-                try:
-                    sem.release()
-                except Exception as e:
-                    logger.error(
-                        f"Error while releasing semaphore for received message: {msg}: {e}"
-                    )
-                continue
+                sem.release()
+            except Exception as e:
+                logger.error(f"Error while releasing semaphore: {e}")
+            continue
 
+        try:
+            task = loop.create_task(handle_batch(original_msgs=msgs, semaphore=sem))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        except Exception as e:
+            logger.error(f"Error while queueing scans, releasing semaphore: {e}")
             try:
-                future = loop.run_in_executor(executor, process_msg, msg)
-                loop.create_task(
-                    handle_finished_scan(fut=future, original_msg=msg, semaphore=sem)
-                )
+                sem.release()
             except Exception as e:
-                logger.error(f"Error while queueing scan, releasing semaphore: {e}")
-                try:
-                    sem.release()
-                except Exception as e:
-                    logger.error(
-                        f"Error while releasing semaphore for received message: {msg}: {e}"
-                    )
+                logger.error(
+                    f"Error while releasing semaphore for received messages: {msgs}: {e}"
+                )
 
     logger.info("Service is shutting down...")
 
+    if tasks:
+        await asyncio.wait(tasks)
+    await db.close()
+
     await nc.flush()
     logger.info("Flushed NATS connection")
     await nc.close()
@@ -0,0 +1,51 @@
+import logging
+import os
+
+import dns.asyncresolver
+import dns.resolver
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = int(os.getenv("SCAN_TIMEOUT", "20"))
+DNS_CACHE_MAX_SIZE = int(os.getenv("DNS_CACHE_MAX_SIZE", "100000"))
+
+# Answers are shared by every resolver in the process. Entries expire with the TTL of the
+# answer, and the least recently used entries are evicted once the cache is full.
+answer_cache = dns.resolver.LRUCache(max_size=DNS_CACHE_MAX_SIZE)
+
+# Lookups made through the module level helpers (dns.resolver.resolve, dkimpy) use the default resolver
+dns.resolver.get_default_resolver().cache = answer_cache
+
+
+def build_resolver(resolver_class=None):
+    """
+    Create a resolver using the shared answer cache
+    :param resolver_class: dns.resolver.Resolver (default) or dns.asyncresolver.Resolver
+    :return: The configured resolver
+    """
+    if resolver_class is None:
+        resolver_class = dns.resolver.Resolver
+    resolver = resolver_class()
+    resolver.timeout = TIMEOUT
+    resolver.lifetime = TIMEOUT * 2
+    resolver.cache = answer_cache
+    return resolver
+
+
+def build_async_resolver():
+    return build_resolver(resolver_class=dns.asyncresolver.Resolver)
+
+
+def get_cache_stats():
+    """
+    Get the hit/miss counters of the shared answer cache
+    :return: Dict with hits, misses, hit_ratio and size
+    """
+    statistics = answer_cache.get_statistics_snapshot()
+    lookups = statistics.hits + statistics.misses
+    return {
+        "hits": statistics.hits,
+        "misses": statistics.misses,
+        "hit_ratio": round(statistics.hits / lookups, 3) if lookups else None,
+        "size": len(answer_cache.data),
+    }
@@ -1,3 +1,4 @@
+import asyncio
 from functools import lru_cache
 
 from dataclasses import dataclass
@@ -6,14 +7,22 @@ import re
 import os
 import logging
 
+import dns.asyncquery
 import dns.resolver
 import dns.name
 from dns.resolver import NXDOMAIN, NoAnswer, NoNameservers, Resolver, Answer
 from dns.exception import Timeout
 
+from dns_scanner.dns_cache import build_async_resolver, build_resolver
 from dns_scanner.email_scanners import DKIMScanner, DMARCScanner
+from dns_scanner.zone_cache import (
+    is_known_zone_apex,
+    remember_zone_apex,
+    zone_apex_from_negative_answer,
+)
 from dns_scanner.ns_registrar import (
     check_ns_delegations,
+    check_ns_delegations_async,
     get_registrar_context,
     build_registrar_context,
 )
@@ -47,6 +56,15 @@ class DNSScanResult:
     wildcard_entry: bool = None
 
 
+def apex_from_negative_answer(domain, name, error):
+    zone_apex = zone_apex_from_negative_answer(name, error)
+    if zone_apex is None:
+        return None
+    logger.debug(f"Found SOA for {domain} at {zone_apex} in negative answer at {name}")
+    remember_zone_apex(zone_apex)
+    return str(zone_apex).rstrip(".")
+
+
 def find_zone_apex(domain, resolver=None):
     try:
         if resolver is None:
@@ -56,17 +74,32 @@ def find_zone_apex(domain, resolver=None):
 
         # Walk up the domain hierarchy
         while name != dns.name.root:
+            if is_known_zone_apex(name):
+                logger.debug(f"Using known zone apex for {domain}: {name}")
+                return str(name).rstrip(".")
+
             logger.debug(f"Checking for SOA at {name}")
             try:
                 answers = resolver.resolve(name, "SOA")
                 logger.debug(f"Found SOA for {domain} at {name}: {answers[0]}")
+                remember_zone_apex(name)
                 zone_apex = str(name).rstrip(".")
                 return zone_apex
-            except NoAnswer:
+            except NoAnswer as e:
+                zone_apex = apex_from_negative_answer(domain, name, e)
+                if zone_apex is not None:
+                    return zone_apex
                 # Go up one level
                 logger.debug(f"No SOA found at {name}, moving to parent")
                 name = name.parent()
-            except (NXDOMAIN, NoNameservers) as e:
+            except NXDOMAIN as e:
+                zone_apex = apex_from_negative_answer(domain, name, e)
+                if zone_apex is not None:
+                    return zone_apex
+                # Go up one level
+                logger.debug(f"Domain does not exist at {name}: {e}, moving to parent")
+                name = name.parent()
+            except NoNameservers as e:
                 # Go up one level
                 logger.debug(f"Domain does not exist at {name}: {e}, moving to parent")
                 name = name.parent()
@@ -201,47 +234,41 @@ def get_wildcard_status(domain: str, resolver: Resolver, a_records: Answer):
     return result
 
 
-def scan_domain(domain, dkim_selectors=None):
-    """
-    Scan a domain for DNS records
-    :param str domain: Name of domain to scan
-    :param list[str] dkim_selectors: Array of DKIM selectors
-    :return: The results from the domain scan
-    :rtype: dict
-    """
-
-    if dkim_selectors is None:
-        dkim_selectors = []
+EXISTENCE_QUERY_TYPES = [
+    dns.rdatatype.A,
+    dns.rdatatype.CNAME,
+    dns.rdatatype.SOA,
+    dns.rdatatype.NS,
+]
 
-    scan_result = DNSScanResult(domain)
 
-    # Check if domain exists
+def classify_return_types(domain, rtypes):
+    """
+    Collect the return types of the existence checks, stopping at the first NOERROR
+    :param str domain: Name of domain being scanned
+    :param rtypes: Iterable of return types, in the order of EXISTENCE_QUERY_TYPES
+    :return: The return types considered
+    :rtype: list
+    """
     dns_answer_return_types = []
-    for query_type in [
-        dns.rdatatype.A,
-        dns.rdatatype.CNAME,
-        dns.rdatatype.SOA,
-        dns.rdatatype.NS,
-    ]:
-        rtype = get_dns_return_type(domain, query_type)
+    for rtype in rtypes:
         if rtype == "NOERROR":
             dns_answer_return_types.append(rtype)
             break
         elif rtype is None:
             dns_answer_return_types.append(None)
             continue
-        elif rtype == "NXDOMAIN":
-            scan_result.rcode = rtype
-            scan_result.record_exists = False
-            dns_answer_return_types.append(rtype)
-        elif rtype == "SERVFAIL":
+        elif rtype in ["NXDOMAIN", "SERVFAIL"]:
             dns_answer_return_types.append(rtype)
         else:
             logger.error(
                 f"Unknown return type '{rtype}' when checking if domain '{domain}' exists"
             )
             dns_answer_return_types.append(rtype)
+    return dns_answer_return_types
+
 
+def set_record_exists(scan_result, dns_answer_return_types):
     if "NOERROR" not in dns_answer_return_types:
         if "SERVFAIL" in dns_answer_return_types:
             scan_result.rcode = "SERVFAIL"
@@ -252,14 +279,91 @@ def scan_domain(domain, dkim_selectors=None):
         else:
             scan_result.rcode = None
         scan_result.record_exists = False
-        return scan_result.__dict__
+        return False
 
     scan_result.rcode = "NOERROR"
     scan_result.record_exists = True
+    return True
+
+
+def get_zone_dnssec_enabled(domain, zone_apex):
+    if not zone_apex:
+        logger.debug(f"Skipping DNSSEC check for {domain} - No zone apex found")
+        return None
+    if not DNSSEC_NAMESERVER_IP or not DNSSEC_NAMESERVER_HOSTNAME:
+        logger.debug(
+            f"Skipping DNSSEC check for {domain} - DNSSEC nameserver environment variables not set"
+        )
+        return None
+    return dnssec_check_with_ttl(
+        domain=zone_apex,
+        nameserver_ip=DNSSEC_NAMESERVER_IP,
+        nameserver_hostname=DNSSEC_NAMESERVER_HOSTNAME,
+    )
+
+
+def get_scan_registrar_context(scan_result, domain, zone_apex):
+    registrar_domain = scan_result.base_domain or zone_apex or domain
+    if ENABLE_RDAP_LOOKUP:
+        return get_registrar_context(
+            base_domain=registrar_domain,
+            ns_hosts=scan_result.ns_delegations.get("ns_hosts", []),
+        )
+    return build_registrar_context(
+        base_domain=registrar_domain,
+        error="rdap_lookup_disabled",
+    )
+
+
+def get_cname_mx_records(scan_result):
+    """
+    If no MX records are found (with warnings), but there are CNAME records, check the CNAME target for MX records
+    :return: The MX records of the CNAME target, or None if they should not be used
+    """
+    if (
+        len(scan_result.mx_records.get("hosts", [])) == 0
+        and len(scan_result.mx_records.get("warnings", [])) > 0
+        and scan_result.cname_record is not None
+    ):
+        cname_target_domain = scan_result.cname_record.split()[-1].strip(".")
+        cname_scan_results = DMARCScanner(cname_target_domain).run()
+        cname_mx_records = cname_scan_results.get("mx", {})
+
+        if (
+            len(cname_mx_records.get("hosts", [])) > 0
+            and len(cname_mx_records.get("warnings", [])) == 0
+        ):
+            return cname_mx_records
+    return None
+
+
+def scan_domain(domain, dkim_selectors=None):
+    """
+    Scan a domain for DNS records
+    :param str domain: Name of domain to scan
+    :param list[str] dkim_selectors: Array of DKIM selectors
+    :return: The results from the domain scan
+    :rtype: dict
+    """
+
+    if dkim_selectors is None:
+        dkim_selectors = []
 
-    resolver = dns.resolver.Resolver()
-    resolver.timeout = TIMEOUT
-    resolver.lifetime = TIMEOUT * 2
+    scan_result = DNSScanResult(domain)
+
+    # Check if domain exists
+    dns_answer_return_types = classify_return_types(
+        domain,
+        (
+            get_dns_return_type(domain, query_type)
+            for query_type in EXISTENCE_QUERY_TYPES
+        ),
+    )
+
+    if not set_record_exists(scan_result, dns_answer_return_types):
+        return scan_result.__dict__
+
+    resolver = build_resolver()
 
     # Get chaining results (A and CNAME records)
     try:
@@ -301,22 +405,7 @@ def scan_domain(domain, dkim_selectors=None):
     zone_apex = find_zone_apex(domain)
     scan_result.zone_apex = zone_apex
 
-    if not zone_apex:
-        logger.debug(f"Skipping DNSSEC check for {domain} - No zone apex found")
-        zone_dnssec_enabled = None
-    elif not DNSSEC_NAMESERVER_IP or not DNSSEC_NAMESERVER_HOSTNAME:
-        logger.debug(
-            f"Skipping DNSSEC check for {domain} - DNSSEC nameserver environment variables not set"
-        )
-        zone_dnssec_enabled = None
-    else:
-        zone_dnssec_enabled = dnssec_check_with_ttl(
-            domain=zone_apex,
-            nameserver_ip=DNSSEC_NAMESERVER_IP,
-            nameserver_hostname=DNSSEC_NAMESERVER_HOSTNAME,
-        )
-
-    scan_result.zone_dnssec_enabled = zone_dnssec_enabled
+    scan_result.zone_dnssec_enabled = get_zone_dnssec_enabled(domain, zone_apex)
 
     # Run DMARC scan
     dmarc_start_time = time.monotonic()
@@ -336,33 +425,13 @@ def scan_domain(domain, dkim_selectors=None):
         domain=domain, zone_apex=zone_apex, ns_records=ns_records
     )
 
-    registrar_domain = scan_result.base_domain or zone_apex or domain
-    if ENABLE_RDAP_LOOKUP:
-        scan_result.registrar_context = get_registrar_context(
-            base_domain=registrar_domain,
-            ns_hosts=scan_result.ns_delegations.get("ns_hosts", []),
-        )
-    else:
-        scan_result.registrar_context = build_registrar_context(
-            base_domain=registrar_domain,
-            error="rdap_lookup_disabled",
-        )
-
-    # If no MX records are found (with warnings), but there are CNAME records, check the CNAME target for MX records
-    if (
-        len(scan_result.mx_records.get("hosts", [])) == 0
-        and len(scan_result.mx_records.get("warnings", [])) > 0
-        and scan_result.cname_record is not None
-    ):
-        cname_target_domain = scan_result.cname_record.split()[-1].strip(".")
-        cname_scan_results = DMARCScanner(cname_target_domain).run()
-        cname_mx_records = cname_scan_results.get("mx", {})
+    scan_result.registrar_context = get_scan_registrar_context(
+        scan_result, domain, zone_apex
+    )
 
-        if (
-            len(cname_mx_records.get("hosts", [])) > 0
-            and len(cname_mx_records.get("warnings", [])) == 0
-        ):
-            scan_result.mx_records = cname_mx_records
+    cname_mx_records = get_cname_mx_records(scan_result)
+    if cname_mx_records is not None:
+        scan_result.mx_records = cname_mx_records
 
     try:
         # Run DKIM scan
@@ -377,3 +446,261 @@ def scan_domain(domain, dkim_selectors=None):
     logger.info(f"DNS results for '{domain}': {scan_result.__dict__}")
 
     return scan_result.__dict__
+
+
+async def find_zone_apex_async(domain, resolver):
+    try:
+        name = dns.name.from_text(domain)
+
+        # Walk up the domain hierarchy
+        while name != dns.name.root:
+            if is_known_zone_apex(name):
+                logger.debug(f"Using known zone apex for {domain}: {name}")
+                return str(name).rstrip(".")
+
+            logger.debug(f"Checking for SOA at {name}")
+            try:
+                answers = await resolver.resolve(name, "SOA")
+                logger.debug(f"Found SOA for {domain} at {name}: {answers[0]}")
+                remember_zone_apex(name)
+                return str(name).rstrip(".")
+            except NoAnswer as e:
+                zone_apex = apex_from_negative_answer(domain, name, e)
+                if zone_apex is not None:
+                    return zone_apex
+                logger.debug(f"No SOA found at {name}, moving to parent")
+            except NXDOMAIN as e:
+                zone_apex = apex_from_negative_answer(domain, name, e)
+                if zone_apex is not None:
+                    return zone_apex
+                logger.debug(f"Domain does not exist at {name}: {e}, moving to parent")
+            except NoNameservers as e:
+                logger.debug(f"Domain does not exist at {name}: {e}, moving to parent")
+            except Timeout as e:
+                logger.error(f"Timeout while checking SOA at {name}: {e}")
+            except Exception as e:
+                logger.error(f"Error checking SOA at {name}: {e}")
+            name = name.parent()
+
+        return None
+    except Exception as e:
+        logger.error(f"Error in find_zone_apex_async for {domain}: {e}")
+        return None
+
+
+async def get_dns_return_type_async(domain, query_type):
+    try:
+        default_resolver = dns.resolver.get_default_resolver()
+        query = dns.message.make_query(domain, query_type)
+        exist_response = (
+            await dns.asyncquery.udp_with_fallback(
+                q=query,
+                timeout=TIMEOUT,
+                where=default_resolver.nameservers[0],
+                port=default_resolver.port,
+            )
+        )[0]
+        return dns.rcode.to_text(exist_response.rcode())
+    except Timeout as e:
+        logger.error(
+            f"Timeout while checking if domain '{domain}' exists with query type '{dns.rdatatype.to_text(query_type)}': {e}"
+        )
+        return None
+    except Exception as e:
+        logger.error(
+            f"Error while checking if domain '{domain}' exists with query type '{dns.rdatatype.to_text(query_type)}': {e}"
+        )
+        return None
+
+
+async def get_wildcard_status_async(domain: str, resolver, a_records: Answer):
+    result = {"wildcard_entry": False, "wildcard_sibling": False}
+    try:
+        wildcard_sibling_domain = re.sub(r"^[^.]+", "*", domain)
+        wildcard_record = await resolver.resolve(
+            wildcard_sibling_domain,
+            rdtype=dns.rdatatype.A,
+            raise_on_no_answer=False,
+        )
+        if wildcard_record is not None:
+            # if wildcard exists on domain, is sibling
+            result["wildcard_sibling"] = True
+            if a_records is None:
+                try:
+                    # check for mail-only subdomain (e.g. mail.example.com)
+                    mx_records, wildcard_mx = await asyncio.gather(
+                        resolver.resolve(qname=domain, rdtype=dns.rdatatype.MX),
+                        resolver.resolve(
+                            wildcard_sibling_domain,
+                            rdtype=dns.rdatatype.MX,
+                            raise_on_no_answer=False,
+                        ),
+                    )
+                    # if mx records exist and match, is wildcard entry
+                    if (mx_records is None and wildcard_mx is None) or (
+                        format_answers(mx_records.response.answer[-1])
+                        == format_answers(wildcard_mx.response.answer[-1])
+                    ):
+                        result["wildcard_entry"] = True
+                except (NoAnswer, NXDOMAIN, NoNameservers, Timeout) as e:
+                    logger.info(
+                        f"Error checking for wildcard status (MX record check) on {domain}: {e}"
+                    )
+                except Exception as e:
+                    logger.error(
+                        f"Unknown error checking for wildcard status (MX record check) on {domain}: {e}"
+                    )
+            # check to see if subdomain and wildcard record point to the same endpoints
+            elif (
+                len(a_records.response.answer) > 0
+                and len(wildcard_record.response.answer) > 0
+            ):
+                if format_answers(a_records.response.answer[-1]) == format_answers(
+                    wildcard_record.response.answer[-1]
+                ):
+                    result["wildcard_entry"] = True
+
+    except (NoAnswer, NXDOMAIN, NoNameservers, Timeout) as e:
+        logger.info(f"Error checking for wildcard status on {domain}: {e}")
+    except Exception as e:
+        logger.error(f"Unknown error checking for wildcard status on {domain}: {e}")
+
+    return result
+
+
+async def scan_domain_async(domain, dkim_selectors=None):
+    """
+    Scan a domain for DNS records, issuing independent queries concurrently.
+    Produces the same results as scan_domain.
+    :param str domain: Name of domain to scan
+    :param list[str] dkim_selectors: Array of DKIM selectors
+    :return: The results from the domain scan
+    :rtype: dict
+    """
+
+    if dkim_selectors is None:
+        dkim_selectors = []
+
+    scan_result = DNSScanResult(domain)
+
+    # Check if domain exists. Most domains answer NOERROR to the A query, only
+    # probe the remaining query types (concurrently) when it does not.
+    rtypes = [await get_dns_return_type_async(domain, EXISTENCE_QUERY_TYPES[0])]
+    if rtypes[0] != "NOERROR":
+        rtypes += await asyncio.gather(
+            *[
+                get_dns_return_type_async(domain, query_type)
+                for query_type in EXISTENCE_QUERY_TYPES[1:]
+            ]
+        )
+    dns_answer_return_types = classify_return_types(domain, rtypes)
+
+    if not set_record_exists(scan_result, dns_answer_return_types):
+        return scan_result.__dict__
+
+    resolver = build_async_resolver()
+
+    async def resolve_chain():
+        # Get chaining results (A and CNAME records)
+        try:
+            a_records = await resolver.resolve(qname=domain, rdtype=dns.rdatatype.A)
+        except (NoAnswer, NXDOMAIN, NoNameservers, Timeout):
+            a_records = None
+        except Exception as e:
+            logger.error(f"Unknown error getting A records for {domain}: {e}")
+            a_records = None
+
+        if a_records:
+            scan_result.resolve_ips = [a_record.to_text() for a_record in a_records]
+            scan_result.resolve_chain = [
+                str(answer).splitlines() for answer in a_records.response.answer
+            ]
+        else:
+            scan_result.resolve_ips = None
+            scan_result.resolve_chain = None
+
+        # Get wildcard status of domain
+        wildcard_status = await get_wildcard_status_async(domain, resolver, a_records)
+        scan_result.wildcard_entry = wildcard_status["wildcard_entry"]
+        scan_result.wildcard_sibling = wildcard_status["wildcard_sibling"]
+
+    async def resolve_cname():
+        # Get first CNAME record (in case there is no A record in chain). Checking if chain is valid.
+        try:
+            cname_record = await resolver.resolve(
+                qname=domain, rdtype=dns.rdatatype.CNAME
+            )
+        except (NoAnswer, NXDOMAIN, NoNameservers, Timeout):
+            cname_record = None
+        except Exception as e:
+            logger.error(f"Unknown error getting CNAME record for {domain}: {e}")
+            cname_record = None
+
+        if cname_record is not None:
+            scan_result.cname_record = str(cname_record.response.answer[0])
+
+    async def resolve_zone_apex():
+        scan_result.zone_apex = await find_zone_apex_async(domain, resolver)
+        # minimal_dnssec_check is cached per zone, run it in a thread to share that cache
+        scan_result.zone_dnssec_enabled = await asyncio.to_thread(
+            get_zone_dnssec_enabled, domain, scan_result.zone_apex
+        )
+
+    async def run_dmarc_scan():
+        # checkdmarc has no asynchronous API, run it in a thread
+        dmarc_start_time = time.monotonic()
+        logger.debug(f"Starting DMARC scanner for '{domain}'")
+        dmarc_scan_result = await asyncio.to_thread(DMARCScanner(domain).run)
+        scan_result.base_domain = dmarc_scan_result.get("base_domain", "")
+        scan_result.mx_records = dmarc_scan_result.get("mx", {})
+        scan_result.spf = dmarc_scan_result.get("spf", {})
+        scan_result.dmarc = dmarc_scan_result.get("dmarc", {})
+        scan_result.ns_records = dmarc_scan_result.get(
+            "ns", {"hostnames": [], "errors": []}
+        )
+        logger.debug(f"DMARC scan elapsed time: {time.monotonic() - dmarc_start_time}")
+
+    async def run_dkim_scan():
+        dkim_start_time = time.monotonic()
+        logger.debug(f"Starting DKIM scanner for '{domain}'")
+        scan_result.dkim = await DKIMScanner(domain, dkim_selectors).run_async(
+            resolver
+        )
+        logger.debug(f"DKIM scan elapsed time: {time.monotonic() - dkim_start_time}")
+
+    zone_apex_task = asyncio.ensure_future(resolve_zone_apex())
+    dmarc_task = asyncio.ensure_future(run_dmarc_scan())
+    cname_task = asyncio.ensure_future(resolve_cname())
+
+    async def check_delegations():
+        await asyncio.gather(zone_apex_task, dmarc_task)
+        # check nameserver delegations
+        scan_result.ns_delegations = await check_ns_delegations_async(
+            domain=domain,
+            zone_apex=scan_result.zone_apex,
+            ns_records=scan_result.ns_records,
+            resolver=resolver,
+        )
+        scan_result.registrar_context = await asyncio.to_thread(
+            get_scan_registrar_context, scan_result, domain, scan_result.zone_apex
+        )
+
+    async def check_cname_mx_records():
+        await asyncio.gather(dmarc_task, cname_task)
+        cname_mx_records = await asyncio.to_thread(get_cname_mx_records, scan_result)
+        if cname_mx_records is not None:
+            scan_result.mx_records = cname_mx_records
+
+    await asyncio.gather(
+        resolve_chain(),
+        zone_apex_task,
+        dmarc_task,
+        cname_task,
+        check_delegations(),
+        check_cname_mx_records(),
+        run_dkim_scan(),
+    )
+
+    logger.info(f"DNS results for '{domain}': {scan_result.__dict__}")
+
+    return scan_result.__dict__
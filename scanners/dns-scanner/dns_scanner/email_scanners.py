@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import json
 import logging
@@ -20,6 +21,8 @@ import dns.resolver
 from dns.exception import Timeout
 from dns.resolver import NoAnswer, NXDOMAIN, NoNameservers
 
+from dns_scanner.dns_cache import build_resolver
+
 logger = logging.getLogger(__name__)
 
 TIMEOUT = int(os.getenv("SCAN_TIMEOUT", "20"))
@@ -27,9 +30,7 @@ TIMEOUT = int(os.getenv("SCAN_TIMEOUT", "20"))
 
 def check_if_domain_exists(domain, resolver):
     if not resolver:
-        resolver = dns.resolver.Resolver()
-        resolver.timeout = TIMEOUT
-        resolver.lifetime = TIMEOUT * 2
+        resolver = build_resolver()
 
     # Check if domain exists, only return True if DNS returns NOERROR
     try:
@@ -162,10 +163,8 @@ class DMARCScanner:
         domain_list = list()
         domain_list.append(self.domain)
 
-        resolver = dns.resolver.Resolver()
-        resolver.timeout = TIMEOUT
-        lifetime = TIMEOUT * 2
-        resolver.lifetime = lifetime
+        resolver = build_resolver()
+        lifetime = resolver.lifetime
 
         try:
             # Perform "checkdmarc" scan on provided domain.
@@ -477,49 +476,108 @@ class DKIMScanner:
 
         return pk, keysize, ktag
 
+    def scan_selector(self, selector, txt_record_bytes):
+        """
+        Parse the DKIM TXT record found for a selector
+        :param selector: DKIM selector
+        :param txt_record_bytes: TXT record retrieved from DNS, or None if missing
+        :return: The result for the selector
+        """
+        result = {}
+        try:
+            dkim_txt_values_bytes = dkim.util.parse_tag_value(txt_record_bytes)
+
+            parsed_txt_record = {}
+
+            for key, val in dkim_txt_values_bytes.items():
+                parsed_txt_record[key.decode("ascii")] = val.decode("ascii")
+
+            lookup_url = f"{selector}._domainkey.{self.domain}."
+            pk, keysize, ktag = self.load_pk(lookup_url, txt_record_bytes)
+            ktag = ktag.decode("ascii") if ktag else None
+
+            if pk and pk.get("publicExponent"):
+                public_exponent = pk.get("publicExponent")
+            else:
+                public_exponent = None
+
+            if pk and pk.get("modulus"):
+                modulus = pk.get("modulus")
+            else:
+                modulus = None
+
+            result["record"] = txt_record_bytes.decode("ascii")
+            result["parsed"] = parsed_txt_record
+            result["key_size"] = keysize
+            result["key_type"] = ktag
+            result["public_key_modulus"] = modulus
+            result["public_exponent"] = public_exponent
+
+        except Exception as e:
+            logger.error(
+                f"Failed to perform DomainKeys Identified Mail scan on given domain: {self.domain}, (selector: {selector}): {str(e)}"
+            )
+            result = {"error": "missing"}
+
+        return result
+
     def run(self):
 
         record = {}
 
         for selector in self.selectors:
-            record[selector] = {}
             try:
                 # Add period at end of name for DNS query, otherwise it may not resolve in containers due to search
                 # in /etc/resolv.conf
                 lookup_url = f"{selector}._domainkey.{self.domain}."
                 # Retrieve public key from DNS
                 txt_record_bytes = dnsplug.get_txt_dnspython(lookup_url)
-                dkim_txt_values_bytes = dkim.util.parse_tag_value(txt_record_bytes)
-
-                parsed_txt_record = {}
-
-                for key, val in dkim_txt_values_bytes.items():
-                    parsed_txt_record[key.decode("ascii")] = val.decode("ascii")
-
-                pk, keysize, ktag = self.load_pk(lookup_url, txt_record_bytes)
-                ktag = ktag.decode("ascii") if ktag else None
+            except Exception as e:
+                logger.error(
+                    f"Failed to perform DomainKeys Identified Mail scan on given domain: {self.domain}, (selector: {selector}): {str(e)}"
+                )
+                record[selector] = {"error": "missing"}
+                continue
 
-                if pk and pk.get("publicExponent"):
-                    public_exponent = pk.get("publicExponent")
-                else:
-                    public_exponent = None
+            record[selector] = self.scan_selector(selector, txt_record_bytes)
 
-                if pk and pk.get("modulus"):
-                    modulus = pk.get("modulus")
-                else:
-                    modulus = None
+        return record
 
-                record[selector]["record"] = txt_record_bytes.decode("ascii")
-                record[selector]["parsed"] = parsed_txt_record
-                record[selector]["key_size"] = keysize
-                record[selector]["key_type"] = ktag
-                record[selector]["public_key_modulus"] = modulus
-                record[selector]["public_exponent"] = public_exponent
+    @staticmethod
+    async def get_txt_async(name, resolver):
+        """Asynchronous equivalent of dkim.dnsplug.get_txt_dnspython"""
+        try:
+            answer = await resolver.resolve(
+                name, dns.rdatatype.TXT, raise_on_no_answer=False
+            )
+            for rrset in answer.response.answer:
+                if rrset.rdtype == dns.rdatatype.TXT:
+                    return b"".join(list(rrset.items)[0].strings)
+        except NXDOMAIN:
+            pass
+        return None
+
+    async def run_async(self, resolver):
+        """
+        Same as run, but all selectors are looked up concurrently
+        :param resolver: dns.asyncresolver.Resolver used for the TXT lookups
+        """
+        lookups = await asyncio.gather(
+            *[
+                self.get_txt_async(f"{selector}._domainkey.{self.domain}.", resolver)
+                for selector in self.selectors
+            ],
+            return_exceptions=True,
+        )
 
-            except Exception as e:
+        record = {}
+        for selector, txt_record_bytes in zip(self.selectors, lookups):
+            if isinstance(txt_record_bytes, Exception):
                 logger.error(
-                    f"Failed to perform DomainKeys Identified Mail scan on given domain: {self.domain}, (selector: {selector}): {str(e)}"
+                    f"Failed to perform DomainKeys Identified Mail scan on given domain: {self.domain}, (selector: {selector}): {str(txt_record_bytes)}"
                 )
                 record[selector] = {"error": "missing"}
+                continue
+            record[selector] = self.scan_selector(selector, txt_record_bytes)
 
         return record
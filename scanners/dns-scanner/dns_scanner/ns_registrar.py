@@ -1,11 +1,20 @@
+import asyncio
 import os
 
 import dns
+import dns.asyncquery
 import dns.resolver
 import requests
 from dns.exception import Timeout
 from dns.resolver import NXDOMAIN, NoAnswer, NoNameservers
 
+from dns_scanner.zone_cache import (
+    get_delegation_probe,
+    get_zone_nameservers,
+    remember_delegation_probe,
+    remember_zone_nameservers,
+)
+
 TIMEOUT = int(os.getenv("SCAN_TIMEOUT", "20"))
 RDAP_TIMEOUT_SEC = float(os.getenv("RDAP_TIMEOUT_SEC", "3"))
 
@@ -56,26 +65,69 @@ def get_ns_ip(host: str, resolver):
     return ns_ip
 
 
-def check_ns_delegations(domain, zone_apex, ns_records, resolver=None, timeout_sec=10):
-    if resolver is None:
-        resolver = dns.resolver.get_default_resolver()
-
-    qname = zone_apex
-    if not zone_apex:
-        qname = domain
-
+def get_ns_hosts(domain, zone_apex, ns_records, resolver):
     ns_hosts = ns_records.get("hostnames", [])
     if len(ns_hosts) == 0:
         ns_lookup_name = zone_apex or domain
+        ns_hosts = get_zone_nameservers(ns_lookup_name)
+        if ns_hosts is not None:
+            return ns_hosts
         try:
             ns_res = resolver.resolve(ns_lookup_name, dns.rdatatype.NS)
             ns_hosts = [host.to_text() for host in ns_res]
+            remember_zone_nameservers(ns_lookup_name, ns_hosts)
         except (NoAnswer, NXDOMAIN, NoNameservers, Timeout):
             ns_hosts = []
+    return ns_hosts
+
+
+def build_ns_check_row(host, qname):
+    return {
+        "ns_host": host,
+        "qname": qname,
+        "qtype": "SOA",
+        "rcode": None,
+        "answered_authoritatively": False,
+        "error": None,
+        "timeout": False,
+    }
+
+
+def check_ns_host(host, qname, resolver, timeout_sec):
+    # Names in the same zone share their delegation, reuse recent probes of the nameserver
+    row = get_delegation_probe(qname, host)
+    if row is not None:
+        return row
+
+    row = probe_ns_host(host, qname, resolver, timeout_sec)
+    remember_delegation_probe(row)
+    return row
+
+
+def probe_ns_host(host, qname, resolver, timeout_sec):
+    row = build_ns_check_row(host, qname)
+    try:
+        ns_ip = get_ns_ip(host, resolver)
+        if ns_ip is None:
+            row["error"] = "ns_ip_resolution_failed"
+            return row
+
+        res = probe_nameserver(ns_ip, qname, "SOA", False, timeout_sec)
+        row["rcode"] = dns.rcode.to_text(res.rcode())
+        row["answered_authoritatively"] = bool(res.flags & dns.flags.AA)
+    except Timeout:
+        row["timeout"] = True
+        row["error"] = "timeout"
+    except Exception as e:
+        row["error"] = str(e)
+
+    return row
 
+
+def summarize_ns_checks(ns_hosts, ns_checks):
     output = {
         "ns_hosts": ns_hosts,
-        "ns_checks": [],
+        "ns_checks": ns_checks,
         "ns_delegation": {
             "total_ns": len(ns_hosts),
             "authoritative_ok": 0,
@@ -87,45 +139,14 @@ def check_ns_delegations(domain, zone_apex, ns_records, resolver=None, timeout_s
         output["ns_delegation"]["lame_type"] = "unknown"
         return output
 
-    for host in ns_hosts:
-        row = {
-            "ns_host": host,
-            "qname": qname,
-            "qtype": "SOA",
-            "rcode": None,
-            "answered_authoritatively": False,
-            "error": None,
-            "timeout": False,
-        }
-
-        try:
-            ns_ip = get_ns_ip(host, resolver)
-            if ns_ip is None:
-                row["error"] = "ns_ip_resolution_failed"
-                output["ns_delegation"]["lame_count"] += 1
-                output["ns_checks"].append(row)
-                continue
-
-            res = probe_nameserver(ns_ip, qname, "SOA", False, timeout_sec)
-            row["rcode"] = dns.rcode.to_text(res.rcode())
-            row["answered_authoritatively"] = bool(res.flags & dns.flags.AA)
-
-            if row["answered_authoritatively"] and row["rcode"] in [
-                "NOERROR",
-                "NXDOMAIN",
-            ]:
-                output["ns_delegation"]["authoritative_ok"] += 1
-            else:
-                output["ns_delegation"]["lame_count"] += 1
-        except Timeout:
-            row["timeout"] = True
-            row["error"] = "timeout"
+    for row in ns_checks:
+        if row["answered_authoritatively"] and row["rcode"] in [
+            "NOERROR",
+            "NXDOMAIN",
+        ]:
+            output["ns_delegation"]["authoritative_ok"] += 1
+        else:
             output["ns_delegation"]["lame_count"] += 1
-        except Exception as e:
-            row["error"] = str(e)
-            output["ns_delegation"]["lame_count"] += 1
-
-        output["ns_checks"].append(row)
 
     ok = output["ns_delegation"]["authoritative_ok"]
     total = output["ns_delegation"]["total_ns"]
@@ -140,6 +161,111 @@ def check_ns_delegations(domain, zone_apex, ns_records, resolver=None, timeout_s
     return output
 
 
+def check_ns_delegations(domain, zone_apex, ns_records, resolver=None, timeout_sec=10):
+    if resolver is None:
+        resolver = dns.resolver.get_default_resolver()
+
+    qname = zone_apex
+    if not zone_apex:
+        qname = domain
+
+    ns_hosts = get_ns_hosts(domain, zone_apex, ns_records, resolver)
+    ns_checks = [check_ns_host(host, qname, resolver, timeout_sec) for host in ns_hosts]
+    return summarize_ns_checks(ns_hosts, ns_checks)
+
+
+async def get_ns_ip_async(host: str, resolver):
+    ns_ip = None
+    try:
+        ns_a = await resolver.resolve(host, "A")
+        if ns_a:
+            ns_ip = ns_a[0].to_text()
+    except (NoAnswer, NXDOMAIN, NoNameservers, Timeout):
+        ns_ip = None
+
+    if ns_ip is None:
+        try:
+            ns_aaaa = await resolver.resolve(host, "AAAA")
+            if ns_aaaa:
+                ns_ip = ns_aaaa[0].to_text()
+        except (NoAnswer, NXDOMAIN, NoNameservers, Timeout):
+            ns_ip = None
+
+    return ns_ip
+
+
+async def probe_nameserver_async(
+    where: str, qname: str, qtype: str, recursion_desired: bool, timeout: int
+):
+    query = dns.message.make_query(
+        qname,
+        dns.rdatatype.from_text(qtype),
+        use_edns=True,
+    )
+    if not recursion_desired:
+        query.flags &= ~dns.flags.RD
+    return await dns.asyncquery.udp(query, where=where, timeout=timeout)
+
+
+async def check_ns_host_async(host, qname, resolver, timeout_sec):
+    row = get_delegation_probe(qname, host)
+    if row is not None:
+        return row
+
+    row = await probe_ns_host_async(host, qname, resolver, timeout_sec)
+    remember_delegation_probe(row)
+    return row
+
+
+async def probe_ns_host_async(host, qname, resolver, timeout_sec):
+    row = build_ns_check_row(host, qname)
+    try:
+        ns_ip = await get_ns_ip_async(host, resolver)
+        if ns_ip is None:
+            row["error"] = "ns_ip_resolution_failed"
+            return row
+
+        res = await probe_nameserver_async(ns_ip, qname, "SOA", False, timeout_sec)
+        row["rcode"] = dns.rcode.to_text(res.rcode())
+        row["answered_authoritatively"] = bool(res.flags & dns.flags.AA)
+    except Timeout:
+        row["timeout"] = True
+        row["error"] = "timeout"
+    except Exception as e:
+        row["error"] = str(e)
+
+    return row
+
+
+async def check_ns_delegations_async(
+    domain, zone_apex, ns_records, resolver, timeout_sec=10
+):
+    """
+    Same as check_ns_delegations, but every nameserver is probed concurrently
+    using an asynchronous resolver (dns.asyncresolver.Resolver).
+    """
+    qname = zone_apex
+    if not zone_apex:
+        qname = domain
+
+    ns_hosts = ns_records.get("hostnames", [])
+    if len(ns_hosts) == 0:
+        ns_lookup_name = zone_apex or domain
+        ns_hosts = get_zone_nameservers(ns_lookup_name)
+        if ns_hosts is None:
+            try:
+                ns_res = await resolver.resolve(ns_lookup_name, dns.rdatatype.NS)
+                ns_hosts = [host.to_text() for host in ns_res]
+                remember_zone_nameservers(ns_lookup_name, ns_hosts)
+            except (NoAnswer, NXDOMAIN, NoNameservers, Timeout):
+                ns_hosts = []
+
+    ns_checks = await asyncio.gather(
+        *[check_ns_host_async(host, qname, resolver, timeout_sec) for host in ns_hosts]
+    )
+    return summarize_ns_checks(ns_hosts, list(ns_checks))
+
+
 def get_registrar_context(base_domain, ns_hosts=None):
     context = build_registrar_context(base_domain)
 
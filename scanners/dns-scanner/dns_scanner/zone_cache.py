@@ -0,0 +1,94 @@
+import copy
+import logging
+import os
+
+import dns.name
+import dns.rdatatype
+from dns.resolver import NoAnswer, NXDOMAIN
+from expiringdict import ExpiringDict
+
+logger = logging.getLogger(__name__)
+
+ZONE_CACHE_TTL = int(os.getenv("ZONE_CACHE_TTL", "3600"))
+ZONE_CACHE_MAX_SIZE = int(os.getenv("ZONE_CACHE_MAX_SIZE", "50000"))
+
+# Names known to be a zone apex
+zone_apexes = ExpiringDict(max_len=ZONE_CACHE_MAX_SIZE, max_age_seconds=ZONE_CACHE_TTL)
+# Zone apex -> NS hostnames of the zone
+zone_nameservers = ExpiringDict(
+    max_len=ZONE_CACHE_MAX_SIZE, max_age_seconds=ZONE_CACHE_TTL
+)
+# (zone apex, NS hostname) -> result of the delegation probe of that nameserver
+delegation_probes = ExpiringDict(
+    max_len=ZONE_CACHE_MAX_SIZE, max_age_seconds=ZONE_CACHE_TTL
+)
+
+
+def is_known_zone_apex(name: dns.name.Name):
+    return zone_apexes.get(name.to_text().lower()) is not None
+
+
+def remember_zone_apex(name: dns.name.Name):
+    zone_apexes[name.to_text().lower()] = True
+
+
+def zone_apex_from_negative_answer(name: dns.name.Name, error):
+    """
+    Negative answers (NODATA and NXDOMAIN) carry the SOA of the enclosing zone in their
+    authority section, which tells us the zone apex without walking up the hierarchy.
+    :param name: Name that was queried for SOA
+    :param error: The NoAnswer or NXDOMAIN raised by the resolver
+    :return: The zone apex containing name, or None if it could not be determined
+    """
+    try:
+        if isinstance(error, NoAnswer):
+            responses = [error.response()]
+        elif isinstance(error, NXDOMAIN):
+            responses = list(error.kwargs.get("responses", {}).values())
+        else:
+            return None
+    except Exception:
+        return None
+
+    for response in responses:
+        for rrset in response.authority:
+            # Ignore authority data for another zone (e.g. the target of a CNAME)
+            if rrset.rdtype == dns.rdatatype.SOA and name.is_subdomain(rrset.name):
+                return rrset.name
+    return None
+
+
+def get_zone_nameservers(zone):
+    ns_hosts = zone_nameservers.get(zone)
+    return list(ns_hosts) if ns_hosts is not None else None
+
+
+def remember_zone_nameservers(zone, ns_hosts):
+    if ns_hosts:
+        zone_nameservers[zone] = list(ns_hosts)
+
+
+def get_delegation_probe(qname, ns_host):
+    row = delegation_probes.get((qname, ns_host))
+    return copy.deepcopy(row) if row is not None else None
+
+
+def remember_delegation_probe(row):
+    # Don't spread a transient timeout to every other name in the zone
+    if row["timeout"]:
+        return
+    delegation_probes[(row["qname"], row["ns_host"])] = copy.deepcopy(row)
+
+
+def get_zone_cache_stats():
+    return {
+        "zone_apexes": len(zone_apexes),
+        "zone_nameservers": len(zone_nameservers),
+        "delegation_probes": len(delegation_probes),
+    }
+
+
+def clear_zone_cache():
+    zone_apexes.clear()
+    zone_nameservers.clear()
+    delegation_probes.clear()
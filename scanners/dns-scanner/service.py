@@ -13,7 +13,6 @@ from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 
 import nats
-from arango import ArangoClient
 from dotenv import load_dotenv
 from nats.js import JetStreamContext
 from nats.js.api import ConsumerConfig, AckPolicy
@@ -21,7 +20,10 @@ from nats.errors import TimeoutError as NatsTimeoutError
 
 load_dotenv()
 
-from dns_scanner.dns_scanner import scan_domain
+from arango_pool import connect, get_pool_stats
+from dns_scanner.dns_cache import get_cache_stats
+from dns_scanner.dns_scanner import scan_domain, scan_domain_async
+from dns_scanner.zone_cache import get_zone_cache_stats
 
 LOGGER_LEVEL = os.getenv("LOGGER_LEVEL", "INFO")
 
@@ -56,32 +58,28 @@ DB_NAME = os.getenv("DB_NAME")
 DB_URL = os.getenv("DB_URL")
 
 SCAN_THREAD_COUNT = int(os.getenv("SCAN_THREAD_COUNT", 1))
+# Scan domains on the event loop (scan_domain_async) instead of in worker threads
+SCAN_ASYNC = os.getenv("SCAN_ASYNC", "false").lower() == "true"
+ASYNC_SCAN_CONCURRENCY = int(os.getenv("ASYNC_SCAN_CONCURRENCY", 200))
+DNS_CACHE_STATS_INTERVAL = int(os.getenv("DNS_CACHE_STATS_INTERVAL", 300))
+# Maximum number of connections to each database host, one per thread looking up scan targets by default
+DB_POOL_SIZE = int(
+    os.getenv("DB_POOL_SIZE", ASYNC_SCAN_CONCURRENCY if SCAN_ASYNC else SCAN_THREAD_COUNT)
+)
 
-# Establish DB connection
-arango_client = ArangoClient(hosts=DB_URL)
-db = arango_client.db(DB_NAME, username=DB_USER, password=DB_PASS)
+# Establish DB connection, DB_URL can list several coordinators separated by commas
+db = connect(DB_URL, DB_NAME, DB_USER, DB_PASS, pool_size=DB_POOL_SIZE)
 
 
 def to_json(msg):
     print(json.dumps(msg, indent=2))
 
 
-def run_scan(msg):
-    start_time = time.monotonic()
-    subject = msg.subject
-    reply = msg.reply
-    data = msg.data.decode()
-    logger.info(
-        "Received a message on '{subject} {reply}': {data}".format(
-            subject=subject, reply=reply, data=data
-        )
-    )
-    payload = json.loads(msg.data)
-
-    domain = payload.get("domain")
-    user_key = payload.get("user_key")
-    shared_id = payload.get("shared_id")
-
+def get_scan_target(domain):
+    """
+    Fetch the domain document and its DKIM selectors
+    :return: Tuple of (domain_doc, selectors), or None if the domain can't be scanned
+    """
     # Check if domain exists in DB
     domain_doc_cursor = db.collection("domains").find({"domain": domain}, limit=1)
 
@@ -89,10 +87,7 @@ def run_scan(msg):
         domain_doc = domain_doc_cursor.next()
     except IndexError:
         logger.error(f"Domain '{domain}' not found in DB")
-        return
-
-    domain_key = domain_doc.get("_key")
-    domain_id = domain_doc.get("_id")
+        return None
 
     # Get DKIM selectors from DB
     try:
@@ -101,7 +96,7 @@ def run_scan(msg):
             FOR selector, e IN 1 ANY @domain domainsToSelectors
                 RETURN selector
             """,
-            bind_vars={"domain": domain_id},
+            bind_vars={"domain": domain_doc.get("_id")},
         )
         connected_selector_docs = [sel for sel in connected_selectors_cursor]
         connected_selector_strings = [
@@ -109,7 +104,57 @@ def run_scan(msg):
         ]
     except Exception as e:
         logger.error(f"Error getting selectors for domain '{domain}': {e}")
+        return None
+
+    return domain_doc, connected_selector_strings
+
+
+def parse_scan_msg(msg):
+    subject = msg.subject
+    reply = msg.reply
+    data = msg.data.decode()
+    logger.info(
+        "Received a message on '{subject} {reply}': {data}".format(
+            subject=subject, reply=reply, data=data
+        )
+    )
+    return json.loads(msg.data)
+
+
+def format_scan_data(payload, domain_doc, scan_results, start_time):
+    end_time = time.monotonic()
+    # Truncate to 2 decimal places for duration
+    duration_seconds = round(end_time - start_time, 2)
+
+    scan_results["duration_seconds"] = duration_seconds
+
+    return {
+        "results": scan_results,
+        "domain": payload.get("domain"),
+        "user_key": payload.get("user_key"),
+        "domain_key": domain_doc.get("_key"),
+        "shared_id": payload.get("shared_id"),
+    }
+
+
+def timeout_scan_results():
+    return {
+        "dmarc": {"error": "missing"},
+        "spf": {"error": "missing"},
+        "mx": {"error": "missing"},
+        "dkim": {"error": "missing"},
+    }
+
+
+def run_scan(msg):
+    start_time = time.monotonic()
+    payload = parse_scan_msg(msg)
+    domain = payload.get("domain")
+
+    scan_target = get_scan_target(domain)
+    if scan_target is None:
         return
+    domain_doc, connected_selector_strings = scan_target
 
     try:
         logger.info(
@@ -121,28 +166,34 @@ def run_scan(msg):
 
     except TimeoutError:
         logger.error(f"Timeout while scanning {domain}")
-        scan_results = {
-            "dmarc": {"error": "missing"},
-            "spf": {"error": "missing"},
-            "mx": {"error": "missing"},
-            "dkim": {"error": "missing"},
-        }
+        scan_results = timeout_scan_results()
 
-    end_time = time.monotonic()
-    # Truncate to 2 decimal places for duration
-    duration_seconds = round(end_time - start_time, 2)
+    return format_scan_data(payload, domain_doc, scan_results, start_time)
 
-    scan_results["duration_seconds"] = duration_seconds
 
-    formatted_scan_data = {
-        "results": scan_results,
-        "domain": domain,
-        "user_key": user_key,
-        "domain_key": domain_key,
-        "shared_id": shared_id,
-    }
+async def run_scan_async(msg):
+    start_time = time.monotonic()
+    payload = parse_scan_msg(msg)
+    domain = payload.get("domain")
+
+    scan_target = await asyncio.to_thread(get_scan_target, domain)
+    if scan_target is None:
+        return
+    domain_doc, connected_selector_strings = scan_target
+
+    try:
+        logger.info(
+            f"Scanning {domain} with DKIM selectors '{str(connected_selector_strings)}'"
+        )
+        scan_results = await scan_domain_async(
+            domain=domain, dkim_selectors=connected_selector_strings
+        )
 
-    return formatted_scan_data
+    except (TimeoutError, asyncio.TimeoutError):
+        logger.error(f"Timeout while scanning {domain}")
+        scan_results = timeout_scan_results()
+
+    return format_scan_data(payload, domain_doc, scan_results, start_time)
 
 
 async def run():
@@ -216,6 +267,15 @@ async def run():
             lambda: asyncio.create_task(ask_exit(signal_name)),
         )
 
+    async def log_cache_stats():
+        while not context.should_exit:
+            await asyncio.sleep(DNS_CACHE_STATS_INTERVAL)
+            logger.info(f"DNS answer cache statistics: {get_cache_stats()}")
+            logger.info(f"Zone cache statistics: {get_zone_cache_stats()}")
+            logger.info(f"Database connection pool statistics: {get_pool_stats()}")
+
+    loop.create_task(log_cache_stats())
+
     async def handle_finished_scan(fut, original_msg, semaphore):
         try:
             await fut
@@ -257,7 +317,12 @@ async def run():
                     f"Error while releasing semaphore for received message: {original_msg}: {e}"
                 )
 
-    sem = asyncio.BoundedSemaphore(SCAN_THREAD_COUNT)
+    if SCAN_ASYNC:
+        sem = asyncio.BoundedSemaphore(ASYNC_SCAN_CONCURRENCY)
+        # Database lookups and checkdmarc are blocking and run in the default executor
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=ASYNC_SCAN_CONCURRENCY))
+    else:
+        sem = asyncio.BoundedSemaphore(SCAN_THREAD_COUNT)
 
     with ThreadPoolExecutor() as executor:
         # Only check priority message every 0.5 seconds
@@ -309,7 +374,10 @@ async def run():
                     continue
 
             try:
-                future = loop.run_in_executor(executor, run_scan, msg)
+                if SCAN_ASYNC:
+                    future = loop.create_task(run_scan_async(msg))
+                else:
+                    future = loop.run_in_executor(executor, run_scan, msg)
                 loop.create_task(
                     handle_finished_scan(fut=future, original_msg=msg, semaphore=sem)
                 )
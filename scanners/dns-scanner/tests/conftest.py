@@ -0,0 +1,10 @@
+import pytest
+
+from dns_scanner.zone_cache import clear_zone_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_zone_cache():
+    clear_zone_cache()
+    yield
+    clear_zone_cache()
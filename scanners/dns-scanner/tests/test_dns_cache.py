@@ -0,0 +1,44 @@
+import time
+
+import dns.asyncresolver
+import dns.name
+import dns.rdataclass
+import dns.rdatatype
+import dns.resolver
+
+from dns_scanner import dns_cache
+
+
+class FakeAnswer:
+    def __init__(self, ttl):
+        self.expiration = time.time() + ttl
+
+
+def test_resolvers_share_answer_cache():
+    resolver = dns_cache.build_resolver()
+    async_resolver = dns_cache.build_async_resolver()
+
+    assert isinstance(async_resolver, dns.asyncresolver.Resolver)
+    assert resolver.cache is dns_cache.answer_cache
+    assert async_resolver.cache is dns_cache.answer_cache
+    assert dns.resolver.get_default_resolver().cache is dns_cache.answer_cache
+    assert resolver.lifetime == dns_cache.TIMEOUT * 2
+
+
+def test_cache_respects_ttl_and_counts_hits():
+    dns_cache.answer_cache.flush()
+    dns_cache.answer_cache.reset_statistics()
+
+    live_key = (dns.name.from_text("_spf.example.com"), dns.rdatatype.TXT, dns.rdataclass.IN)
+    expired_key = (dns.name.from_text("mx.example.com"), dns.rdatatype.A, dns.rdataclass.IN)
+    dns_cache.answer_cache.put(live_key, FakeAnswer(ttl=300))
+    dns_cache.answer_cache.put(expired_key, FakeAnswer(ttl=-1))
+
+    assert dns_cache.answer_cache.get(live_key) is not None
+    assert dns_cache.answer_cache.get(expired_key) is None
+
+    stats = dns_cache.get_cache_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_ratio"] == 0.5
+    assert stats["size"] == 1
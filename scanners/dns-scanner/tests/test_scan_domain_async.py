@@ -0,0 +1,112 @@
+import asyncio
+
+from dns_scanner import dns_scanner as scanner_mod
+
+
+class FakeAsyncResolver:
+    timeout = None
+    lifetime = None
+
+    async def resolve(self, *args, **kwargs):
+        raise scanner_mod.NoAnswer
+
+
+class FakeDMARCScanner:
+    def __init__(self, domain):
+        self.domain = domain
+
+    def run(self):
+        return {
+            "base_domain": "example.com",
+            "mx": {"hosts": [], "warnings": []},
+            "spf": {},
+            "dmarc": {},
+            "ns": {"hostnames": ["ns1.example.com."], "errors": []},
+        }
+
+
+class FakeDKIMScanner:
+    def __init__(self, domain, selectors):
+        self.domain = domain
+        self.selectors = selectors
+
+    async def run_async(self, resolver):
+        return {"selectors": self.selectors}
+
+
+def patch_scanner(monkeypatch, return_types):
+    queried_types = []
+
+    async def fake_get_dns_return_type_async(domain, query_type):
+        queried_types.append(query_type)
+        return return_types[query_type]
+
+    async def fake_find_zone_apex_async(domain, resolver):
+        return "example.com"
+
+    async def fake_get_wildcard_status_async(domain, resolver, a_records):
+        return {"wildcard_entry": False, "wildcard_sibling": False}
+
+    async def fake_check_ns_delegations_async(domain, zone_apex, ns_records, resolver):
+        return {
+            "ns_hosts": ns_records.get("hostnames", []),
+            "ns_checks": [],
+            "ns_delegation": {"lame_type": "none"},
+        }
+
+    monkeypatch.setattr(scanner_mod, "ENABLE_RDAP_LOOKUP", False)
+    monkeypatch.setattr(
+        scanner_mod, "get_dns_return_type_async", fake_get_dns_return_type_async
+    )
+    monkeypatch.setattr(scanner_mod, "find_zone_apex_async", fake_find_zone_apex_async)
+    monkeypatch.setattr(
+        scanner_mod, "get_wildcard_status_async", fake_get_wildcard_status_async
+    )
+    monkeypatch.setattr(
+        scanner_mod, "check_ns_delegations_async", fake_check_ns_delegations_async
+    )
+    monkeypatch.setattr(scanner_mod, "DMARCScanner", FakeDMARCScanner)
+    monkeypatch.setattr(scanner_mod, "DKIMScanner", FakeDKIMScanner)
+    monkeypatch.setattr(
+        scanner_mod.dns.asyncresolver, "Resolver", lambda: FakeAsyncResolver()
+    )
+    return queried_types
+
+
+def test_scan_domain_async_returns_expected_shape(monkeypatch):
+    queried_types = patch_scanner(
+        monkeypatch, {scanner_mod.dns.rdatatype.A: "NOERROR"}
+    )
+
+    result = asyncio.run(
+        scanner_mod.scan_domain_async("mail.example.com", dkim_selectors=["selector1"])
+    )
+
+    assert queried_types == [scanner_mod.dns.rdatatype.A]
+    assert result["record_exists"] is True
+    assert result["rcode"] == "NOERROR"
+    assert result["zone_apex"] == "example.com"
+    assert result["base_domain"] == "example.com"
+    assert result["dkim"] == {"selectors": ["selector1"]}
+    assert result["ns_delegations"]["ns_hosts"] == ["ns1.example.com."]
+    assert result["registrar_context"]["error"] == "rdap_lookup_disabled"
+
+
+def test_scan_domain_async_nonexistent_domain(monkeypatch):
+    rdatatype = scanner_mod.dns.rdatatype
+    queried_types = patch_scanner(
+        monkeypatch,
+        {
+            rdatatype.A: "NXDOMAIN",
+            rdatatype.CNAME: "NXDOMAIN",
+            rdatatype.SOA: "SERVFAIL",
+            rdatatype.NS: None,
+        },
+    )
+
+    result = asyncio.run(scanner_mod.scan_domain_async("missing.example.com"))
+
+    assert sorted(queried_types) == sorted(scanner_mod.EXISTENCE_QUERY_TYPES)
+    assert result["record_exists"] is False
+    assert result["rcode"] == "SERVFAIL"
+    assert result["zone_apex"] is None
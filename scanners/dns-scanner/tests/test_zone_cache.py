@@ -0,0 +1,86 @@
+import dns
+import dns.message
+import dns.rrset
+
+from dns_scanner import dns_scanner as scanner_mod
+from dns_scanner import ns_registrar
+
+
+def no_answer(qname, authority_zone=None):
+    response = dns.message.make_response(dns.message.make_query(qname, "SOA"))
+    if authority_zone:
+        response.authority.append(
+            dns.rrset.from_text(
+                authority_zone,
+                300,
+                "IN",
+                "SOA",
+                f"ns1.{authority_zone} hostmaster.{authority_zone} 1 7200 3600 1209600 300",
+            )
+        )
+    return scanner_mod.NoAnswer(response=response)
+
+
+class SOAResolver:
+    def __init__(self, authority_zone=None):
+        self.authority_zone = authority_zone
+        self.calls = []
+
+    def resolve(self, name, query_type):
+        self.calls.append(str(name))
+        raise no_answer(name, self.authority_zone)
+
+
+class FakeResponse:
+    flags = dns.flags.AA
+
+    def rcode(self):
+        return dns.rcode.NOERROR
+
+
+def test_find_zone_apex_uses_negative_answer_authority():
+    resolver = SOAResolver(authority_zone="canada.ca.")
+
+    assert scanner_mod.find_zone_apex("a.b.canada.ca", resolver) == "canada.ca"
+    assert resolver.calls == ["a.b.canada.ca."]
+
+    # The apex itself is now known and needs no lookup
+    assert scanner_mod.find_zone_apex("canada.ca", resolver) == "canada.ca"
+    assert resolver.calls == ["a.b.canada.ca."]
+
+
+def test_find_zone_apex_stops_walk_at_known_apex():
+    scanner_mod.remember_zone_apex(dns.name.from_text("canada.ca"))
+    resolver = SOAResolver()
+
+    assert scanner_mod.find_zone_apex("x.y.canada.ca", resolver) == "canada.ca"
+    assert resolver.calls == ["x.y.canada.ca.", "y.canada.ca."]
+
+
+def test_find_zone_apex_ignores_unrelated_authority():
+    # e.g. SOA of a CNAME target in another zone
+    resolver = SOAResolver(authority_zone="cdn.example.net.")
+
+    assert scanner_mod.find_zone_apex("www.canada.ca", resolver) is None
+    assert resolver.calls == ["www.canada.ca.", "canada.ca.", "ca."]
+
+
+def test_check_ns_delegations_reuses_probes_within_zone(monkeypatch):
+    probes = []
+
+    def fake_probe(where, qname, qtype, recursion_desired, timeout):
+        probes.append((where, qname))
+        return FakeResponse()
+
+    monkeypatch.setattr(ns_registrar, "get_ns_ip", lambda host, resolver: "192.0.2.1")
+    monkeypatch.setattr(ns_registrar, "probe_nameserver", fake_probe)
+
+    ns_records = {"hostnames": ["ns1.canada.ca.", "ns2.canada.ca."], "errors": []}
+    for domain in ["a.canada.ca", "b.canada.ca"]:
+        result = ns_registrar.check_ns_delegations(
+            domain=domain, zone_apex="canada.ca", ns_records=ns_records, resolver=object()
+        )
+        assert result["ns_delegation"]["authoritative_ok"] == 2
+        assert result["ns_delegation"]["lame_type"] == "none"
+
+    assert probes == [("192.0.2.1", "canada.ca"), ("192.0.2.1", "canada.ca")]
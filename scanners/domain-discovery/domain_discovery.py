@@ -1,4 +1,4 @@
-import subprocess
+import contextlib
 import logging
 import os
 from dataclasses import dataclass
@@ -13,6 +13,7 @@ import json
 import signal
 import traceback
 
+import dns.asyncresolver
 import dns.resolver
 from nats.js import JetStreamContext
 from nats.js.api import ConsumerConfig, AckPolicy
@@ -34,82 +35,205 @@ NAME = os.getenv("NAME", "domain-discovery")
 SERVERLIST = os.getenv("NATS_SERVERS", "nats://localhost:4222")
 SERVERS = SERVERLIST.split(",")
 
+# Number of subdomain liveness checks in flight at once
+LIVENESS_CONCURRENCY = int(os.getenv("LIVENESS_CONCURRENCY", 100))
+# Number of live subdomains added to the database per transaction
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", 500))
+
 # Establish DB connection
 arango_client = ArangoClient(hosts=DB_URL)
 db = arango_client.db(DB_NAME, username=DB_USER, password=DB_PASS)
 
+# Resolver shared by every liveness check, caching answers across discovery requests
+resolver = dns.asyncresolver.Resolver()
+resolver.cache = dns.resolver.LRUCache()
+
+
+def new_domain(subdomain):
+    return {
+        "domain": subdomain,
+        "lastRan": None,
+        "selectors": [],
+        "hash": None,
+        "status": {
+            "certificates": None,
+            "dkim": None,
+            "dmarc": None,
+            "https": None,
+            "spf": None,
+            "ssl": None,
+        },
+        "archived": False,
+    }
+
+
+def add_subdomains(live_subdomains, orgId, counts):
+    # Insert the new domains and claim every live subdomain in one transaction
+    existing_domains = get_existing_domains(live_subdomains)
+    for subdomain in live_subdomains:
+        logger.info(
+            "Adding {subdomain} to org: {orgId}".format(
+                subdomain=subdomain, orgId=orgId
+            )
+        )
 
-def process_subdomains(results, orgId):
-    subdomains = [domain.strip() for domain in results]
-    claimed_domains = get_claimed_domains(orgId)
+    new_subdomains = [
+        subdomain for subdomain in live_subdomains if subdomain not in existing_domains
+    ]
     domains_to_scan = []
-    for subdomain in subdomains:
-        if (
-            subdomain not in claimed_domains
-            and subdomain.strip()
-            and check_live(subdomain)
-        ):
-            logger.info(
-                "Adding {subdomain} to org: {orgId}".format(
-                    subdomain=subdomain, orgId=orgId
-                )
+    domain_ids = [
+        existing_domains[subdomain]["_id"]
+        for subdomain in live_subdomains
+        if subdomain in existing_domains
+    ]
+    failed = 0
+
+    # setup transaction
+    txn_db = db.begin_transaction(
+        write=[
+            db.collection("domains").name,
+            db.collection("claims").name,
+        ],
+    )
+    try:
+        domain_results = (
+            txn_db.collection("domains").insert_many(
+                [new_domain(subdomain) for subdomain in new_subdomains]
             )
-            try:
-                checkDomain = (
-                    db.collection("domains").find({"domain": subdomain}).next()
-                )
-            except StopIteration:
-                checkDomain = None
-            if not checkDomain:
-                try:
-                    domainInsert = db.collection("domains").insert(
-                        {
-                            "domain": subdomain,
-                            "lastRan": None,
-                            "selectors": [],
-                            "hash": None,
-                            "status": {
-                                "certificates": None,
-                                "dkim": None,
-                                "dmarc": None,
-                                "https": None,
-                                "spf": None,
-                                "ssl": None,
-                            },
-                            "archived": False,
-                        }
-                    )
-                    domainInsert["domain"] = subdomain
-                    domains_to_scan.append(domainInsert)
-                except Exception as e:
-                    logger.error(
-                        f"Inserting new domain: {str(e)} \n\nFull traceback: {traceback.format_exc()}"
-                    )
-                    continue
-            else:
-                domainInsert = checkDomain
+            if new_subdomains
+            else []
+        )
+        for subdomain, domainInsert in zip(new_subdomains, domain_results):
+            if isinstance(domainInsert, Exception):
+                logger.error(f"Inserting new domain {subdomain}: {str(domainInsert)}")
+                failed += 1
+                continue
+            domainInsert["domain"] = subdomain
+            domains_to_scan.append(domainInsert)
+            domain_ids.append(domainInsert["_id"])
 
-            try:
-                db.collection("claims").insert(
+        firstSeen = (
+            datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        )
+        claim_results = (
+            txn_db.collection("claims").insert_many(
+                [
                     {
                         "_from": orgId,
-                        "_to": domainInsert["_id"],
-                        "tags": ['new-nouveau'],
+                        "_to": domain_id,
+                        "tags": ["new-nouveau"],
                         "assetState": "approved",
-                        "firstSeen": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[
-                :-3
-            ]
-            + "Z",
+                        "firstSeen": firstSeen,
                     }
-                )
-            except Exception as e:
-                logger.error(
-                    f"Claiming domain: {str(e)} \n\nFull traceback: {traceback.format_exc()}"
-                )
-                continue
+                    for domain_id in domain_ids
+                ]
+            )
+            if domain_ids
+            else []
+        )
+        for domain_id, claimInsert in zip(domain_ids, claim_results):
+            if isinstance(claimInsert, Exception):
+                logger.error(f"Claiming domain {domain_id}: {str(claimInsert)}")
+                failed += 1
+
+        txn_db.commit_transaction()
+    except Exception as e:
+        logger.error(
+            f"Adding subdomains to {orgId}: {str(e)} \n\nFull traceback: {traceback.format_exc()}"
+        )
+        txn_db.abort_transaction()
+        counts["failed"] += len(live_subdomains)
+        return []
+
+    counts["inserted"] += len(domains_to_scan)
+    counts["claimed"] += len(domain_ids) - len(domains_to_scan)
+    counts["failed"] += failed
     return domains_to_scan
 
 
+async def process_subdomains(subdomains, orgId, publish_scan_requests):
+    # Checks liveness while findomain is still running, and adds the live subdomains in batches as they come
+    loop = asyncio.get_running_loop()
+    claimed_domains = set(get_claimed_domains(orgId))
+    seen = set()
+    counts = {
+        "found": 0,
+        "inserted": 0,
+        "claimed": 0,
+        "already_claimed": 0,
+        "not_live": 0,
+        "failed": 0,
+    }
+    candidates = asyncio.Queue(maxsize=LIVENESS_CONCURRENCY)
+    live = asyncio.Queue()
+
+    async def read_subdomains():
+        async for line in subdomains:
+            subdomain = line.strip()
+            if not subdomain or subdomain in seen:
+                continue
+            seen.add(subdomain)
+            counts["found"] += 1
+            if subdomain in claimed_domains:
+                counts["already_claimed"] += 1
+                continue
+            await candidates.put(subdomain)
+
+    async def check_candidates():
+        while True:
+            subdomain = await candidates.get()
+            if subdomain is None:
+                await live.put(None)
+                return
+            if await check_live(subdomain):
+                await live.put(subdomain)
+            else:
+                counts["not_live"] += 1
+
+    async def add_batch(batch):
+        domains_to_scan = await loop.run_in_executor(
+            None, add_subdomains, batch, orgId, counts
+        )
+        if domains_to_scan:
+            await publish_scan_requests(domains_to_scan)
+
+    async def add_live_subdomains():
+        batch = []
+        checkers_left = LIVENESS_CONCURRENCY
+        while checkers_left:
+            subdomain = await live.get()
+            if subdomain is None:
+                checkers_left -= 1
+                continue
+            batch.append(subdomain)
+            if len(batch) >= INSERT_BATCH_SIZE:
+                await add_batch(batch)
+                batch = []
+        if batch:
+            await add_batch(batch)
+
+    checkers = [
+        asyncio.create_task(check_candidates()) for _ in range(LIVENESS_CONCURRENCY)
+    ]
+    adder = asyncio.create_task(add_live_subdomains())
+    try:
+        await read_subdomains()
+    finally:
+        for _ in checkers:
+            await candidates.put(None)
+    await asyncio.gather(*checkers)
+    await adder
+
+    logger.info(
+        f"Discovered {counts['found']} subdomains for {orgId}: "
+        f"{counts['inserted']} new domains inserted, "
+        f"{counts['claimed']} existing domains claimed, "
+        f"{counts['already_claimed']} skipped as already claimed, "
+        f"{counts['not_live']} skipped as not live, {counts['failed']} failed"
+    )
+    return counts["inserted"]
+
+
 def get_claimed_domains(orgId):
     # Get existing domains in org
     try:
@@ -126,9 +250,24 @@ def get_claimed_domains(orgId):
         return []
 
 
-def check_live(domain):
+def get_existing_domains(subdomains):
+    # Get the domains that already exist, by name
     try:
-        dns.resolver.resolve(domain, rdtype=dns.rdatatype.A, raise_on_no_answer=False)
+        cursor = db.aql.execute(
+            "FOR d IN domains FILTER d.domain IN @domains RETURN d",
+            bind_vars={"domains": subdomains},
+        )
+        return {document["domain"]: document for document in cursor}
+    except Exception as e:
+        logger.error(
+            f"Getting existing domains: {str(e)} \n\nFull traceback: {traceback.format_exc()}"
+        )
+        return {}
+
+
+async def check_live(domain):
+    try:
+        await resolver.resolve(domain, rdtype=dns.rdatatype.A, raise_on_no_answer=False)
         return True
     except (
         dns.resolver.NoAnswer,
@@ -143,27 +282,38 @@ def check_live(domain):
         return False
 
 
-def domain_discovery(domain, orgId):
+async def read_lines(stream):
+    async for line in stream:
+        yield line.decode()
+
+
+async def domain_discovery(domain, orgId, publish_scan_requests):
     try:
-        findomain_output = subprocess.run(
-            [
-                "findomain",
-                "-t",
-                domain,
-                "-q",
-            ],
-            capture_output=True,
-            text=True,
+        findomain = await asyncio.create_subprocess_exec(
+            "findomain",
+            "-t",
+            domain,
+            "-q",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
         )
-        subdomain_list = findomain_output.stdout.split("\n")
     except Exception as e:
         logger.error(
             f"Running findomain: {str(e)} \n\nFull traceback: {traceback.format_exc()}"
         )
-        return []
+        return 0
 
-    results = process_subdomains(subdomain_list, orgId)
-    return results
+    try:
+        inserted = await process_subdomains(
+            read_lines(findomain.stdout), orgId, publish_scan_requests
+        )
+    except BaseException:
+        with contextlib.suppress(ProcessLookupError):
+            findomain.kill()
+        await findomain.wait()
+        raise
+    await findomain.wait()
+    return inserted
 
 
 async def run():
@@ -215,6 +365,35 @@ async def run():
         logger.error(f"Got signal {sig_name}: exit")
         context.should_exit = True
 
+    async def publish_scan_requests(domains):
+        # Publish every scan request at once rather than waiting on each ack in turn
+        publish_results = await asyncio.gather(
+            *(
+                js.publish(
+                    stream="SCANS",
+                    subject="scans.requests",
+                    payload=json.dumps(
+                        {
+                            "domain": newDomain["domain"],
+                            "selectors": [],
+                            "domain_key": newDomain["_key"],
+                        }
+                    ).encode(),
+                )
+                for newDomain in domains
+            ),
+            return_exceptions=True,
+        )
+        for newDomain, result in zip(domains, publish_results):
+            if isinstance(result, Exception):
+                logger.error(
+                    f"Publishing scan request for {newDomain['domain']}: {str(result)}"
+                )
+        published = sum(
+            1 for result in publish_results if not isinstance(result, Exception)
+        )
+        logger.info(f"Published {published} of {len(domains)} scan requests")
+
     for signal_name in {"SIGINT", "SIGTERM"}:
         loop.add_signal_handler(
             getattr(signal, signal_name),
@@ -245,29 +424,8 @@ async def run():
         org_id = payload.get("orgId")
 
         logger.info(f"Starting subdomain scan on '{domain}'")
-        results = domain_discovery(domain, org_id)
-        logger.info(f"{len(results)} new subdomains found for {domain}")
-
-        for newDomain in results:
-            domain_key = newDomain["_key"]
-            try:
-                await js.publish(
-                    stream="SCANS",
-                    subject="scans.requests",
-                    payload=json.dumps(
-                        {
-                            "domain": newDomain["domain"],
-                            "selectors": [],
-                            "domain_key": domain_key,
-                        }
-                    ).encode(),
-                )
-
-            except Exception as e:
-                logger.error(
-                    f"Inserting processed results: {str(e)} \n\nFull traceback: {traceback.format_exc()}"
-                )
-                return
+        inserted = await domain_discovery(domain, org_id, publish_scan_requests)
+        logger.info(f"{inserted} new subdomains found for {domain}")
 
 
 if __name__ == "__main__":
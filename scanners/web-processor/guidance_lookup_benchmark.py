@@ -0,0 +1,109 @@
+import argparse
+import timeit
+
+from web_processor.web_processor import (
+    CIPHER_STRENGTHS,
+    CURVE_STRENGTHS,
+    guidance,
+    process_tls_results,
+)
+
+
+def list_cipher_strength(cipher_suite):
+    # Previous implementation: concatenates and scans the guidance lists for every cipher suite
+    if cipher_suite in (
+        guidance["ciphers"]["1.2"]["recommended"]
+        + guidance["ciphers"]["1.3"]["recommended"]
+    ):
+        return "strong"
+    elif cipher_suite in (
+        guidance["ciphers"]["1.2"]["sufficient"]
+        + guidance["ciphers"]["1.3"]["sufficient"]
+    ):
+        return "acceptable"
+    elif cipher_suite in guidance["ciphers"]["1.2"]["phase_out"]:
+        return "phase_out"
+    return "weak"
+
+
+def list_curve_strength(curve):
+    if curve.lower() in guidance["curves"]["recommended"]:
+        return "strong"
+    elif curve.lower() in guidance["curves"]["sufficient"]:
+        return "acceptable"
+    elif curve.lower() in guidance["curves"]["phase_out"]:
+        return "phase_out"
+    return "weak"
+
+
+def lookup_cipher_strength(cipher_suite):
+    return CIPHER_STRENGTHS.get(cipher_suite, "weak")
+
+
+def lookup_curve_strength(curve):
+    return CURVE_STRENGTHS.get(curve.lower(), "weak")
+
+
+def build_tls_results():
+    # Accepts every cipher suite in the guidance plus a few weak ones, across all protocols
+    cipher_suites = list(CIPHER_STRENGTHS.keys()) + [
+        "TLS_RSA_WITH_RC4_128_SHA",
+        "TLS_RSA_WITH_3DES_EDE_CBC_SHA",
+        "TLS_RSA_WITH_NULL_SHA256",
+    ]
+    return {
+        "accepted_cipher_suites": {
+            "ssl_2_0_cipher_suites": [],
+            "ssl_3_0_cipher_suites": [],
+            "tls_1_0_cipher_suites": [],
+            "tls_1_1_cipher_suites": [],
+            "tls_1_2_cipher_suites": cipher_suites,
+            "tls_1_3_cipher_suites": guidance["ciphers"]["1.3"]["recommended"],
+        },
+        "accepted_elliptic_curves": list(CURVE_STRENGTHS.keys()) + ["prime192v1"],
+        "certificate_chain_info": None,
+        "is_vulnerable_to_heartbleed": False,
+        "is_vulnerable_to_ccs_injection": False,
+    }
+
+
+def time_per_call(fn, args_list, number):
+    def run():
+        for args in args_list:
+            fn(args)
+
+    seconds = min(timeit.repeat(run, number=number, repeat=5))
+    return seconds / (number * len(args_list)) * 1_000_000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare list and lookup table classification of TLS scan results."
+    )
+    parser.add_argument("--number", "-n", type=int, default=2000,
+                        help="Number of iterations per measurement.")
+    args = parser.parse_args()
+
+    tls_results = build_tls_results()
+    cipher_suites = tls_results["accepted_cipher_suites"]["tls_1_2_cipher_suites"]
+    curves = tls_results["accepted_elliptic_curves"]
+
+    for name, list_fn, lookup_fn, values in [
+        ("cipher suite", list_cipher_strength, lookup_cipher_strength, cipher_suites),
+        ("curve", list_curve_strength, lookup_curve_strength, curves),
+    ]:
+        assert [list_fn(value) for value in values] == [lookup_fn(value) for value in values]
+        list_us = time_per_call(list_fn, values, args.number)
+        lookup_us = time_per_call(lookup_fn, values, args.number)
+        print(
+            f"{name}: list {list_us:.3f} us, lookup table {lookup_us:.3f} us "
+            f"({list_us / lookup_us:.1f}x)"
+        )
+
+    process_us = time_per_call(
+        lambda results: process_tls_results(results, True), [tls_results], args.number
+    )
+    print(
+        f"process_tls_results ({len(cipher_suites)} cipher suites, {len(curves)} curves): "
+        f"{process_us:.1f} us per result"
+    )
@@ -0,0 +1,150 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+# service.py reads its database settings at import, the benchmark never uses them
+os.environ.setdefault("NATS_SERVERS", "nats://localhost:4222")
+os.environ.setdefault("DB_URL", "http://localhost:8529")
+
+current_directory = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_FIXTURES = f"{current_directory}/benchmark_fixtures/*.json"
+
+
+def load_fixtures(pattern):
+    fixtures = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path) as fixture_file:
+            fixture = json.load(fixture_file)
+        fixture["name"] = os.path.splitext(os.path.basename(path))[0]
+        fixtures.append(fixture)
+    return fixtures
+
+
+def build_stages(service):
+    def run_process_results(fixture):
+        return service.process_results(fixture["results"])
+
+    def run_snake_to_camel(fixture):
+        return service.snake_to_camel(fixture["processed_results"])
+
+    return {
+        "process_results": run_process_results,
+        "snake_to_camel": run_snake_to_camel,
+    }
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies_ns, allocated_bytes):
+    latencies_us = sorted(latency / 1000 for latency in latencies_ns)
+    return {
+        "count": len(latencies_us),
+        "mean_us": round(statistics.fmean(latencies_us), 2),
+        "p50_us": round(percentile(latencies_us, 50), 2),
+        "p90_us": round(percentile(latencies_us, 90), 2),
+        "p99_us": round(percentile(latencies_us, 99), 2),
+        "max_us": round(latencies_us[-1], 2),
+        "mean_peak_alloc_kib": round(statistics.fmean(allocated_bytes) / 1024, 2),
+        "max_peak_alloc_kib": round(max(allocated_bytes) / 1024, 2),
+    }
+
+
+def measure(stage, fixtures, iterations):
+    # Time first, then trace allocations separately since tracemalloc slows every allocation down
+    latencies_ns = []
+    for _ in range(iterations):
+        for fixture in fixtures:
+            start_time = time.perf_counter_ns()
+            stage(fixture)
+            latencies_ns.append(time.perf_counter_ns() - start_time)
+
+    allocated_bytes = []
+    tracemalloc.start()
+    for fixture in fixtures:
+        tracemalloc.reset_peak()
+        current_bytes, _ = tracemalloc.get_traced_memory()
+        stage(fixture)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        allocated_bytes.append(peak_bytes - current_bytes)
+    tracemalloc.stop()
+
+    return summarize(latencies_ns, allocated_bytes)
+
+
+def find_regressions(report, baseline, tolerance):
+    regressions = []
+    for stage, stats in report["stages"].items():
+        baseline_stats = baseline.get("stages", {}).get(stage)
+        if baseline_stats is None:
+            continue
+        for metric in ["p50_us", "p99_us", "mean_peak_alloc_kib"]:
+            limit = baseline_stats[metric] * (1 + tolerance)
+            if stats[metric] > limit:
+                regressions.append(
+                    f"{stage} {metric}: {stats[metric]} > {limit:.2f} (baseline {baseline_stats[metric]})"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark processing of recorded web scan results.")
+    parser.add_argument('--fixtures', '-f', default=DEFAULT_FIXTURES,
+                        help='Glob of fixture files to replay.')
+    parser.add_argument('--iterations', '-n', type=int, default=200,
+                        help='Number of times each fixture is processed per stage.')
+    parser.add_argument('--output', '-o', type=argparse.FileType('w'),
+                        help='Write the report as JSON, e.g. to use as a baseline.')
+    parser.add_argument('--baseline', '-b', type=argparse.FileType('r'),
+                        help='Fail if latency or allocations regress compared to this report.')
+    parser.add_argument('--tolerance', '-t', type=float, default=0.25,
+                        help='Allowed regression compared to the baseline (0.25 = 25%%).')
+    args = parser.parse_args()
+
+    import service
+
+    logging.disable(logging.CRITICAL)
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        print(f"No fixtures found matching '{args.fixtures}'", file=sys.stderr)
+        sys.exit(1)
+
+    stages = build_stages(service)
+    for fixture in fixtures:
+        fixture["processed_results"] = stages["process_results"](fixture)
+
+    report = {
+        "fixtures": [fixture["name"] for fixture in fixtures],
+        "iterations": args.iterations,
+        "stages": {
+            name: measure(stage, fixtures, args.iterations)
+            for name, stage in stages.items()
+        },
+    }
+
+    print(f"{'stage':<16} {'p50 us':>9} {'p90 us':>9} {'p99 us':>9} {'max us':>9} {'alloc KiB':>10}")
+    for name, stats in report["stages"].items():
+        print(
+            f"{name:<16} {stats['p50_us']:>9} {stats['p90_us']:>9} {stats['p99_us']:>9} "
+            f"{stats['max_us']:>9} {stats['mean_peak_alloc_kib']:>10}"
+        )
+
+    if args.output:
+        json.dump(report, args.output, indent=2)
+
+    if args.baseline:
+        regressions = find_regressions(report, json.load(args.baseline), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
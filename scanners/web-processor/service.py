@@ -3,16 +3,14 @@ import logging
 import asyncio
 import os
 import signal
+import datetime
 import time
 from dataclasses import dataclass
 
-from concurrent.futures import ThreadPoolExecutor
-
 import sys
 import traceback
 import re
 
-from arango import ArangoClient, DocumentUpdateError
 from dotenv import load_dotenv
 import nats
 from nats.errors import TimeoutError as NatsTimeoutError
@@ -46,6 +44,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+from async_arango import ArangoError, AsyncArangoDatabase
 from web_processor.web_processor import process_results
 
 
@@ -59,10 +58,30 @@ DB_NAME = os.getenv("DB_NAME")
 DB_URL = os.getenv("DB_URL")
 
 SCAN_THREAD_COUNT = int(os.getenv("SCAN_THREAD_COUNT", 1))
-
-# Establish DB connection
-arango_client = ArangoClient(hosts=DB_URL)
-db = arango_client.db(DB_NAME, username=DB_USER, password=DB_PASS)
+# Number of messages processed concurrently on the event loop
+MAX_IN_FLIGHT_MESSAGES = int(os.getenv("MAX_IN_FLIGHT_MESSAGES", SCAN_THREAD_COUNT))
+# Maximum number of open connections to the database, other requests wait for a free one.
+# Each message sends one request at a time, so by default every message in flight has a connection.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", MAX_IN_FLIGHT_MESSAGES))
+DB_POOL_STATS_INTERVAL = int(os.getenv("DB_POOL_STATS_INTERVAL", 300))
+# Publish domain status changes for the incremental summaries consumer
+PUBLISH_STATUS_CHANGES = os.getenv("PUBLISH_STATUS_CHANGES", "false").lower() == "true"
+STATUS_CHANGE_SUBJECT = "scans.domain_status_changes"
+# Statuses counted in chart and organization summaries
+SUMMARY_STATUS_CATEGORIES = ("https", "hsts", "ssl", "dmarc", "spf", "dkim")
+# Seconds to wait for the other web scans of a domain before updating it with the completed ones
+WEB_SCAN_FINALIZE_TIMEOUT = int(os.getenv("WEB_SCAN_FINALIZE_TIMEOUT", 600))
+# Seconds between sweeps for web documents still waiting for scans after the timeout
+WEB_SCAN_SWEEP_INTERVAL = int(os.getenv("WEB_SCAN_SWEEP_INTERVAL", 60))
+# Overdue web documents finalized per sweep
+WEB_SCAN_SWEEP_BATCH_SIZE = int(os.getenv("WEB_SCAN_SWEEP_BATCH_SIZE", 100))
+# Attempts at counting off a web scan when sibling scans finish at the same time
+COUNT_ATTEMPTS = 5
+WRITE_CONFLICT = 1200
+
+# DB connection pool, opened on the event loop in processor_service()
+# DB_URL can list several coordinators separated by commas
+db = AsyncArangoDatabase(DB_URL, DB_NAME, DB_USER, DB_PASS, pool_size=DB_POOL_SIZE)
 
 
 def to_camelcase(string):
@@ -92,7 +111,282 @@ def snake_to_camel(d):
         }
 
 
-def process_msg(msg):
+def summary_snapshot(domain):
+    # Fields of a domain that chart and organization summaries are computed from
+    status = domain.get("status") or {}
+    negative_tags = domain.get("negativeTags") or {}
+    # Web tags are counted once per web scan reporting them, domains updated before
+    # webScanNegativeTags was stored fall back to the distinct tags until their next web scan
+    web_negative_tags = domain.get("webScanNegativeTags")
+    if web_negative_tags is None:
+        web_negative_tags = negative_tags.get("web") or []
+    return {
+        "status": {category: status.get(category) for category in SUMMARY_STATUS_CATEGORIES},
+        "phase": domain.get("phase"),
+        "negative_tags": sorted((negative_tags.get("dns") or []) + web_negative_tags),
+        "ignored": domain.get("archived") is True
+        or domain.get("blocked") is True
+        or domain.get("rcode") == "NXDOMAIN",
+    }
+
+
+def merge_patch(document, patch):
+    # Apply a patch locally the way UPDATE merges it into the stored document
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(document.get(key), dict):
+            merge_patch(document[key], value)
+        else:
+            document[key] = value
+
+
+def status_change_msg_id(status_change, msg):
+    # A redelivered scan message publishes its status change under the same id, JetStream drops the duplicate
+    return f"{status_change['domain_id']}:{msg.metadata.sequence.stream}"
+
+
+async def build_status_change(domain, previous_snapshot):
+    snapshot = summary_snapshot(domain)
+    if snapshot == previous_snapshot:
+        return None
+
+    org_ids = await db.aql(
+        """
+        FOR claim IN claims
+            FILTER claim._to == @domain_id
+            FILTER claim.assetState == "approved"
+            RETURN claim._from
+        """,
+        bind_vars={"domain_id": domain["_id"]},
+    )
+    return {
+        "domain_id": domain["_id"],
+        "domain": domain["domain"],
+        "org_ids": org_ids,
+        "old": previous_snapshot,
+        "new": snapshot,
+        "timestamp": str(datetime.datetime.now().astimezone()),
+    }
+
+
+async def complete_web_scan(web_scan_key, results):
+    """
+    Store the results of a web scan and count it off the scans its web document is waiting for
+    :return: Tuple of the web document _id and the number of its scans still pending (None if it is not counted)
+    """
+    for attempt in range(COUNT_ATTEMPTS):
+        try:
+            completed = await db.aql(
+                """
+                LET webV = FIRST(
+                    FOR v IN 1 ANY @web_scan_id webToWebScans
+                        LIMIT 1
+                        RETURN v
+                )
+                FOR scan IN webScan
+                    FILTER scan._key == @web_scan_key
+                    // Scans stored again and web documents from before the count are not counted
+                    LET counted = scan.status != "complete" AND IS_NUMBER(webV.pendingScans)
+                    LET pendingScans = counted ? MAX([webV.pendingScans - 1, 0]) : webV.pendingScans
+                    UPDATE scan WITH @patch IN webScan
+                    LET countdown = (
+                        FOR webDoc IN (counted ? [webV] : [])
+                            // Fails with a conflict if a sibling changed the count since it was read
+                            // Web documents with every scan in are no longer swept for overdue scans
+                            UPDATE webDoc WITH {
+                                pendingScans,
+                                pendingSince: pendingScans > 0 ? webDoc.pendingSince : null
+                            } IN web OPTIONS { ignoreRevs: false }
+                    )
+                    RETURN { web_id: webV._id, pending_scans: pendingScans }
+                """,
+                bind_vars={
+                    "web_scan_id": f"webScan/{web_scan_key}",
+                    "web_scan_key": web_scan_key,
+                    "patch": {"status": "complete", "results": results},
+                },
+            )
+            break
+        except ArangoError as e:
+            # Sibling scans finishing together conflict on the count, the losing query changed nothing
+            if e.error_num != WRITE_CONFLICT or attempt == COUNT_ATTEMPTS - 1:
+                raise
+    if len(completed) == 0:
+        return None, None
+    return completed[0]["web_id"], completed[0]["pending_scans"]
+
+
+async def find_overdue_web_scans():
+    """
+    Find web documents still waiting for scans WEB_SCAN_FINALIZE_TIMEOUT seconds after they were created
+    :return: List of dicts with the web document _id, its domain _key and whether a newer web document replaced it
+    """
+    return await db.aql(
+        """
+        WITH domains, web
+        FOR webDoc IN web
+            FILTER webDoc.pendingSince != null AND webDoc.pendingSince <= @deadline
+            LIMIT @limit
+            LET domain = FIRST(
+                FOR domainV IN 1 INBOUND webDoc domainsWeb
+                    RETURN domainV
+            )
+            LET superseded = LENGTH(
+                FOR newerWebV IN 1 OUTBOUND domain domainsWeb
+                    FILTER newerWebV.timestamp > webDoc.timestamp
+                    LIMIT 1
+                    RETURN 1
+            ) > 0
+            RETURN { web_id: webDoc._id, domain_key: domain._key, superseded }
+        """,
+        bind_vars={
+            "deadline": time.time() - WEB_SCAN_FINALIZE_TIMEOUT,
+            "limit": WEB_SCAN_SWEEP_BATCH_SIZE,
+        },
+    )
+
+
+async def clear_overdue_web_scans(web_id, finalized):
+    """
+    Stop sweeping a web document for its overdue scans
+    :param finalized: Whether its domain was updated with the completed scans, scans arriving later then update it again
+    """
+    patch = {"_key": web_id.split("/")[1], "pendingSince": None}
+    if finalized:
+        # Late scans are counted off from zero, leaving none to wait for
+        patch["pendingScans"] = 0
+    await db.update("web", patch)
+
+
+async def finalize_domain(domain_key, web_id, msg):
+    """
+    Update the web statuses of a domain from the completed scans of its latest web document
+    :return: The domain status change to publish, or None
+    """
+    status_change = None
+
+    domain = await db.get("domains", domain_key)
+    previous_snapshot = summary_snapshot(domain)
+
+    # Only the fields owned by the web processor are sent, merged into the stored domain
+    domain_patch = {}
+    if web_id is not None:
+        domain_patch["latestWebScan"] = web_id
+
+    status = {}
+    if domain.get("status", None) == None:
+        status.update({"dkim": "info", "dmarc": "info", "spf": "info"})
+
+    all_web_scans = []
+    if web_id is not None:
+        all_web_scans = await db.aql(
+            """
+            WITH web, webScan
+            FOR webScanV, webScanE IN 1 ANY @web_id webToWebScans
+                FILTER webScanV.status == "complete"
+                RETURN {
+                    "scan_status": webScanV.status,
+                    "https_status": webScanV.results.connectionResults.httpsStatus,
+                    "hsts_status": webScanV.results.connectionResults.hstsStatus,
+                    "certificate_status": webScanV.results.tlsResult.certificateStatus,
+                    "tls_result": webScanV.results.tlsResult,
+                    "connection_results": webScanV.results.connectionResults,
+                    "has_entrust_certificate": webScanV.results.tlsResult.certificateChainInfo.hasEntrustCertificate,
+                    "ssl_status": webScanV.results.tlsResult.sslStatus,
+                    "protocol_status": webScanV.results.tlsResult.protocolStatus,
+                    "cipher_status": webScanV.results.tlsResult.cipherStatus,
+                    "curve_status": webScanV.results.tlsResult.curveStatus,
+                    "blocked_category": webScanV.results.connectionResults.httpsChainResult.connections[0].connection.blockedCategory,
+                }
+            """,
+            bind_vars={"web_id": web_id},
+        )
+
+    https_statuses = []
+    hsts_statuses = []
+    ssl_statuses = []
+    protocol_statuses = []
+    cipher_statuses = []
+    curve_statuses = []
+    certificate_statuses = []
+    blocked_categories = []
+    has_entrust_certificate = False
+    scan_pending = False
+    web_negative_findings = set()
+    # Tags of every scan, repeated across scans, as the summaries count them
+    web_scan_negative_tags = []
+    for web_scan in all_web_scans:
+        # Skip incomplete scans
+        if web_scan["scan_status"] != "complete":
+            scan_pending = True
+            continue
+        if web_scan["has_entrust_certificate"]:
+            has_entrust_certificate = True
+        https_statuses.append(web_scan["https_status"])
+        hsts_statuses.append(web_scan["hsts_status"])
+        ssl_statuses.append(web_scan["ssl_status"])
+        protocol_statuses.append(web_scan["protocol_status"])
+        cipher_statuses.append(web_scan["cipher_status"])
+        curve_statuses.append(web_scan["curve_status"])
+        certificate_statuses.append(web_scan["certificate_status"])
+        blocked_categories.append(web_scan["blocked_category"])
+        web_negative_findings.update(web_scan.get("tls_result", {"negativeTags": []}).get("negativeTags"))
+        web_negative_findings.update(web_scan.get("connection_results", {"negativeTags": []}).get("negativeTags"))
+        web_scan_negative_tags += (web_scan["tls_result"] or {}).get("negativeTags") or []
+        web_scan_negative_tags += (web_scan["connection_results"] or {}).get("negativeTags") or []
+
+    def get_status(statuses):
+        if "fail" in statuses:
+            return "fail"
+        elif "pass" in statuses:
+            return "pass"
+        else:
+            return "info"
+
+    status["https"] = get_status(https_statuses)
+    status["hsts"] = get_status(hsts_statuses)
+
+    status["ssl"] = get_status(ssl_statuses)
+    status["protocols"] = get_status(protocol_statuses)
+    status["ciphers"] = get_status(cipher_statuses)
+    status["curves"] = get_status(curve_statuses)
+    status["certificates"] = get_status(certificate_statuses)
+    domain_patch["status"] = status
+    domain_patch["blocked"] = any(
+        [bool(blocked_category) for blocked_category in blocked_categories]
+    )
+    domain_patch["webScanPending"] = scan_pending
+    domain_patch["hasEntrustCertificate"] = has_entrust_certificate
+    domain_patch["negativeTags"] = {"web": list(web_negative_findings)}
+    domain_patch["webScanNegativeTags"] = web_scan_negative_tags
+
+    document_updated = False
+    try:
+        await db.aql(
+            """
+            UPDATE @domain_key WITH @patch IN domains
+            """,
+            bind_vars={"domain_key": domain_key, "patch": domain_patch},
+        )
+        document_updated = True
+    except ArangoError as e:
+        logger.error(
+            f"Error while updating domain for received message: {msg}: {str(e)}"
+        )
+    # Keep the local copy in step with the stored domain for the status change
+    merge_patch(domain, domain_patch)
+
+    if PUBLISH_STATUS_CHANGES and document_updated:
+        try:
+            status_change = await build_status_change(domain, previous_snapshot)
+        except Exception as e:
+            logger.error(
+                f"Error while building status change for received message: {msg}: {str(e)}"
+            )
+
+    return status_change
+
+
+async def process_msg(msg):
     subject = msg.subject
     reply = msg.reply
     data = msg.data.decode()
@@ -112,147 +406,21 @@ def process_msg(msg):
     )
 
     processed_results = process_results(results)
+    status_change = None
+    web_id = None
+    pending_scans = None
 
     if user_key is None:
         try:
-            db.collection("webScan").update_match(
-                {"_key": web_scan_key},
-                {
-                    "status": "complete",
-                    "results": snake_to_camel(processed_results),
-                },
+            web_id, pending_scans = await complete_web_scan(
+                web_scan_key, snake_to_camel(processed_results)
             )
-
-            domain = db.collection("domains").get({"_key": domain_key})
-
-            web_doc_cursor = db.aql.execute(
-                """
-                FOR webV, e IN 1 ANY @web_scan_id webToWebScans
-                    LIMIT 1
-                    RETURN webV._id
-                """,
-                bind_vars={"web_scan_id": f"webScan/{web_scan_key}"},
-            )
-            if not web_doc_cursor.empty():
-                domain.update({"latestWebScan": web_doc_cursor.next()})
-
-            if domain.get("status", None) == None:
-                domain.update(
-                    {
-                        "status": {
-                            "certificates": "info",
-                            "ciphers": "info",
-                            "curves": "info",
-                            "dkim": "info",
-                            "dmarc": "info",
-                            "hsts": "info",
-                            "https": "info",
-                            "protocols": "info",
-                            "spf": "info",
-                            "ssl": "info",
-                        }
-                    }
+            if pending_scans:
+                logger.info(
+                    f"Waiting for {pending_scans} more web scans of '{domain}' before updating the domain"
                 )
-
-            all_web_scan_cursor = db.aql.execute(
-                """
-                WITH web, webScan
-                FOR webV,e IN 1 ANY @web_scan_id webToWebScans
-                    FOR webScanV, webScanE IN 1 ANY webV._id webToWebScans
-                        FILTER webScanV.status == "complete"
-                        RETURN {
-                            "scan_status": webScanV.status,
-                            "https_status": webScanV.results.connectionResults.httpsStatus,
-                            "hsts_status": webScanV.results.connectionResults.hstsStatus,
-                            "certificate_status": webScanV.results.tlsResult.certificateStatus,
-                            "tls_result": webScanV.results.tlsResult,
-                            "connection_results": webScanV.results.connectionResults,
-                            "has_entrust_certificate": webScanV.results.tlsResult.certificateChainInfo.hasEntrustCertificate,
-                            "ssl_status": webScanV.results.tlsResult.sslStatus,
-                            "protocol_status": webScanV.results.tlsResult.protocolStatus,
-                            "cipher_status": webScanV.results.tlsResult.cipherStatus,
-                            "curve_status": webScanV.results.tlsResult.curveStatus,
-                            "blocked_category": webScanV.results.connectionResults.httpsChainResult.connections[0].connection.blockedCategory,
-                        }
-                """,
-                bind_vars={"web_scan_id": f"webScan/{web_scan_key}"},
-            )
-
-            all_web_scans = [web_scan for web_scan in all_web_scan_cursor]
-            https_statuses = []
-            hsts_statuses = []
-            ssl_statuses = []
-            protocol_statuses = []
-            cipher_statuses = []
-            curve_statuses = []
-            certificate_statuses = []
-            blocked_categories = []
-            has_entrust_certificate = False
-            scan_pending = False
-            web_negative_findings = set()
-            for web_scan in all_web_scans:
-                # Skip incomplete scans
-                if web_scan["scan_status"] != "complete":
-                    scan_pending = True
-                    continue
-                if web_scan["has_entrust_certificate"]:
-                    has_entrust_certificate = True
-                https_statuses.append(web_scan["https_status"])
-                hsts_statuses.append(web_scan["hsts_status"])
-                ssl_statuses.append(web_scan["ssl_status"])
-                protocol_statuses.append(web_scan["protocol_status"])
-                cipher_statuses.append(web_scan["cipher_status"])
-                curve_statuses.append(web_scan["curve_status"])
-                certificate_statuses.append(web_scan["certificate_status"])
-                blocked_categories.append(web_scan["blocked_category"])
-                web_negative_findings.update(web_scan.get("tls_result", {"negativeTags": []}).get("negativeTags"))
-                web_negative_findings.update(web_scan.get("connection_results", {"negativeTags": []}).get("negativeTags"))
-
-            def get_status(statuses):
-                if "fail" in statuses:
-                    return "fail"
-                elif "pass" in statuses:
-                    return "pass"
-                else:
-                    return "info"
-
-            domain["status"]["https"] = get_status(https_statuses)
-            domain["status"]["hsts"] = get_status(hsts_statuses)
-
-            domain["status"]["ssl"] = get_status(ssl_statuses)
-            domain["status"]["protocols"] = get_status(protocol_statuses)
-            domain["status"]["ciphers"] = get_status(cipher_statuses)
-            domain["status"]["curves"] = get_status(curve_statuses)
-            domain["status"]["certificates"] = get_status(certificate_statuses)
-            domain["blocked"] = any(
-                [bool(blocked_category) for blocked_category in blocked_categories]
-            )
-            domain["webScanPending"] = scan_pending
-            domain["hasEntrustCertificate"] = has_entrust_certificate
-            domain["negativeTags"]["web"] = list(web_negative_findings)
-
-            del domain["_rev"]
-            try:
-                db.collection("domains").update(domain)
-            except DocumentUpdateError as e:
-                error_str = str(e)
-                start_retry = time.monotonic()
-                document_updated = False
-                # Retry for 5 seconds in case another process is updating the same document
-                while time.monotonic() - start_retry < 5:
-                    try:
-                        db.collection("domains").update(domain)
-                        document_updated = True
-                        break
-                    except DocumentUpdateError as while_e:
-                        time.sleep(0.1)
-                        error_str = str(while_e)
-                        continue
-                if not document_updated:
-                    logger.error(
-                        f"Error while updating domain after retrying for received message: {msg}: {error_str}"
-                    )
-
+            else:
+                status_change = await finalize_domain(domain_key, web_id, msg)
         except Exception as e:
             logger.error(
                 f"Error while inserting processed results for received message: {msg}: {str(e)} \n\nFull traceback: {traceback.format_exc()}"
@@ -265,6 +433,7 @@ def process_msg(msg):
         "user_key": user_key,
         "domain_key": domain_key,
         "shared_id": shared_id,
+        "status_change": status_change,
     }
 
     return formatted_scan_data
@@ -280,6 +449,8 @@ async def processor_service():
 
     context = Context()
 
+    await db.connect()
+
     async def error_cb(error):
         logger.error(f"Uncaught error in callback: {error}")
 
@@ -325,16 +496,104 @@ async def processor_service():
             lambda: asyncio.create_task(ask_exit(signal_name)),
         )
 
-    async def handle_finished_scan(fut, original_msg, semaphore):
+    async def log_pool_stats():
+        while not context.should_exit:
+            await asyncio.sleep(DB_POOL_STATS_INTERVAL)
+            logger.info(f"Database connection pool statistics: {db.pool_stats()}")
+
+    loop.create_task(log_pool_stats())
+
+    try:
+        # Overdue web documents are found through a sparse index of those still waiting for scans
+        await db.ensure_index(
+            "web",
+            {
+                "type": "persistent",
+                "fields": ["pendingSince"],
+                "sparse": True,
+                "inBackground": True,
+            },
+        )
+    except Exception as e:
+        logger.error(f"Error while ensuring the index of pending web scans: {e}")
+
+    async def publish_status_change(status_change, msg_id, original_msg):
+        try:
+            await js.publish(
+                stream="SCANS",
+                subject=STATUS_CHANGE_SUBJECT,
+                payload=json.dumps(status_change).encode(),
+                headers={"Nats-Msg-Id": msg_id},
+            )
+        except Exception as e:
+            # Summaries are recomputed daily, a missed change must not block the scan
+            logger.error(
+                f"Error while publishing status change: {status_change}: for received message: {original_msg}: {e}"
+            )
+
+    async def finalize_overdue_web_scans():
+        # Web documents waiting on scans that never arrive, e.g. scans the web scanner gave up on,
+        # are found in the database so that a restart of the processor does not leave them pending
+        while not context.should_exit:
+            await asyncio.sleep(WEB_SCAN_SWEEP_INTERVAL)
+            try:
+                overdue = await find_overdue_web_scans()
+            except Exception as e:
+                logger.error(f"Error while finding overdue web scans: {e}")
+                continue
+
+            for web_scan in overdue:
+                web_id = web_scan["web_id"]
+                finalized = (
+                    web_scan["domain_key"] is not None and not web_scan["superseded"]
+                )
+                if finalized:
+                    logger.warning(
+                        f"Web scans of '{web_id}' still pending after {WEB_SCAN_FINALIZE_TIMEOUT} seconds, updating the domain with the completed scans"
+                    )
+                    try:
+                        status_change = await finalize_domain(
+                            web_scan["domain_key"], web_id, web_id
+                        )
+                    except Exception as e:
+                        # Left pending, the next sweep tries again
+                        logger.error(
+                            f"Error while updating domain of overdue web scans '{web_id}': {e}"
+                        )
+                        continue
+                    if status_change is not None:
+                        # Processors sweeping the same web document publish the change under the same id
+                        await publish_status_change(
+                            status_change,
+                            f"{status_change['domain_id']}:{web_id}:timeout",
+                            web_id,
+                        )
+
+                try:
+                    await clear_overdue_web_scans(web_id, finalized)
+                except Exception as e:
+                    logger.error(
+                        f"Error while clearing overdue web scans '{web_id}': {e}"
+                    )
+
+    async def handle_scan(original_msg, semaphore):
         try:
-            await fut
-            res = fut.result()
-            if isinstance(res, Exception):
+            try:
+                res = await process_msg(original_msg)
+            except Exception as e:
                 logger.error(
-                    f"Uncaught scan error for received message: {original_msg}: {res}"
+                    f"Uncaught scan error for received message: {original_msg}: {e}"
                 )
                 return
 
+            status_change = res.get("status_change") if res else None
+            if status_change is not None:
+                await publish_status_change(
+                    status_change,
+                    status_change_msg_id(status_change, original_msg),
+                    original_msg,
+                )
+
             try:
                 logger.debug(f"Acknowledging message: {original_msg}")
                 await original_msg.ack()
@@ -351,55 +610,62 @@ async def processor_service():
                     f"Error while releasing semaphore for received message: {original_msg}: {e}"
                 )
 
-    sem = asyncio.BoundedSemaphore(SCAN_THREAD_COUNT)
+    sem = asyncio.BoundedSemaphore(MAX_IN_FLIGHT_MESSAGES)
+    # Keep references to running scans so they are not garbage collected
+    tasks = set()
+    sweep_task = loop.create_task(finalize_overdue_web_scans())
 
-    with ThreadPoolExecutor() as executor:
-        while True:
-            if context.should_exit:
-                break
-            if nc.is_closed:
-                logger.error("Connection to NATS is closed.")
-                break
+    while True:
+        if context.should_exit:
+            break
+        if nc.is_closed:
+            logger.error("Connection to NATS is closed.")
+            break
 
-            await sem.acquire()
+        await sem.acquire()
 
-            if context.should_exit:
-                break
-            if nc.is_closed:
-                logger.error("Connection to NATS is closed.")
-                break
+        if context.should_exit:
+            break
+        if nc.is_closed:
+            logger.error("Connection to NATS is closed.")
+            break
 
+        try:
+            logger.debug("Fetching message...")
+            msgs = await context.sub.fetch(batch=1, timeout=1)
+            msg = msgs[0]
+            logger.debug(f"Received message: {msg}")
+        except NatsTimeoutError:
+            logger.debug("No messages available...")
             try:
-                logger.debug("Fetching message...")
-                msgs = await context.sub.fetch(batch=1, timeout=1)
-                msg = msgs[0]
-                logger.debug(f"Received message: {msg}")
-            except NatsTimeoutError:
-                logger.debug("No messages available...")
-                try:
-                    sem.release()
-                except Exception as e:
-                    logger.error(
-                        f"Error while releasing semaphore for received message: {msg}: {e}"
-                    )
-                continue
+                sem.release()
+            except Exception as e:
+                logger.error(
+                    f"Error while releasing semaphore for received message: {msg}: {e}"
+                )
+            continue
 
+        try:
+            task = loop.create_task(handle_scan(original_msg=msg, semaphore=sem))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        except Exception as e:
+            logger.error(f"Error while queueing scan, releasing semaphore: {e}")
             try:
-                future = loop.run_in_executor(executor, process_msg, msg)
-                loop.create_task(
-                    handle_finished_scan(fut=future, original_msg=msg, semaphore=sem)
-                )
+                sem.release()
             except Exception as e:
-                logger.error(f"Error while queueing scan, releasing semaphore: {e}")
-                try:
-                    sem.release()
-                except Exception as e:
-                    logger.error(
-                        f"Error while releasing semaphore for received message: {msg}: {e}"
-                    )
+                logger.error(
+                    f"Error while releasing semaphore for received message: {msg}: {e}"
+                )
 
     logger.info("Service is shutting down...")
 
+    # Web documents still waiting for scans are finalized by the next sweep of any processor
+    sweep_task.cancel()
+    if tasks:
+        await asyncio.wait(tasks)
+    await db.close()
+
     await nc.flush()
     logger.info("Flushed NATS connection...")
     await nc.close()
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import os
+import time
+
+import pytest
+from dotenv import load_dotenv
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "test.env"))
+
+DB_URL = os.getenv("DB_URL", "http://localhost:8530")
+DB_USER = os.getenv("DB_USER", "root")
+DB_PASS = os.getenv("DB_PASS", "test")
+DB_NAME = os.path.basename(__file__).split(".")[0]
+
+os.environ.setdefault("DB_URL", DB_URL)
+os.environ.setdefault("DB_NAME", DB_NAME)
+
+import service
+from async_arango import ArangoError, AsyncArangoDatabase
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "..", "benchmark_fixtures")
+
+
+def scan_results(fixture):
+    with open(os.path.join(FIXTURES, f"{fixture}.json")) as f:
+        return json.load(f)["results"]
+
+
+class Msg:
+    def __init__(self, web_scan_key, fixture):
+        self.subject = "scans.web_scanner_results"
+        self.reply = None
+        self.data = json.dumps(
+            {
+                "domain": "domain1.gc.ca",
+                "domain_key": "domain1",
+                "web_scan_key": web_scan_key,
+                "ip_address": "127.0.0.1",
+                "results": scan_results(fixture),
+            }
+        ).encode()
+
+
+async def create_test_db():
+    sys_db = AsyncArangoDatabase(DB_URL, "_system", DB_USER, DB_PASS)
+    await sys_db.connect()
+    try:
+        try:
+            await sys_db.request("DELETE", f"/database/{DB_NAME}")
+        except ArangoError as e:
+            if e.http_code != 404:
+                raise
+        await sys_db.request("POST", "/database", body={"name": DB_NAME})
+    finally:
+        await sys_db.close()
+
+    db = AsyncArangoDatabase(DB_URL, DB_NAME, DB_USER, DB_PASS)
+    await db.connect()
+    for name in ("domains", "web", "webScan"):
+        await db.request("POST", "/collection", body={"name": name})
+    for name in ("domainsWeb", "webToWebScans"):
+        await db.request("POST", "/collection", body={"name": name, "type": 3})
+    return db
+
+
+async def delete_test_db(db):
+    await db.close()
+    sys_db = AsyncArangoDatabase(DB_URL, "_system", DB_USER, DB_PASS)
+    await sys_db.connect()
+    try:
+        await sys_db.request("DELETE", f"/database/{DB_NAME}")
+    finally:
+        await sys_db.close()
+
+
+class TestWebScanTimeout:
+    @pytest.fixture
+    def web_scans(self, monkeypatch):
+        async def run(test):
+            db = await create_test_db()
+            monkeypatch.setattr(service, "db", db)
+            try:
+                await db.insert(
+                    "domains",
+                    {"_key": "domain1", "domain": "domain1.gc.ca", "status": {"dmarc": "pass"}},
+                )
+                # Waiting for two scans since before the timeout
+                await db.insert(
+                    "web",
+                    {
+                        "_key": "web1",
+                        "timestamp": "2024-01-01T12:00:00+00:00",
+                        "pendingScans": 2,
+                        "pendingSince": time.time() - service.WEB_SCAN_FINALIZE_TIMEOUT - 1,
+                    },
+                )
+                await db.insert("domainsWeb", {"_from": "domains/domain1", "_to": "web/web1"})
+                for key in ("scan1", "scan2"):
+                    await db.insert("webScan", {"_key": key, "status": "pending"})
+                    await db.insert("webToWebScans", {"_from": "web/web1", "_to": f"webScan/{key}"})
+                await test(db)
+            finally:
+                await delete_test_db(db)
+
+        return lambda test: asyncio.run(run(test))
+
+    def test_late_scan_after_sweep_updates_domain(self, web_scans):
+        async def test(db):
+            await service.process_msg(Msg("scan1", "modern"))
+            assert "latestWebScan" not in await db.get("domains", "domain1")
+
+            overdue = await service.find_overdue_web_scans()
+            assert overdue == [{"web_id": "web/web1", "domain_key": "domain1", "superseded": False}]
+            await service.finalize_domain("domain1", "web/web1", "web/web1")
+            await service.clear_overdue_web_scans("web/web1", True)
+
+            domain = await db.get("domains", "domain1")
+            assert domain["latestWebScan"] == "web/web1"
+            assert domain["status"]["https"] == "pass"
+            assert await service.find_overdue_web_scans() == []
+
+            # The scan the sweep gave up on arrives afterwards
+            await service.process_msg(Msg("scan2", "legacy"))
+
+            domain = await db.get("domains", "domain1")
+            assert domain["status"]["https"] == "fail"
+            # Reported by both scans, counted once for each like the full summaries computation
+            assert service.summary_snapshot(domain)["negative_tags"].count("ssl17") == 2
+            web = await db.get("web", "web1")
+            assert web["pendingScans"] == 0 and web["pendingSince"] is None
+
+        web_scans(test)
+
+    def test_sweep_of_superseded_web_document_keeps_count(self, web_scans):
+        async def test(db):
+            await db.insert("web", {"_key": "web2", "timestamp": "2024-01-02T12:00:00+00:00"})
+            await db.insert("domainsWeb", {"_from": "domains/domain1", "_to": "web/web2"})
+
+            overdue = await service.find_overdue_web_scans()
+            assert overdue == [{"web_id": "web/web1", "domain_key": "domain1", "superseded": True}]
+            await service.clear_overdue_web_scans("web/web1", False)
+
+            web = await db.get("web", "web1")
+            assert web["pendingScans"] == 2 and web["pendingSince"] is None
+
+            # Late scans of the older web document do not update the domain until all are in
+            await service.process_msg(Msg("scan1", "modern"))
+            assert "latestWebScan" not in await db.get("domains", "domain1")
+
+        web_scans(test)
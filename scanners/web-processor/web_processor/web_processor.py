@@ -1,6 +1,7 @@
 import os
 import json
 import logging
+from types import MappingProxyType
 from urllib.parse import urlparse
 
 logger = logging.getLogger(__name__)
@@ -10,8 +11,40 @@ PQC_SCAN_ENABLED = os.getenv("PQC_SCAN_ENABLED", "false").lower() in ("true", "1
 current_directory = os.path.dirname(os.path.realpath(__file__))
 # Opening JSON file from:
 # https://raw.githubusercontent.com/CybercentreCanada/ITSP.40.062/main/transport-layer-security/tls-guidance.json
-guidance_file = open(f"{current_directory}/tls-guidance.json")
-guidance = json.load(guidance_file)
+with open(f"{current_directory}/tls-guidance.json") as guidance_file:
+    guidance = json.load(guidance_file)
+
+
+def build_strength_lookup(tiers):
+    # Map each name to the strength of the first (most preferred) tier listing it
+    strengths = {}
+    for strength, names in tiers:
+        for name in names:
+            strengths.setdefault(name, strength)
+    return MappingProxyType(strengths)
+
+
+# Guidance is compiled once at import so each cipher suite and curve is a single dict lookup
+CIPHER_STRENGTHS = build_strength_lookup(
+    [
+        ("strong", guidance["ciphers"]["1.2"]["recommended"]),
+        ("strong", guidance["ciphers"]["1.3"]["recommended"]),
+        ("acceptable", guidance["ciphers"]["1.2"]["sufficient"]),
+        ("acceptable", guidance["ciphers"]["1.3"]["sufficient"]),
+        ("phase_out", guidance["ciphers"]["1.2"]["phase_out"]),
+    ]
+)
+CURVE_STRENGTHS = build_strength_lookup(
+    [
+        ("strong", guidance["curves"]["recommended"]),
+        ("acceptable", guidance["curves"]["sufficient"]),
+        ("phase_out", guidance["curves"]["phase_out"]),
+    ]
+)
+ACCEPTED_SIGNATURE_ALGORITHMS = tuple(
+    guidance["signature_algorithms"]["recommended"]
+    + guidance["signature_algorithms"]["sufficient"]
+)
 
 
 def process_tls_results(tls_results, web_server_present):
@@ -69,21 +102,10 @@ def process_tls_results(tls_results, web_server_present):
             if "3DES" in cipher_suite:
                 negative_tags.append("ssl4")
 
-            if cipher_suite in (
-                guidance["ciphers"]["1.2"]["recommended"]
-                + guidance["ciphers"]["1.3"]["recommended"]
-            ):
-                strength = "strong"
-            elif cipher_suite in (
-                guidance["ciphers"]["1.2"]["sufficient"]
-                + guidance["ciphers"]["1.3"]["sufficient"]
-            ):
-                strength = "acceptable"
-            elif cipher_suite in guidance["ciphers"]["1.2"]["phase_out"]:
-                strength = "phase_out"
+            strength = CIPHER_STRENGTHS.get(cipher_suite, "weak")
+            if strength == "phase_out":
                 neutral_tags.append("ssl23")
-            else:
-                strength = "weak"
+            elif strength == "weak":
                 negative_tags.append("ssl6")
 
             accepted_cipher_suites[protocol].append(
@@ -93,15 +115,10 @@ def process_tls_results(tls_results, web_server_present):
     weak_curve = False
     result_accepted_elliptic_curves = tls_results.get("accepted_elliptic_curves", [])
     for curve in result_accepted_elliptic_curves:
-        if curve.lower() in guidance["curves"]["recommended"]:
-            strength = "strong"
-        elif curve.lower() in guidance["curves"]["sufficient"]:
-            strength = "acceptable"
-        elif curve.lower() in guidance["curves"]["phase_out"]:
-            strength = "phase_out"
+        strength = CURVE_STRENGTHS.get(curve.lower(), "weak")
+        if strength == "phase_out":
             neutral_tags.append("ssl22")
-        else:
-            strength = "weak"
+        elif strength == "weak":
             weak_curve = True
             negative_tags.append("ssl17")
 
@@ -170,10 +187,7 @@ def process_tls_results(tls_results, web_server_present):
         pass
 
     if signature_algorithm is not None:
-        for algorithm in (
-            guidance["signature_algorithms"]["recommended"]
-            + guidance["signature_algorithms"]["sufficient"]
-        ):
+        for algorithm in ACCEPTED_SIGNATURE_ALGORITHMS:
             if signature_algorithm.lower() in algorithm:
                 # positive_tags.append("ssl5")
                 break
@@ -0,0 +1,247 @@
+import asyncio
+import contextlib
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+
+from nats.js.errors import KeyWrongLastSequenceError, KeyNotFoundError
+from nats.js.kv import KeyValue
+
+logger = logging.getLogger(__name__)
+
+# Lease standing for the slots counted by web scanners from before leases, see IPSlotLeaser
+LEGACY_LEASE_ID = "legacy"
+
+
+@dataclass
+class IPSlotLease:
+    # Slots reserved for this instance in the KV bucket
+    leased: int = 0
+    # Slots currently used by scans running on this instance
+    in_use: int = 0
+    # Unix time at which other instances may reclaim the lease
+    expires_at: float = 0
+
+
+@dataclass
+class IPSlotStats:
+    local_acquires: int = 0
+    kv_acquires: int = 0
+    denied: int = 0
+    kv_conflicts: int = 0
+    kv_errors: int = 0
+    kv_wait_seconds: float = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+
+class IPSlotLeaser:
+    """
+    Limits the number of concurrent scans of an IP address across all web scanner instances.
+
+    Each IP address has an entry in the KV bucket recording the slots leased by every instance:
+    {"leases": {"<instance_id>": {"slots": 3, "expires_at": 1700000000}}, "count": 3, "updated_at": 1700000000}
+
+    An instance leases a block of slots at a time and hands them out locally, only going back to
+    the KV bucket once its lease is used up or about to expire. Leases are renewed while in use
+    and returned when idle. Leases of crashed instances expire after lease_ttl seconds.
+
+    Web scanners from before leases stored only {"count": 3, "updated_at": 1700000000} and keep
+    doing so while both versions run during a rollout. Such a count is read as a lease of its own
+    that expires lease_ttl seconds after updated_at, and count is written with the total of the
+    leases so that older scanners still see the slots in use. Once no older scanner is left the
+    legacy leases expire by themselves, no migration of the bucket is needed.
+    """
+
+    def __init__(
+        self,
+        kv: KeyValue,
+        instance_id: str,
+        max_slots_per_ip: int,
+        block_size: int = 2,
+        lease_ttl: int = 60,
+        max_retries: int = 5,
+    ):
+        self.kv = kv
+        self.instance_id = instance_id
+        self.max_slots_per_ip = max_slots_per_ip
+        self.block_size = max(block_size, 1)
+        self.lease_ttl = lease_ttl
+        self.max_retries = max_retries
+        self.leases: dict[str, IPSlotLease] = {}
+        self.stats = IPSlotStats()
+        # KV updates are serialized per IP address, other addresses are not held up by them
+        self._kv_locks: dict[str, asyncio.Lock] = {}
+        self._kv_lock_users: dict[str, int] = {}
+
+    def _lease_is_usable(self, lease: IPSlotLease) -> bool:
+        # Leave a third of the TTL for the lease to be renewed before others may reclaim it
+        return lease.expires_at - time.time() > self.lease_ttl / 3
+
+    async def try_acquire(self, ip: str) -> bool:
+        lease = self.leases.get(ip)
+        if lease and lease.in_use < lease.leased and self._lease_is_usable(lease):
+            lease.in_use += 1
+            self.stats.local_acquires += 1
+            return True
+
+        acquired = await self._update_lease(
+            ip, lambda lease, available: self._slots_to_acquire(lease, available)
+        )
+        if acquired:
+            self.leases[ip].in_use += 1
+            self.stats.kv_acquires += 1
+        else:
+            self.stats.denied += 1
+            self._forget_if_unused(ip)
+        return acquired
+
+    def release(self, ip: str) -> None:
+        lease = self.leases.get(ip)
+        if lease is None or lease.in_use == 0:
+            logger.info(f"No IP slot in use for {ip} to release")
+            return
+        lease.in_use -= 1
+
+    async def maintain(self) -> None:
+        """Renew leases that are in use and return idle leases to the KV bucket"""
+        for ip, lease in list(self.leases.items()):
+            if lease.in_use == 0:
+                # A scan may take a slot while the KV entry is read, only return the lease if it is still idle
+                if await self._update_lease(
+                    ip, lambda lease, available: 0 if lease.in_use == 0 else None
+                ):
+                    self._forget_if_unused(ip)
+            elif lease.expires_at - time.time() < self.lease_ttl * 2 / 3:
+                await self._update_lease(
+                    ip,
+                    lambda lease, available: max(
+                        lease.in_use, min(lease.leased, available)
+                    ),
+                )
+
+    async def release_all(self) -> None:
+        for ip in list(self.leases.keys()):
+            await self._update_lease(ip, lambda lease, available: 0)
+        self.leases.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            "leased_ips": len(self.leases),
+            "leased_slots": sum(lease.leased for lease in self.leases.values()),
+            "slots_in_use": sum(lease.in_use for lease in self.leases.values()),
+            "local_acquires": self.stats.local_acquires,
+            "kv_acquires": self.stats.kv_acquires,
+            "denied": self.stats.denied,
+            "kv_conflicts": self.stats.kv_conflicts,
+            "kv_errors": self.stats.kv_errors,
+            "kv_wait_seconds": round(self.stats.kv_wait_seconds, 3),
+        }
+
+    def _slots_to_acquire(self, lease: IPSlotLease, available: int):
+        needed = lease.in_use + 1
+        if available < needed:
+            return None
+        return min(available, lease.in_use + self.block_size)
+
+    def _forget_if_unused(self, ip: str) -> None:
+        lease = self.leases.get(ip)
+        if lease is not None and lease.in_use == 0 and lease.leased == 0:
+            del self.leases[ip]
+
+    def _read_leases(self, entry_data: dict) -> dict:
+        if "leases" in entry_data:
+            return entry_data["leases"]
+        # Written by an older web scanner, its count stands for scans that are not tracked by instance
+        count = entry_data.get("count", 0)
+        if count <= 0:
+            return {}
+        updated_at = entry_data.get("updated_at", time.time())
+        return {
+            LEGACY_LEASE_ID: {"slots": count, "expires_at": updated_at + self.lease_ttl}
+        }
+
+    @contextlib.asynccontextmanager
+    async def _ip_lock(self, ip: str):
+        lock = self._kv_locks.setdefault(ip, asyncio.Lock())
+        self._kv_lock_users[ip] = self._kv_lock_users.get(ip, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            # Drop the lock once no update of the IP address holds or waits for it
+            self._kv_lock_users[ip] -= 1
+            if self._kv_lock_users[ip] == 0:
+                del self._kv_lock_users[ip]
+                del self._kv_locks[ip]
+
+    async def _update_lease(self, ip: str, slots_for) -> bool:
+        """
+        Write this instance's lease for the IP address with a compare-and-set update.
+        slots_for(lease, available) returns the number of slots to lease given the slots not
+        leased by other instances, 0 to return the lease or None to give up.
+        """
+        start_time = time.monotonic()
+        try:
+            async with self._ip_lock(ip):
+                lease = self.leases.setdefault(ip, IPSlotLease())
+                for _ in range(self.max_retries):
+                    try:
+                        try:
+                            entry = await self.kv.get(ip)
+                            entry_data = json.loads(entry.value.decode())
+                            revision = entry.revision
+                        except KeyNotFoundError:
+                            entry_data = {}
+                            revision = None
+
+                        now = time.time()
+                        leases = {
+                            instance_id: other_lease
+                            for instance_id, other_lease in self._read_leases(entry_data).items()
+                            if instance_id != self.instance_id
+                            and other_lease.get("expires_at", 0) > now
+                        }
+                        available = self.max_slots_per_ip - sum(
+                            other_lease.get("slots", 0) for other_lease in leases.values()
+                        )
+
+                        slots = slots_for(lease, available)
+                        if slots is None:
+                            return False
+
+                        # Stop handing out slots that are about to be returned while the update is sent
+                        lease.leased = min(lease.leased, slots)
+
+                        expires_at = now + self.lease_ttl
+                        if slots > 0:
+                            leases[self.instance_id] = {
+                                "slots": slots,
+                                "expires_at": expires_at,
+                            }
+                        count = sum(
+                            other_lease.get("slots", 0) for other_lease in leases.values()
+                        )
+                        payload = json.dumps(
+                            {"leases": leases, "count": count, "updated_at": int(now)}
+                        ).encode()
+
+                        if revision is None:
+                            await self.kv.create(ip, payload)
+                        else:
+                            await self.kv.update(ip, payload, revision)
+
+                        lease.leased = slots
+                        lease.expires_at = expires_at if slots > 0 else 0
+                        return True
+                    except KeyWrongLastSequenceError:
+                        logger.debug(f"Wrong last sequence while leasing IP slots for {ip}")
+                        self.stats.kv_conflicts += 1
+                        await asyncio.sleep(0.1)
+                    except Exception as e:
+                        logger.error(f"Unexpected error while leasing IP slots for {ip}: {e}")
+                        self.stats.kv_errors += 1
+                        await asyncio.sleep(0.1)
+                return False
+        finally:
+            self.stats.kv_wait_seconds += time.monotonic() - start_time
@@ -1,4 +1,5 @@
 import re
+from concurrent.futures import Executor
 from typing import Optional, Union
 from urllib.parse import urlsplit
 import urllib3
@@ -6,7 +7,7 @@ import urllib3
 import logging
 import requests
 from requests import Response, PreparedRequest
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, InitVar
 
 from scan.endpoint_chain_scanner.constants import DEFAULT_REQUEST_HEADERS, TIMEOUT
 from scan.endpoint_chain_scanner.security_txt_check import fetch_security_txt
@@ -248,17 +249,31 @@ class EndpointChainScanResult:
     ip_address: str
     http_chain_result: Optional[ChainResult] = field(init=False)
     https_chain_result: Optional[ChainResult] = field(init=False)
+    # When provided, the HTTPS chain runs in the executor while the HTTP chain runs in the calling thread
+    executor: InitVar[Optional[Executor]] = None
+
+    def __post_init__(self, executor):
+        https_future = None
+        if executor is not None:
+            https_future = executor.submit(
+                ChainResult, scheme="https", domain=self.domain, ip_address=self.ip_address
+            )
 
-    def __post_init__(self):
         self.http_chain_result = ChainResult(
             scheme="http", domain=self.domain, ip_address=self.ip_address
         )
-        self.https_chain_result = ChainResult(
-            scheme="https", domain=self.domain, ip_address=self.ip_address
-        )
+
+        if https_future is not None:
+            self.https_chain_result = https_future.result()
+        else:
+            self.https_chain_result = ChainResult(
+                scheme="https", domain=self.domain, ip_address=self.ip_address
+            )
 
 
-def scan_chain(domain, ip_address) -> EndpointChainScanResult:
-    endpoint_scan_result = EndpointChainScanResult(domain=domain, ip_address=ip_address)
+def scan_chain(domain, ip_address, executor=None) -> EndpointChainScanResult:
+    endpoint_scan_result = EndpointChainScanResult(
+        domain=domain, ip_address=ip_address, executor=executor
+    )
 
     return endpoint_scan_result
@@ -1,16 +1,32 @@
-import concurrent
 import os
 import socket
-from concurrent.futures import ProcessPoolExecutor
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import asdict
 
+from scan.worker_pool import RecyclingProcessPool
 from scan.tls_scanner.tls_scanner import scan_tls
 from scan.tls_scanner.pqc_scanner import scan_pqc
 from scan.endpoint_chain_scanner.endpoint_chain_scanner import scan_chain
 
 PQC_SCAN_ENABLED = os.getenv("PQC_SCAN_ENABLED", "false").lower() in ("true", "1")
 
+# Maximum number of probes (TLS scan, HTTP chain, HTTPS chain) run at the same time against one target.
+# Each IP address can be scanned by MAX_SLOTS_PER_IP scans at once, so keep the product of both polite.
+WEB_SCAN_TARGET_CONCURRENCY = int(os.getenv("WEB_SCAN_TARGET_CONCURRENCY", 3))
+
+TLS_WORKER_COUNT = int(os.getenv("TLS_WORKER_COUNT", os.getenv("SCAN_THREAD_COUNT", 1)))
+TLS_WORKER_MAX_TASKS = int(os.getenv("TLS_WORKER_MAX_TASKS", 50))
+TLS_WORKER_MAX_RSS_MB = int(os.getenv("TLS_WORKER_MAX_RSS_MB", 1024))
+
+# TLS scans run in worker processes as sslyze has a memory leak. Workers are kept
+# between scans and recycled after a number of scans or when their memory grows too large.
+TLS_WORKER_POOL = RecyclingProcessPool(
+    max_workers=TLS_WORKER_COUNT,
+    max_tasks_per_child=TLS_WORKER_MAX_TASKS,
+    max_rss_bytes=TLS_WORKER_MAX_RSS_MB * 2**20,
+)
+
 
 def scan_web(domain, ip_address=None, pqc_enabled=None):
     timestamp = str(datetime.datetime.now().astimezone())
@@ -37,12 +53,17 @@ def scan_web(domain, ip_address=None, pqc_enabled=None):
         # Prefer IPv4 if available, otherwise use IPv6
         ip_address = ipv4_address or ipv6_address
 
-    chain_result = scan_chain(domain, ip_address=ip_address)
-
-    # Run TLS check in process pool as sslyze has a memory leak
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        future = executor.submit(scan_tls, domain=domain, ip_address=ip_address)
-        tls_result = future.result()
+    if WEB_SCAN_TARGET_CONCURRENCY > 1:
+        # The calling thread runs one probe, the executor runs the others
+        with ThreadPoolExecutor(max_workers=WEB_SCAN_TARGET_CONCURRENCY - 1) as executor:
+            tls_future = executor.submit(
+                TLS_WORKER_POOL.run, scan_tls, domain=domain, ip_address=ip_address
+            )
+            chain_result = scan_chain(domain, ip_address=ip_address, executor=executor)
+            tls_result = tls_future.result()
+    else:
+        chain_result = scan_chain(domain, ip_address=ip_address)
+        tls_result = TLS_WORKER_POOL.run(scan_tls, domain=domain, ip_address=ip_address)
 
     results = {
         "tls_result": asdict(tls_result),
@@ -0,0 +1,64 @@
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+
+def run_and_measure(fn, kwargs):
+    """Run fn in the worker and report the worker's resident memory afterwards"""
+    result = fn(**kwargs)
+    return result, psutil.Process().memory_info().rss
+
+
+class RecyclingProcessPool:
+    """
+    Long-lived process pool for work that leaks memory (e.g. sslyze).
+
+    Each worker is replaced after max_tasks_per_child tasks. If a worker reports a
+    resident memory above max_rss_bytes after a task, or the pool breaks, the whole
+    pool is retired: tasks already running finish and a fresh pool is started for
+    the next submission.
+    """
+
+    def __init__(self, max_workers, max_tasks_per_child, max_rss_bytes):
+        self.max_workers = max_workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self.max_rss_bytes = max_rss_bytes
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _retire(self, executor, reason):
+        with self._lock:
+            if self._executor is not executor:
+                # Already replaced by another thread
+                return
+            logger.warning(f"Recycling worker pool: {reason}")
+            self._executor = None
+        executor.shutdown(wait=False)
+
+    def run(self, fn, **kwargs):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    max_tasks_per_child=self.max_tasks_per_child,
+                )
+            executor = self._executor
+            future = executor.submit(run_and_measure, fn, kwargs)
+
+        try:
+            result, rss = future.result()
+        except BrokenProcessPool as e:
+            self._retire(executor, f"pool is broken: {e}")
+            raise
+
+        if rss > self.max_rss_bytes:
+            self._retire(
+                executor,
+                f"worker memory {rss // 2**20} MiB exceeds {self.max_rss_bytes // 2**20} MiB",
+            )
+        return result
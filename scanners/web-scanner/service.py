@@ -18,9 +18,9 @@ from concurrent.futures import ThreadPoolExecutor
 from nats.aio.msg import Msg
 from nats.js import JetStreamContext
 from nats.js.api import AckPolicy, ConsumerConfig
-from nats.js.errors import KeyWrongLastSequenceError, KeyNotFoundError
 from nats.js.kv import KeyValue
 
+from ip_slots import IPSlotLeaser
 from scan.web_scanner import scan_web
 import nats
 from nats.errors import TimeoutError as NatsTimeoutError
@@ -56,6 +56,11 @@ SERVERS = SERVER_LIST.split(",")
 
 SCAN_THREAD_COUNT = int(os.getenv("SCAN_THREAD_COUNT", 1))
 MAX_SLOTS_PER_IP = int(os.getenv("MAX_SLOTS_PER_IP", 2))
+# Slots leased from the KV bucket at a time, handed out locally until used up
+IP_SLOT_LEASE_BLOCK_SIZE = int(os.getenv("IP_SLOT_LEASE_BLOCK_SIZE", 2))
+# Seconds until the leased slots of an instance can be reclaimed by others (e.g. after a crash)
+IP_SLOT_LEASE_TTL = int(os.getenv("IP_SLOT_LEASE_TTL", 60))
+IP_SLOT_STATS_INTERVAL = int(os.getenv("IP_SLOT_STATS_INTERVAL", 300))
 
 TASK_QUEUE = asyncio.Queue()
 SEMAPHORE = asyncio.BoundedSemaphore(SCAN_THREAD_COUNT)
@@ -120,102 +125,6 @@ def run_scan(msg):
     return formatted_results
 
 
-async def try_acquire_ip_slot(kv: KeyValue, ip: str) -> bool:
-    # Try to acquire a slot to scan the IP address
-    max_retries = 5
-    retries = 0
-
-    while retries < max_retries:
-        try:
-            entry = await kv.get(ip)
-            entry_data = json.loads(entry.value.decode())
-            count = entry_data.get("count", 0)
-
-            if count < MAX_SLOTS_PER_IP:
-                try:
-                    await kv.update(
-                        ip,
-                        json.dumps(
-                            {"count": count + 1, "updated_at": int(time.time())}
-                        ).encode(),
-                        entry.revision,
-                    )
-                    return True
-                except KeyWrongLastSequenceError:
-                    logger.debug(f"Wrong last sequence for {ip}: {entry.revision}")
-                    retries += 1
-                    await asyncio.sleep(0.1)
-                    continue
-                except Exception as e:
-                    logger.error(f"Unexpected error acquiring IP slot for {ip}: {e}")
-                    retries += 1
-                    await asyncio.sleep(0.1)
-                    continue
-            else:
-                return False  # No slots available
-        except KeyNotFoundError:
-            try:
-                # Key does not exist, create it
-                await kv.create(
-                    ip, json.dumps({"count": 1, "updated_at": int(time.time())}).encode()
-                )
-                return True
-            except KeyWrongLastSequenceError:
-                logger.debug(f"Wrong last sequence when creating {ip}")
-                retries += 1
-                await asyncio.sleep(0.1)
-                continue
-            except Exception as e:
-                logger.error(f"Unexpected error creating IP slot for {ip}: {e}")
-                retries += 1
-                await asyncio.sleep(0.1)
-                continue
-        except Exception as e:
-            logger.error(f"Error acquiring IP slot for {ip}: {e}")
-            retries += 1
-            await asyncio.sleep(0.1)
-
-    return False  # Failed after max retries
-
-
-async def release_ip_slot(kv: KeyValue, ip: str) -> None:
-    # Release the slot for the IP address
-    error_retries = 0
-
-    while True:
-        try:
-            entry = await kv.get(ip)
-            entry_data = json.loads(entry.value.decode())
-            count = entry_data.get("count", 0)
-
-            if count > 0:
-                try:
-                    await kv.update(
-                        ip,
-                        json.dumps(
-                            {"count": count - 1, "updated_at": int(time.time())}
-                        ).encode(),
-                        entry.revision,
-                    )
-                    return
-                except KeyWrongLastSequenceError:
-                    logger.info(f"Wrong last sequence for {ip}: {entry.revision}")
-                    await asyncio.sleep(0.1)
-                    continue
-        except KeyNotFoundError:
-            logger.info(f"IP slot for {ip} not found to release")
-            return  # Key not found, nothing to release
-        except Exception as e:
-            error_retries += 1
-            logger.error(f"Unexpected error releasing IP slot for {ip}: {e}")
-            if error_retries > 10:
-                logger.critical(
-                    f"Error releasing IP slot for {ip}. Giving up after 10 retries. Error: {e}"
-                )
-                raise
-            await asyncio.sleep(0.1)
-
-
 async def scan_service():
     loop = asyncio.get_running_loop()
 
@@ -225,6 +134,7 @@ async def scan_service():
         sub: JetStreamContext.PullSubscription = None
         priority_sub: JetStreamContext.PullSubscription = None
         ip_kv: KeyValue = None
+        ip_slots: IPSlotLeaser = None
         leaders_kv: KeyValue = None
 
     context = Context()
@@ -240,6 +150,7 @@ async def scan_service():
             **priority_pull_subscribe_options
         )
         context.ip_kv = await js.key_value(bucket="WEB_SCANNER_IPS")
+        context.ip_slots.kv = context.ip_kv
         logger.info("Re-subscribed to NATS...")
 
     async def disconnected_cb():
@@ -326,7 +237,7 @@ async def scan_service():
                     try:
                         ip_address = json.loads(msg.data).get("ip_address")
                         logger.debug(f"Releasing IP address: {ip_address}")
-                        await release_ip_slot(context.ip_kv, ip_address)
+                        context.ip_slots.release(ip_address)
                         logger.debug(f"Released IP address: {ip_address}")
                     except Exception as e:
                         logger.error(
@@ -383,7 +294,7 @@ async def scan_service():
                         await msg.ack()
                         continue
 
-                    if not await try_acquire_ip_slot(context.ip_kv, ip):
+                    if not await context.ip_slots.try_acquire(ip):
                         logger.debug(
                             f"Unable to acquire slot for IP address: {ip}, requeuing..."
                         )
@@ -404,6 +315,25 @@ async def scan_service():
                 raise
         logger.info("Producer shutting down...")
 
+    async def maintain_ip_slots():
+        time_to_log_stats = time.monotonic() + IP_SLOT_STATS_INTERVAL
+        while not SHUTDOWN_EVENT.is_set():
+            try:
+                await asyncio.wait_for(SHUTDOWN_EVENT.wait(), timeout=IP_SLOT_LEASE_TTL / 3)
+                break
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                await context.ip_slots.maintain()
+            except Exception as e:
+                logger.error(f"Error while maintaining IP slot leases: {e}")
+
+            if time.monotonic() > time_to_log_stats:
+                logger.info(f"IP slot lease statistics: {context.ip_slots.get_stats()}")
+                time_to_log_stats = time.monotonic() + IP_SLOT_STATS_INTERVAL
+        logger.info("IP slot lease maintenance shutting down...")
+
     async def shutdown():
         logger.info("Shutting down...")
         SHUTDOWN_EVENT.set()
@@ -414,6 +344,12 @@ async def scan_service():
         except asyncio.TimeoutError:
             logger.error("Timeout waiting for tasks to finish...")
 
+        # Return leased IP slots so other instances don't wait for the leases to expire
+        try:
+            await context.ip_slots.release_all()
+        except Exception as e:
+            logger.error(f"Error while returning IP slot leases: {e}")
+
         await nc.flush()
         logger.info("Flushed NATS connection...")
         await nc.close()
@@ -442,6 +378,13 @@ async def scan_service():
     logger.info(f"Connected to NATS at {nc.connected_url.netloc}...")
 
     context.ip_kv = await js.key_value(bucket="WEB_SCANNER_IPS")
+    context.ip_slots = IPSlotLeaser(
+        kv=context.ip_kv,
+        instance_id=instance_id,
+        max_slots_per_ip=MAX_SLOTS_PER_IP,
+        block_size=IP_SLOT_LEASE_BLOCK_SIZE,
+        lease_ttl=IP_SLOT_LEASE_TTL,
+    )
 
     pull_subscribe_options = {
         "stream": "SCANS",
@@ -471,9 +414,10 @@ async def scan_service():
 
     workers = [asyncio.create_task(work_consumer()) for _ in range(SCAN_THREAD_COUNT)]
     producer = asyncio.create_task(work_producer())
+    slot_maintainer = asyncio.create_task(maintain_ip_slots())
 
     try:
-        await asyncio.gather(*workers, producer, return_exceptions=True)
+        await asyncio.gather(*workers, producer, slot_maintainer, return_exceptions=True)
     except asyncio.CancelledError:
         logger.info("Service shut down")
 
@@ -12,4 +12,6 @@ MINIMUM_SCANS = int(os.getenv("DETECT_DECAY_MINIMUM_SCANS"))
 DRY_RUN_EMAIL_MODE = os.getenv("DETECT_DECAY_DRY_RUN_EMAIL_MODE", "false") == "true"
 DRY_RUN_LOG_MODE = os.getenv("DETECT_DECAY_DRY_RUN_LOG_MODE", "false") == "true"
 SERVICE_ACCOUNT_EMAIL = os.getenv("SERVICE_ACCOUNT_EMAIL")
-EMAIL_TEMPLATE_ID = os.getenv("DETECT_DECAY_EMAIL_TEMPLATE_ID")
\ No newline at end of file
+EMAIL_TEMPLATE_ID = os.getenv("DETECT_DECAY_EMAIL_TEMPLATE_ID")
+# Number of domains whose scan histories are fetched per query
+DOMAIN_BATCH_SIZE = int(os.getenv("DETECT_DECAY_DOMAIN_BATCH_SIZE", 500))
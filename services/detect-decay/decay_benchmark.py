@@ -0,0 +1,70 @@
+import argparse
+import random
+import timeit
+
+# Reads its configuration from the same environment as the service
+from detect_decay import DNS_DECAY_CATEGORIES, WEB_DECAY_CATEGORIES, find_decays
+
+
+def find_decay(statuses, i, minimum_scans):
+    if len(statuses) < minimum_scans:
+        return False
+    recent_all_failed = all(status == "fail" for status in statuses[i:minimum_scans-1+i])
+    previous_passed = statuses[minimum_scans-1+i] == "pass"
+    return recent_all_failed and previous_passed
+
+
+def list_decays(scans, categories, minimum_scans):
+    # Previous implementation: rebuilds every category's statuses for every window offset
+    decayed_statuses = []
+    if len(scans) >= minimum_scans:
+        for i in range(len(scans) - (minimum_scans - 1)):
+            for category, label in categories.items():
+                if find_decay([scan[category] for scan in scans], i, minimum_scans):
+                    decayed_statuses.append(label)
+    return decayed_statuses
+
+
+def build_history(categories, length, fail_rate):
+    # Runs of failing scans between passing ones, with the odd info status
+    history = []
+    for _ in range(length):
+        scan = {}
+        for category in categories:
+            roll = random.random()
+            scan[category] = "fail" if roll < fail_rate else "info" if roll > 0.95 else "pass"
+        history.append(scan)
+    return history
+
+
+def time_per_call(fn, args, number):
+    seconds = min(timeit.repeat(lambda: fn(*args), number=number, repeat=5))
+    return seconds / number * 1_000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare list and vectorized sliding-window decay detection on long scan histories."
+    )
+    parser.add_argument("--number", "-n", type=int, default=5,
+                        help="Number of iterations per measurement.")
+    parser.add_argument("--minimum-scans", "-m", type=int, default=5,
+                        help="Number of scans in a decay window.")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[30, 365, 2000],
+                        help="Lengths of the scan histories to compare.")
+    parser.add_argument("--fail-rate", type=float, default=0.7,
+                        help="Share of failing statuses in the generated histories.")
+    args = parser.parse_args()
+
+    random.seed(0)
+    for name, categories in (("web", WEB_DECAY_CATEGORIES), ("dns", DNS_DECAY_CATEGORIES)):
+        for length in args.lengths:
+            history = build_history(categories, length, args.fail_rate)
+            call_args = (history, categories, args.minimum_scans)
+            assert list_decays(*call_args) == find_decays(*call_args)
+            list_ms = time_per_call(list_decays, call_args, args.number)
+            vectorized_ms = time_per_call(find_decays, call_args, args.number)
+            print(
+                f"{name} history of {length} scans: list {list_ms:.3f} ms, "
+                f"vectorized {vectorized_ms:.3f} ms ({list_ms / vectorized_ms:.1f}x)"
+            )
@@ -3,10 +3,11 @@ import sys
 import logging
 import copy
 from datetime import datetime, timedelta, timezone
+import numpy as np
 from arango import ArangoClient
 from notify.send_email_notifs import send_email_notifs
 
-from config import DB_USER, DB_PASS, DB_NAME, DB_URL, START_HOUR, START_MINUTE, MINIMUM_SCANS, DRY_RUN_EMAIL_MODE, DRY_RUN_LOG_MODE
+from config import DB_USER, DB_PASS, DB_NAME, DB_URL, START_HOUR, START_MINUTE, MINIMUM_SCANS, DRY_RUN_EMAIL_MODE, DRY_RUN_LOG_MODE, DOMAIN_BATCH_SIZE
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -163,6 +164,133 @@ def get_all_web_scans(domain_id, db):
     
     return web_scans
 
+# Returns the claimed domains of each org, fetched in one query
+def get_claimed_domains(org_ids, db):
+    cursor = db.aql.execute(
+        """
+        FOR claim IN claims
+            FILTER claim._from IN @org_ids
+            LET domain = DOCUMENT(claim._to)
+            FILTER domain != null
+            RETURN {
+                "org_id": claim._from,
+                "domain": KEEP(domain, "_id", "domain", "archived", "blocked", "rcode"),
+            }
+        """,
+        bind_vars={"org_ids": org_ids},
+    )
+    domains_by_org = {org_id: [] for org_id in org_ids}
+    for claim in cursor:
+        domains_by_org[claim["org_id"]].append(claim["domain"])
+    return domains_by_org
+
+# Returns the dns scans of each domain since the start of the time period, newest first,
+# followed by the MINIMUM_SCANS - 1 scans before it needed to detect a decay at the start of the period
+def get_dns_scan_histories(domain_ids, db):
+    time_period_start = get_timestamp(1, START_HOUR, START_MINUTE)
+    cursor = db.aql.execute(
+        """
+        WITH domains, dns
+        FOR domain_id IN @domain_ids
+            LET past_day = (
+                FOR dnsV, dnsE IN 1 OUTBOUND domain_id domainsDNS
+                    FILTER dnsV.timestamp > @time_period_start
+                    SORT dnsV.timestamp DESC
+                    RETURN {
+                        "dmarc_status": dnsV.dmarc.status,
+                        "spf_status": dnsV.spf.status,
+                        "dkim_status": dnsV.dkim.status,
+                    }
+            )
+            FILTER LENGTH(past_day) > 0
+            LET previous = (
+                FOR dnsV, dnsE IN 1 OUTBOUND domain_id domainsDNS
+                    FILTER dnsV.timestamp <= @time_period_start
+                    SORT dnsV.timestamp DESC
+                    LIMIT @lookback
+                    RETURN {
+                        "dmarc_status": dnsV.dmarc.status,
+                        "spf_status": dnsV.spf.status,
+                        "dkim_status": dnsV.dkim.status,
+                    }
+            )
+            RETURN {
+                "domain_id": domain_id,
+                "scans": APPEND(past_day, previous),
+            }
+        """,
+        bind_vars={"domain_ids": domain_ids,
+                   "time_period_start": time_period_start,
+                   "lookback": max(MINIMUM_SCANS - 1, 0)},
+    )
+    return {history["domain_id"]: history["scans"] for history in cursor}
+
+# Same as get_dns_scan_histories, for web scans with completed results
+def get_web_scan_histories(domain_ids, db):
+    time_period_start = get_timestamp(1, START_HOUR, START_MINUTE)
+    cursor = db.aql.execute(
+        """
+        WITH domains, web, webScan
+        FOR domain_id IN @domain_ids
+            LET past_day = (
+                FOR webV, webE IN 1 OUTBOUND domain_id domainsWeb
+                    FILTER webV.timestamp > @time_period_start
+                    SORT webV.timestamp DESC
+                    LET scans = (
+                        FOR webScanV, webScanE IN 1 OUTBOUND webV._id webToWebScans
+                            FILTER webScanV.status == "complete"
+                            RETURN {
+                                "status": webScanV.status,
+                                "https_status": webScanV.results.connectionResults.httpsStatus,
+                                "hsts_status": webScanV.results.connectionResults.hstsStatus,
+                                "certificate_status": webScanV.results.tlsResult.certificateStatus,
+                                "protocol_status": webScanV.results.tlsResult.protocolStatus,
+                                "cipher_status": webScanV.results.tlsResult.cipherStatus,
+                                "curve_status": webScanV.results.tlsResult.curveStatus,
+                            }
+                    )
+                    FILTER COUNT(scans) > 0
+                    RETURN {
+                        "web_id": webV._id,
+                        "scans": scans
+                    }
+            )
+            FILTER LENGTH(past_day) > 0
+            LET previous = (
+                FOR webV, webE IN 1 OUTBOUND domain_id domainsWeb
+                    FILTER webV.timestamp <= @time_period_start
+                    SORT webV.timestamp DESC
+                    LET scans = (
+                        FOR webScanV, webScanE IN 1 OUTBOUND webV._id webToWebScans
+                            FILTER webScanV.status == "complete"
+                            RETURN {
+                                "status": webScanV.status,
+                                "https_status": webScanV.results.connectionResults.httpsStatus,
+                                "hsts_status": webScanV.results.connectionResults.hstsStatus,
+                                "certificate_status": webScanV.results.tlsResult.certificateStatus,
+                                "protocol_status": webScanV.results.tlsResult.protocolStatus,
+                                "cipher_status": webScanV.results.tlsResult.cipherStatus,
+                                "curve_status": webScanV.results.tlsResult.curveStatus,
+                            }
+                    )
+                    FILTER COUNT(scans) > 0
+                    LIMIT @lookback
+                    RETURN {
+                        "web_id": webV._id,
+                        "scans": scans
+                    }
+            )
+            RETURN {
+                "domain_id": domain_id,
+                "webs": APPEND(past_day, previous),
+            }
+        """,
+        bind_vars={"domain_ids": domain_ids,
+                   "time_period_start": time_period_start,
+                   "lookback": max(MINIMUM_SCANS - 1, 0)},
+    )
+    return {history["domain_id"]: history["webs"] for history in cursor}
+
 # Returns a single status given a list of multiple statuses
 def get_status(statuses):
     if "fail" in statuses:
@@ -232,108 +360,128 @@ def get_users(org_id, db):
     )
     return cursor
 
-def find_decay(statuses, i):
-    if len(statuses) < MINIMUM_SCANS:
-        return False
-    recent_all_failed = all(status == "fail" for status in statuses[i:MINIMUM_SCANS-1+i])
-    previous_passed = statuses[MINIMUM_SCANS-1+i] == "pass"
-    return recent_all_failed and previous_passed
+WEB_DECAY_CATEGORIES = {
+    "https_status": "HTTPS Configuration",
+    "hsts_status": "HSTS Implementation",
+    "certificate_status": "Certificates",
+    "protocol_status": "Protocols",
+    "cipher_status": "Ciphers",
+    "curve_status": "Curves",
+}
+DNS_DECAY_CATEGORIES = {
+    "dmarc_status": "DMARC",
+    "spf_status": "SPF",
+    "dkim_status": "DKIM",
+}
+
+FAIL_CODE = 1
+PASS_CODE = 2
+STATUS_CODES = {"fail": FAIL_CODE, "pass": PASS_CODE}
+
+# Encodes the statuses of each category in a series of scan results as a row of int8 codes
+def encode_statuses(scans, categories):
+    return np.array(
+        [[STATUS_CODES.get(scan[category], 0) for scan in scans] for category in categories],
+        dtype=np.int8,
+    ).reshape(len(categories), len(scans))
+
+# Returns a (scans - minimum_scans + 1, categories) mask of the windows where a category decayed,
+# i.e. where minimum_scans - 1 failing scans follow a passing one. All offsets are checked in one pass.
+def find_decay_windows(codes, minimum_scans=MINIMUM_SCANS):
+    categories, scans = codes.shape
+    if scans < minimum_scans:
+        return np.zeros((0, categories), dtype=bool)
+    fail_counts = np.zeros((categories, scans + 1), dtype=np.int32)
+    np.cumsum(codes == FAIL_CODE, axis=1, out=fail_counts[:, 1:])
+    windows = scans - minimum_scans + 1
+    recent_all_failed = fail_counts[:, minimum_scans - 1:scans] - fail_counts[:, :windows] == minimum_scans - 1
+    previous_passed = codes[:, minimum_scans - 1:] == PASS_CODE
+    return (recent_all_failed & previous_passed).T
+
+# Returns the decayed statuses found in a series of scan results, newest first
+def find_decays(scans, categories, minimum_scans=MINIMUM_SCANS):
+    labels = list(categories.values())
+    windows = find_decay_windows(encode_statuses(scans, categories), minimum_scans)
+    # Decays are listed by window offset, then category
+    return [labels[category] for category in np.nonzero(windows)[1]]
+
+def get_final_web_scans(all_web_scans):
+    final_web_scans = []
+    for web in all_web_scans:
+        scans = web.get("scans")
+        # If there is only one scan, no further steps are needed, just get the statuses
+        if len(scans) == 1:
+            final_results = {category: scans[0][category] for category in WEB_DECAY_CATEGORIES}
+        # If there are multiple scans, combine them into one final scan result
+        else:
+            final_results = finalize_web_scans(scans)
+        final_web_scans.append(final_results)
+    return final_web_scans
+
+# Fetches the scan histories of the domains in batches and returns the decayed statuses of each domain
+def get_domain_decays(domains, db):
+    domain_decays = {}
+    domain_ids = list(domains)
+    for batch_start in range(0, len(domain_ids), DOMAIN_BATCH_SIZE):
+        batch = domain_ids[batch_start:batch_start + DOMAIN_BATCH_SIZE]
+        try:
+            web_histories = get_web_scan_histories(batch, db)
+        except Exception as e:
+            logger.error(f"Error fetching web scans for {len(batch)} domains: {e}")
+            web_histories = {}
+        try:
+            dns_histories = get_dns_scan_histories(batch, db)
+        except Exception as e:
+            logger.error(f"Error fetching dns scans for {len(batch)} domains: {e}")
+            dns_histories = {}
+
+        for domain_id in batch:
+            domain = domains[domain_id]
+            # Domains without dns scans in the time period are not checked
+            if domain_id not in dns_histories:
+                continue
+            try:
+                decayed_statuses = find_decays(
+                    get_final_web_scans(web_histories.get(domain_id, [])), WEB_DECAY_CATEGORIES
+                )
+                decayed_statuses.extend(find_decays(dns_histories.get(domain_id, []), DNS_DECAY_CATEGORIES))
+            except Exception as e:
+                logger.error(f"Error checking {domain['domain']} for decays: {e}")
+                continue
+            # Only add if there are actually decayed statuses
+            if len(decayed_statuses) != 0:
+                domain_decays[domain_id] = decayed_statuses
+                logger.info(f"Decays detected for {domain['domain']}: {decayed_statuses}")
+    return domain_decays
 
 def detect_decay(db):
     decays = {} # Dictionary to hold domains and their decayed statuses for each org
     orgs = [] # List to hold org documents, used for email notifs
 
-    # Loop through each org
     for org in db.collection("organizations"):
         if org.get("verified") is False:
             logger.info(f"Skipping unverified org: {org['orgDetails']['en']['name']}")
             continue
-        logger.info(f"Checking {org['orgDetails']['en']['name']} for decays...")
         orgs.append(org)
-        try:
-            domains_dict = {}
-            claims_cursor = db.collection("claims").find({"_from": org["_id"]})
-            claims = [claim for claim in claims_cursor]
-
-            # Loop through each domain
-            for claim in claims:
-                domain = db.collection("domains").get({"_id": claim["_to"]})
-                logger.info(f"Checking {domain['domain']} for decays...")
-
-                # Check that domain isn't archived, blocked, or NXDOMAIN
-                if not ignore_domain(domain):
-                    decayed_statuses = []
-                    # Get web scans                   
-                    try:
-                        all_web_scans = list(get_all_web_scans(domain["_id"], db))
-                        final_web_scans = []
-                        for web in all_web_scans:
-                            scans = web.get("scans")
-                            # If there is only one scan, no further steps are needed, just get the statuses
-                            if len(scans) == 1:
-                                scan = scans[0]
-                                https = scan["https_status"]
-                                hsts = scan["hsts_status"]
-                                certificate = scan["certificate_status"]
-                                protocol = scan["protocol_status"]
-                                cipher = scan["cipher_status"]
-                                curve = scan["curve_status"]
-                                final_results = {
-                                    "https_status": https,
-                                    "hsts_status": hsts,
-                                    "certificate_status": certificate,
-                                    "protocol_status": protocol,
-                                    "cipher_status": cipher,
-                                    "curve_status": curve
-                                }
-                            # If there are multiple scans, combine them into one final scan result
-                            else:
-                                final_results = finalize_web_scans(scans)                                                  
-                            final_web_scans.append(final_results)
-                        if len(final_web_scans) >= MINIMUM_SCANS:
-                            for i in range(len(final_web_scans) - (MINIMUM_SCANS - 1)):
-                                if find_decay([scans["https_status"] for scans in final_web_scans], i):
-                                    decayed_statuses.append("HTTPS Configuration")
-                                if find_decay([scans["hsts_status"] for scans in final_web_scans], i):
-                                    decayed_statuses.append("HSTS Implementation")
-                                if find_decay([scans["certificate_status"] for scans in final_web_scans], i):
-                                    decayed_statuses.append("Certificates")
-                                if find_decay([scans["protocol_status"] for scans in final_web_scans], i):
-                                    decayed_statuses.append("Protocols")
-                                if find_decay([scans["cipher_status"] for scans in final_web_scans], i):
-                                    decayed_statuses.append("Ciphers")
-                                if find_decay([scans["curve_status"] for scans in final_web_scans], i):
-                                    decayed_statuses.append("Curves")                           
-                        
-                    except Exception as e: 
-                        logger.error(f"Error fetching web scans for {domain['domain']}: {e}")
-
-                    # Get dns scans
-                    try:
-                        all_dns_scans = list(get_all_dns_scans(domain["_id"], db))
-                        if len(all_dns_scans) >= MINIMUM_SCANS:
-                            for i in range(len(all_dns_scans) - (MINIMUM_SCANS - 1)):
-                                if find_decay([scans["dmarc_status"] for scans in all_dns_scans], i):
-                                    decayed_statuses.append("DMARC")
-                                if find_decay([scans["spf_status"] for scans in all_dns_scans], i):
-                                    decayed_statuses.append("SPF")
-                                if find_decay([scans["dkim_status"] for scans in all_dns_scans], i):
-                                    decayed_statuses.append("DKIM")
-                    
-                    except Exception as e:
-                        logger.error(f"Error fetching dns scans for {domain['domain']}: {e}")
-                        continue
-                    
-                    # Only add if there are actually decayed statuses
-                    if len(decayed_statuses) != 0:
-                        domains_dict[domain["domain"]] = decayed_statuses
-                        logger.info(f"Decays detected for {domain['domain']}: {decayed_statuses}")
-                        
-            if domains_dict:
-                decays[org['orgDetails']['en']['name']] = domains_dict
 
-        except Exception as e:
-            logger.error(f"Error processing org {org['orgDetails']['en']['name']}: {e}")
+    # Domains claimed by several orgs are only checked once
+    domains_by_org = get_claimed_domains([org["_id"] for org in orgs], db)
+    domains = {}
+    for org_domains in domains_by_org.values():
+        for domain in org_domains:
+            # Check that domain isn't archived, blocked, or NXDOMAIN
+            if not ignore_domain(domain):
+                domains[domain["_id"]] = domain
+    logger.info(f"Checking {len(domains)} domains claimed by {len(orgs)} orgs for decays...")
+    domain_decays = get_domain_decays(domains, db)
+
+    for org in orgs:
+        domains_dict = {}
+        for domain in domains_by_org[org["_id"]]:
+            if domain["_id"] in domain_decays:
+                domains_dict[domain["domain"]] = list(domain_decays[domain["_id"]])
+        if domains_dict:
+            decays[org['orgDetails']['en']['name']] = domains_dict
 
     logger.info(f"Decay Results: {decays}")
     logger.info(f"Decay Results Summary: Total Orgs with Decays = {len(decays)}, Total Domains with Decays = {sum(len(domains) for domains in decays.values())}")
@@ -658,6 +658,17 @@ def test_get_all_web_scans(arango_db):
     assert len(web_docs2) == 5, "Should return 5 web docs for domains/2"
     assert len(web_docs2[0].get("scans")) == 2
 
+def test_get_dns_scan_histories(arango_db):
+    histories = get_dns_scan_histories(["domains/1", "domains/2"], arango_db)
+    assert histories["domains/1"] == list(get_all_dns_scans("domains/1", arango_db))
+    assert histories["domains/2"] == list(get_all_dns_scans("domains/2", arango_db))
+
+def test_get_web_scan_histories(arango_db):
+    histories = get_web_scan_histories(["domains/1", "domains/2"], arango_db)
+    assert histories["domains/1"] == list(get_all_web_scans("domains/1", arango_db))
+    assert histories["domains/2"] == list(get_all_web_scans("domains/2", arango_db))
+    assert len(histories["domains/2"][0].get("scans")) == 2
+
 def test_get_users(arango_db):
     assert len(list(get_users("organizations/1", arango_db))) == 2, "Should return 2 users for organizations/1"
 
@@ -683,3 +694,10 @@ def test_detect_decay(arango_db):
     assert len(responses[0]) == 2, "Should return 2 responses for org 1 users"
     
 
+
+def test_find_decays():
+    categories = {"dmarc_status": "DMARC", "spf_status": "SPF"}
+    scans = [{"dmarc_status": "fail", "spf_status": "pass"}] * (MINIMUM_SCANS - 1) + [{"dmarc_status": "pass", "spf_status": "pass"}]
+    assert find_decays(scans, categories) == ["DMARC"]
+    assert find_decays(scans[1:], categories) == []
+    assert find_decays([{"dmarc_status": "fail", "spf_status": "fail"}] + scans, categories) == ["DMARC"]
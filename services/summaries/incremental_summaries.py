@@ -0,0 +1,388 @@
+import os
+import sys
+import json
+import signal
+import asyncio
+import logging
+import time
+from datetime import date
+
+import nats
+from dotenv import load_dotenv
+from nats.errors import TimeoutError as NatsTimeoutError
+from nats.js.api import ConsumerConfig, AckPolicy
+
+from arango_pool import connect, get_pool_stats
+from summaries import (
+    CHARTS,
+    SCOPES,
+    DMARC_PHASES,
+    org_scopes,
+    new_chart_summaries,
+    new_dmarc_phases,
+    new_org_acc,
+    accumulate_chart,
+    accumulate_org,
+    build_org_doc,
+)
+
+load_dotenv()
+
+DB_USER = os.getenv("DB_USER")
+DB_PASS = os.getenv("DB_PASS")
+DB_NAME = os.getenv("DB_NAME")
+DB_URL = os.getenv("DB_URL")
+# Summaries send their queries one at a time, each process needs a single database connection per host
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 1))
+
+NAME = os.getenv("NAME", "incremental-summaries")
+SERVERLIST = os.getenv("NATS_SERVERS", "nats://localhost:4222")
+SERVERS = SERVERLIST.split(",")
+
+# Published by dns-processor and web-processor when a domain's summarized status changes
+STATUS_CHANGE_SUBJECT = "scans.domain_status_changes"
+# Number of status change events applied to the summaries together
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", 500))
+# Stream sequences of the events already applied, kept long enough to skip any redelivery of them
+APPLIED_EVENTS_COLLECTION = "appliedStatusChanges"
+APPLIED_EVENT_RETENTION = int(os.getenv("APPLIED_EVENT_RETENTION", 24 * 60 * 60))
+
+ORG_CATEGORIES = [category for category in new_org_acc() if category not in ("dmarc_phase", "negative_tags")]
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+
+
+def new_deltas():
+    """Blank counters for what a batch of events removes from and adds to the summaries."""
+    return {
+        side: {
+            "charts": new_chart_summaries(),
+            "dmarc_phases": new_dmarc_phases(),
+            "orgs": {},
+        }
+        for side in ("removed", "added")
+    }
+
+
+def load_org_scopes(db, org_ids):
+    """Scopes of every organization in org_ids, keyed by organization _id."""
+    cursor = db.aql.execute(
+        """
+            FOR org IN organizations
+                FILTER org._id IN @org_ids
+                RETURN { _id: org._id, verified: org.verified, policies: org.policies }
+        """,
+        bind_vars={"org_ids": list(org_ids)},
+    )
+    return {org["_id"]: org_scopes(org) for org in cursor}
+
+
+def accumulate_status_change(deltas, event, scopes_by_org_id):
+    """Count the old snapshot of a domain as removed and the new one as added.
+
+    Snapshots of ignored domains (archived, blocked, NXDOMAIN) are left out like in the full computation.
+    """
+    org_ids = [org_id for org_id in event.get("org_ids") or [] if org_id in scopes_by_org_id]
+    if not org_ids:
+        return
+    scopes = set().union(*(scopes_by_org_id[org_id] for org_id in org_ids))
+
+    for side, snapshot in (("removed", event.get("old")), ("added", event.get("new"))):
+        if snapshot is None or snapshot.get("ignored"):
+            continue
+        acc = deltas[side]
+        status = snapshot.get("status") or {}
+        phase = snapshot.get("phase")
+        accumulate_chart(acc["charts"], acc["dmarc_phases"], scopes, status, phase)
+        for org_id in org_ids:
+            org_acc = acc["orgs"].get(org_id)
+            if org_acc is None:
+                org_acc = new_org_acc()
+                acc["orgs"][org_id] = org_acc
+            accumulate_org(org_acc, status, phase, snapshot.get("negative_tags") or [])
+
+
+def apply_count(base, added, removed):
+    # Never go below zero if the summary being carried forward predates the change
+    return max(0, base + added - removed)
+
+
+def apply_chart_deltas(db, deltas):
+    """Apply the deltas to today's chart summary of each scope, carrying forward the latest one if needed."""
+    chart_summaries_col = db.collection("chartSummaries")
+    today_iso = date.today().isoformat()
+    added = deltas["added"]
+    removed = deltas["removed"]
+
+    for scope in SCOPES:
+        if (
+            added["charts"][scope] == removed["charts"][scope]
+            and added["dmarc_phases"][scope] == removed["dmarc_phases"][scope]
+        ):
+            continue
+
+        cursor = db.aql.execute(
+            """
+                FOR summary IN chartSummaries
+                    FILTER summary.scope == @scope
+                    SORT summary.date DESC
+                    LIMIT 1
+                    RETURN summary
+            """,
+            bind_vars={"scope": scope},
+        )
+        latest = next(cursor, None) or {}
+
+        summary_data = {}
+        for chart_type, scan_types in CHARTS.items():
+            base = latest.get(chart_type) or {}
+            chart = {"scan_types": scan_types}
+            for result in ("pass", "fail"):
+                chart[result] = apply_count(
+                    base.get(result, 0),
+                    added["charts"][scope][chart_type][result],
+                    removed["charts"][scope][chart_type][result],
+                )
+            chart["total"] = chart["pass"] + chart["fail"]
+            summary_data[chart_type] = chart
+
+        base_phases = latest.get("dmarc_phase") or {}
+        phases = {
+            phase: apply_count(
+                base_phases.get(phase, 0),
+                added["dmarc_phases"][scope][phase],
+                removed["dmarc_phases"][scope][phase],
+            )
+            for phase in DMARC_PHASES
+        }
+        summary_data["dmarc_phase"] = {**phases, "total": sum(phases.values())}
+
+        if latest.get("date") == today_iso:
+            chart_summaries_col.update({"_key": latest["_key"], **summary_data})
+        else:
+            chart_summaries_col.insert({"date": today_iso, "scope": scope, **summary_data})
+
+
+def summary_to_acc(summary):
+    """Turn an organization summary document back into counters."""
+    acc = new_org_acc()
+    for category in ORG_CATEGORIES:
+        counts = summary.get(category) or {}
+        acc[category] = {"pass": counts.get("pass", 0), "fail": counts.get("fail", 0)}
+    phases = summary.get("dmarc_phase") or {}
+    acc["dmarc_phase"] = {phase: phases.get(phase, 0) for phase in DMARC_PHASES}
+    acc["negative_tags"] = dict(summary.get("negative_tags") or {})
+    return acc
+
+
+def apply_org_acc_deltas(acc, added, removed):
+    for category in ORG_CATEGORIES:
+        for result in ("pass", "fail"):
+            acc[category][result] = apply_count(
+                acc[category][result], added[category][result], removed[category][result]
+            )
+    for phase in DMARC_PHASES:
+        acc["dmarc_phase"][phase] = apply_count(
+            acc["dmarc_phase"][phase], added["dmarc_phase"][phase], removed["dmarc_phase"][phase]
+        )
+    for tag in set(added["negative_tags"]) | set(removed["negative_tags"]):
+        count = apply_count(
+            acc["negative_tags"].get(tag, 0),
+            added["negative_tags"].get(tag, 0),
+            removed["negative_tags"].get(tag, 0),
+        )
+        if count > 0:
+            acc["negative_tags"][tag] = count
+        else:
+            acc["negative_tags"].pop(tag, None)
+
+
+def apply_org_deltas(db, deltas):
+    """Apply the deltas to today's summary of each changed organization, carrying forward its latest one if needed."""
+    org_summaries_col = db.collection("organizationSummaries")
+    organizations_col = db.collection("organizations")
+    today_iso = date.today().isoformat()
+    added = deltas["added"]["orgs"]
+    removed = deltas["removed"]["orgs"]
+
+    changed_org_ids = [
+        org_id
+        for org_id in set(added) | set(removed)
+        if added.get(org_id) != removed.get(org_id)
+    ]
+    if not changed_org_ids:
+        return
+
+    cursor = db.aql.execute(
+        """
+            FOR org IN organizations
+                FILTER org._id IN @org_ids
+                RETURN { _id: org._id, _key: org._key, summary: DOCUMENT(org.latestSummaryId) }
+        """,
+        bind_vars={"org_ids": changed_org_ids},
+    )
+    for org in cursor:
+        try:
+            latest = org["summary"] or {}
+            acc = summary_to_acc(latest)
+            apply_org_acc_deltas(
+                acc,
+                added.get(org["_id"]) or new_org_acc(),
+                removed.get(org["_id"]) or new_org_acc(),
+            )
+            summary_data = build_org_doc(org["_id"], today_iso, acc)
+
+            if latest.get("date") == today_iso:
+                # negative_tags is replaced rather than merged so that cleared tags are removed
+                org_summaries_col.replace({"_key": latest["_key"], **summary_data})
+            else:
+                inserted = org_summaries_col.insert(summary_data)
+                organizations_col.update(
+                    {"_key": org["_key"], "latestSummaryId": inserted["_id"]}
+                )
+        except Exception as e:
+            logging.error(f"Error applying status changes to organization {org['_id']}: {e}")
+            continue
+
+
+def ensure_applied_events_collection(db):
+    """Create the collection recording applied events, its documents expire after APPLIED_EVENT_RETENTION seconds."""
+    if not db.has_collection(APPLIED_EVENTS_COLLECTION):
+        db.create_collection(APPLIED_EVENTS_COLLECTION)
+    db.collection(APPLIED_EVENTS_COLLECTION).add_index(
+        {"type": "ttl", "fields": ["appliedAt"], "expireAfter": APPLIED_EVENT_RETENTION}
+    )
+
+
+def find_applied_events(db, event_keys):
+    """Keys in event_keys of the events already applied to the summaries."""
+    cursor = db.aql.execute(
+        """
+            FOR applied IN @@applied_events
+                FILTER applied._key IN @keys
+                RETURN applied._key
+        """,
+        bind_vars={"@applied_events": APPLIED_EVENTS_COLLECTION, "keys": event_keys},
+    )
+    return set(cursor)
+
+
+def apply_status_changes(db, events, event_keys=None):
+    """Update today's chart and organization summaries with a batch of domain status change events.
+
+    event_keys identify each event, e.g. by its stream sequence. They are recorded with the summaries
+    in one transaction, and events whose key was already recorded are skipped, so that a batch
+    redelivered after it was applied is not counted twice.
+    """
+    # Commit the whole batch or nothing, a redelivered batch must not find part of it already counted
+    txn_db = db.begin_transaction(
+        read=["organizationSummaries"],
+        write=["chartSummaries", "organizationSummaries", "organizations", APPLIED_EVENTS_COLLECTION],
+    )
+    try:
+        if event_keys is not None:
+            applied = find_applied_events(txn_db, event_keys)
+            if applied:
+                logging.info(f"Skipping {len(applied)} status change events already applied.")
+                events = [event for event, key in zip(events, event_keys) if key not in applied]
+                event_keys = [key for key in event_keys if key not in applied]
+
+        org_ids = {org_id for event in events for org_id in event.get("org_ids") or []}
+        if org_ids:
+            scopes_by_org_id = load_org_scopes(txn_db, org_ids)
+
+            deltas = new_deltas()
+            for event in events:
+                try:
+                    accumulate_status_change(deltas, event, scopes_by_org_id)
+                except Exception as e:
+                    logging.error(f"Error processing status change of domain {event.get('domain_id')}: {e}")
+                    continue
+
+            apply_chart_deltas(txn_db, deltas)
+            apply_org_deltas(txn_db, deltas)
+
+        if event_keys:
+            # Fails on a key another consumer recorded meanwhile, the batch is then retried and skipped
+            txn_db.aql.execute(
+                """
+                    FOR key IN @keys
+                        INSERT { _key: key, appliedAt: @applied_at } INTO @@applied_events
+                """,
+                bind_vars={"@applied_events": APPLIED_EVENTS_COLLECTION, "keys": event_keys, "applied_at": time.time()},
+            )
+    except Exception:
+        txn_db.abort_transaction()
+        raise
+    txn_db.commit_transaction()
+
+
+async def run(host=DB_URL, name=DB_NAME, user=DB_USER, password=DB_PASS):
+    loop = asyncio.get_running_loop()
+    should_exit = asyncio.Event()
+
+    # Establish DB connection
+    db = connect(host, name, user, password, pool_size=DB_POOL_SIZE)
+    ensure_applied_events_collection(db)
+
+    async def error_cb(error):
+        logging.error(f"Uncaught error in callback: {error}")
+
+    nc = await nats.connect(error_cb=error_cb, servers=SERVERS, name=NAME, drain_timeout=30)
+    js = nc.jetstream()
+    logging.info(f"Connected to NATS at {nc.connected_url.netloc}...")
+
+    sub = await js.pull_subscribe(
+        stream="SCANS",
+        subject=STATUS_CHANGE_SUBJECT,
+        durable="incremental_summaries",
+        config=ConsumerConfig(
+            ack_policy=AckPolicy.EXPLICIT,
+            max_deliver=-1,
+            max_waiting=100_000,
+            ack_wait=90,
+        ),
+    )
+
+    for signal_name in {"SIGINT", "SIGTERM"}:
+        loop.add_signal_handler(getattr(signal, signal_name), should_exit.set)
+
+    while not should_exit.is_set() and not nc.is_closed:
+        try:
+            msgs = await sub.fetch(batch=EVENT_BATCH_SIZE, timeout=1)
+        except NatsTimeoutError:
+            continue
+
+        events = []
+        event_keys = []
+        for msg in msgs:
+            try:
+                events.append(json.loads(msg.data))
+            except ValueError as e:
+                logging.error(f"Invalid status change event {msg.data}: {e}")
+                continue
+            # Redeliveries keep the stream sequence of the original message
+            event_keys.append(str(msg.metadata.sequence.stream))
+
+        try:
+            await loop.run_in_executor(None, apply_status_changes, db, events, event_keys)
+        except Exception as e:
+            # Leave the batch unacknowledged so that it is redelivered
+            logging.error(f"Error applying {len(events)} status change events: {e}")
+            continue
+
+        # Acknowledged only once the summaries are committed, and confirmed so that a lost ack is logged
+        logging.info(f"Applied {len(events)} status change events to today's summaries.")
+        for msg in msgs:
+            try:
+                await msg.ack_sync()
+            except Exception as e:
+                logging.error(f"Error acknowledging status change event {msg.data}: {e}")
+
+    logging.info("Service is shutting down...")
+    logging.info(f"Database connection pool statistics: {get_pool_stats()}")
+    await nc.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
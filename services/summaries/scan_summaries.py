@@ -1,13 +1,27 @@
 import os
 import sys
+import heapq
+import pickle
 import logging
 import argparse
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date, datetime, timedelta
 
-from arango import ArangoClient
 from dotenv import load_dotenv
 
-from summaries import CHARTS, SCOPES, ignore_domain, domain_scopes
+from arango_pool import connect, get_pool_stats
+from summaries import (
+    SCOPES,
+    build_domain_index,
+    new_chart_summaries,
+    new_dmarc_phases,
+    new_org_acc,
+    accumulate_chart,
+    accumulate_org,
+    build_org_doc,
+)
 
 load_dotenv()
 
@@ -15,6 +29,11 @@ DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 DB_NAME = os.getenv("DB_NAME")
 DB_URL = os.getenv("DB_URL")
+# Summaries send their queries one at a time, each process needs a single database connection per host
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 1))
+
+# Number of scans fetched per round trip when streaming dns and web in a single pass
+STREAM_BATCH_SIZE = int(os.getenv("BACKFILL_STREAM_BATCH_SIZE", 5000))
 
 CHART_TARGETS = {"shadow": "chartSummaries_rebuild", "prod": "chartSummaries"}
 ORG_TARGETS = {"shadow": "organizationSummaries_rebuild", "prod": "organizationSummaries"}
@@ -93,30 +112,187 @@ def profile_scans(db):
     return datetime.strptime(earliest[:10], "%Y-%m-%d").date()
 
 
-def new_state_entry():
-    """Blank per-domain state: every field unknown ('info') until a scan fills it in."""
-    return {
-        "rcode": None,
-        "phase": None,
-        "status": {
-            "dmarc": "info",
-            "spf": "info",
-            "dkim": "info",
-            "https": "info",
-            "hsts": "info",
-            "ssl": "info",
-        },
-        "dns_tags": [],
-        "web_tags": [],
-    }
+STATE_STATUS_FIELDS = ("dmarc", "spf", "dkim", "https", "hsts", "ssl")
+
+
+class Interner:
+    """Hands out small consecutive ids for hashable values, the first value getting id 0."""
+
+    def __init__(self, *initial):
+        self.ids = {}
+        self.values = []
+        for value in initial:
+            self.id(value)
+
+    def id(self, value):
+        try:
+            return self.ids[value]
+        except KeyError:
+            value_id = len(self.values)
+            self.ids[value] = value_id
+            self.values.append(value)
+            return value_id
+
+
+class ColumnarState:
+    """Latest known scan results of every tracked domain, stored column by column.
+
+    Each tracked domain gets an interned index into flat arrays holding small-int codes for its statuses,
+    DMARC phase and negative tag lists, so the state stays compact over years of history. Domains that are
+    archived, blocked or don't exist anymore are never counted and aren't tracked. Every field is unknown
+    ('info') until a scan fills it in.
+    """
+
+    def __init__(self, domain_by_name, scopes_by_domain_id, orgs_by_domain_name):
+        self.statuses = Interner("info")
+        self.phases = Interner(None)
+        self.tag_lists = Interner(())
+        self.scope_groups = Interner(frozenset())
+        self.org_groups = Interner(())
+        # Counters a single domain adds, keyed by its status and phase codes
+        self.units = {}
+
+        self.domain_ids = {}
+        scope_group_ids = []
+        org_group_ids = []
+        for name, domain in domain_by_name.items():
+            if domain.get("archived") is True or domain.get("blocked") is True:
+                continue
+            self.domain_ids[name] = len(self.domain_ids)
+            scope_group_ids.append(
+                self.scope_groups.id(frozenset(scopes_by_domain_id.get(domain["_id"], ())))
+            )
+            org_group_ids.append(self.org_groups.id(tuple(orgs_by_domain_name.get(name, ()))))
+
+        size = len(self.domain_ids)
+        self.scope_group = array("I", scope_group_ids)
+        self.org_group = array("I", org_group_ids)
+        self.seen = array("B", bytes(size))
+        self.nxdomain = array("B", bytes(size))
+        self.phase = array("H", bytes(2 * size))
+        self.status = {field: array("H", bytes(2 * size)) for field in STATE_STATUS_FIELDS}
+        self.dns_tags = array("I", bytes(4 * size))
+        self.web_tags = array("I", bytes(4 * size))
+
+    def __len__(self):
+        return sum(self.seen)
+
+    def update_dns(self, name, rcode, phase, dmarc, spf, dkim, tags):
+        index = self.domain_ids.get(name)
+        if index is None:
+            return
+        self.seen[index] = 1
+        self.nxdomain[index] = rcode == "NXDOMAIN"
+        self.phase[index] = self.phases.id(phase)
+        self.status["dmarc"][index] = self.statuses.id(dmarc)
+        self.status["spf"][index] = self.statuses.id(spf)
+        self.status["dkim"][index] = self.statuses.id(dkim)
+        self.dns_tags[index] = self.tag_lists.id(tuple(tags))
+
+    def update_web(self, name, https, hsts, ssl, tags):
+        index = self.domain_ids.get(name)
+        if index is None:
+            return
+        self.seen[index] = 1
+        self.status["https"][index] = self.statuses.id(https)
+        self.status["hsts"][index] = self.statuses.id(hsts)
+        self.status["ssl"][index] = self.statuses.id(ssl)
+        self.web_tags[index] = self.tag_lists.id(tuple(tags))
+
+    def unit(self, status_codes, phase_code):
+        """Counters a single domain with these codes adds, as flat (path, value) lists of the non-zero ones."""
+        unit = self.units.get((status_codes, phase_code))
+        if unit is None:
+            status = {
+                field: self.statuses.values[code]
+                for field, code in zip(STATE_STATUS_FIELDS, status_codes)
+            }
+            phase = self.phases.values[phase_code]
+            chart = new_chart_summaries()
+            dmarc_phases = new_dmarc_phases()
+            accumulate_chart(chart, dmarc_phases, {"all"}, status, phase)
+            org_acc = new_org_acc()
+            # A None tag tells whether the domain's negative tags are counted
+            accumulate_org(org_acc, status, phase, [None])
+            counts_tags = org_acc.pop("negative_tags").pop(None, 0) > 0
+            unit = (
+                [
+                    (chart_type, result, value)
+                    for chart_type, counters in chart["all"].items()
+                    for result, value in counters.items()
+                    if result in ("pass", "fail", "total") and value
+                ],
+                [(phase, value) for phase, value in dmarc_phases["all"].items() if value],
+                [
+                    (category, result, value)
+                    for category, counters in org_acc.items()
+                    for result, value in counters.items()
+                    if value
+                ],
+                counts_tags,
+            )
+            self.units[(status_codes, phase_code)] = unit
+        return unit
 
+    def rollup(self):
+        """Roll the state into chart and organization counters.
 
-def reconstruct_day(db, day, state):
-    """Generate a day's state from its scans. Uses the existing state to carry forward any domains that had no scans that day."""
-    start = day.isoformat()
-    end = (day + timedelta(days=1)).isoformat()
+        Domains are grouped by their codes in one pass over the columns, then each distinct group is added
+        once, scaled by its size. Negative tags are grouped separately so they don't split the status groups.
+        """
+        counted = (self.seen, self.nxdomain)
+        statuses = self.status.values()
+        chart_groups = Counter(zip(*counted, self.scope_group, self.phase, *statuses))
+        org_groups = Counter(zip(*counted, self.org_group, self.phase, *statuses))
+        tag_groups = Counter(
+            zip(*counted, self.org_group, self.phase, self.status["dmarc"], self.dns_tags, self.web_tags)
+        )
 
-    dns_cursor = db.aql.execute(
+        chart_summaries = new_chart_summaries()
+        dmarc_phases = new_dmarc_phases()
+        for (seen, nxdomain, scope_group, phase, *status_codes), count in chart_groups.items():
+            if not seen or nxdomain:
+                continue
+            chart_unit, phase_unit, _, _ = self.unit(tuple(status_codes), phase)
+            for scope in self.scope_groups.values[scope_group]:
+                charts = chart_summaries[scope]
+                for chart_type, result, value in chart_unit:
+                    charts[chart_type][result] += value * count
+                phases = dmarc_phases[scope]
+                for phase_name, value in phase_unit:
+                    phases[phase_name] += value * count
+
+        org_accs = {}
+        counts_tags_by_key = {}
+        for (seen, nxdomain, org_group, phase, *status_codes), count in org_groups.items():
+            if not seen or nxdomain:
+                continue
+            _, _, org_unit, counts_tags = self.unit(tuple(status_codes), phase)
+            # dmarc is the first status column
+            counts_tags_by_key[(phase, status_codes[0])] = counts_tags
+            for org_id in self.org_groups.values[org_group]:
+                acc = org_accs.get(org_id)
+                if acc is None:
+                    acc = new_org_acc()
+                    org_accs[org_id] = acc
+                for category, result, value in org_unit:
+                    acc[category][result] += value * count
+
+        for (seen, nxdomain, org_group, phase, dmarc, dns_tags, web_tags), count in tag_groups.items():
+            if not seen or nxdomain or not counts_tags_by_key.get((phase, dmarc)):
+                continue
+            tags = self.tag_lists.values[dns_tags] + self.tag_lists.values[web_tags]
+            for org_id in self.org_groups.values[org_group]:
+                negative_tags = org_accs[org_id]["negative_tags"]
+                for tag in tags:
+                    negative_tags[tag] = negative_tags.get(tag, 0) + count
+
+        return chart_summaries, dmarc_phases, org_accs
+
+
+def latest_dns_scans(db, start, end):
+    """Latest dns scan of each domain with scans between start (inclusive) and end (exclusive)."""
+    return db.aql.execute(
         """
         FOR d IN dns
             FILTER d.domain != null AND d.timestamp >= @start AND d.timestamp < @end
@@ -137,21 +313,10 @@ def reconstruct_day(db, day, state):
         bind_vars={"start": start, "end": end},
     )
 
-    for row in dns_cursor:
-        tags = (
-            (row.get("dmarcTags") or [])
-            + (row.get("spfTags") or [])
-            + (row.get("dkimTags") or [])
-        )
-        entry = state.setdefault(row["domain"], new_state_entry())
-        entry["rcode"] = row.get("rcode")
-        entry["phase"] = row.get("phase")
-        entry["status"]["dmarc"] = row.get("dmarc") or "info"
-        entry["status"]["spf"] = row.get("spf") or "info"
-        entry["status"]["dkim"] = row.get("dkim") or "info"
-        entry["dns_tags"] = tags
 
-    web_cursor = db.aql.execute(
+def latest_web_scans(db, start, end):
+    """Completed results of the latest web scan of each domain with scans between start (inclusive) and end (exclusive)."""
+    return db.aql.execute(
         """
         FOR w IN web
             FILTER w.domain != null AND w.timestamp >= @start AND w.timestamp < @end
@@ -173,25 +338,197 @@ def reconstruct_day(db, day, state):
         bind_vars={"start": start, "end": end},
     )
 
+
+def reconstruct_day(db, day, state):
+    """Generate a day's state from its scans. Uses the existing state to carry forward any domains that had no scans that day."""
+    start = day.isoformat()
+    end = (day + timedelta(days=1)).isoformat()
+
+    for row in latest_dns_scans(db, start, end):
+        apply_dns_scan(state, row)
+
+    for row in latest_web_scans(db, start, end):
+        apply_web_scan(state, row)
+
+
+def seed_state(db, state, start, end):
+    """Bring the state to what the day by day backfill reaches at the end of the day before end.
+
+    For web scans, that is the latest day whose latest scan has completed results, since days without any
+    carry the previous web status forward.
+    """
+    for row in latest_dns_scans(db, start, end):
+        apply_dns_scan(state, row)
+
+    web_cursor = db.aql.execute(
+        """
+        FOR w IN web
+            FILTER w.domain != null AND w.timestamp >= @start AND w.timestamp < @end
+            COLLECT domain = w.domain, day = LEFT(w.timestamp, 10) INTO webs = w
+            LET latest = FIRST(FOR x IN webs SORT x.timestamp DESC LIMIT 1 RETURN x)
+            LET scans = (
+                FOR s IN 1..1 ANY latest._id webToWebScans
+                    FILTER s.status == "complete"
+                    RETURN {
+                        https: s.results.connectionResults.httpsStatus,
+                        hsts: s.results.connectionResults.hstsStatus,
+                        ssl: s.results.tlsResult.sslStatus,
+                        tlsTags: s.results.tlsResult.negativeTags,
+                        connTags: s.results.connectionResults.negativeTags
+                    }
+            )
+            FILTER LENGTH(scans) > 0
+            COLLECT completedDomain = domain INTO days = { day: day, scans: scans }
+            LET last = FIRST(FOR d IN days SORT d.day DESC LIMIT 1 RETURN d)
+            RETURN { domain: completedDomain, scans: last.scans }
+        """,
+        bind_vars={"start": start, "end": end},
+        batch_size=STREAM_BATCH_SIZE,
+        stream=True,
+    )
     for row in web_cursor:
-        scans = row["scans"]
-        if not scans:
+        apply_web_scan(state, row)
+
+
+def stream_days(db, start, end):
+    """Read dns and web once, in timestamp order, and fold their scans into day buckets.
+
+    Yields (day, dns_rows, web_rows) for every day with scans as soon as the stream crosses into the next
+    day, keeping only the latest scan of each domain per collection like reconstruct_day.
+    """
+    bind_vars = {"start": start, "end": end}
+    dns_cursor = db.aql.execute(
+        """
+        FOR d IN dns
+            FILTER d.domain != null AND d.timestamp >= @start AND d.timestamp < @end
+            SORT d.timestamp ASC
+            RETURN {
+                domain: d.domain,
+                timestamp: d.timestamp,
+                rcode: d.rcode,
+                dmarc: d.dmarc.status,
+                spf: d.spf.status,
+                dkim: d.dkim.status,
+                phase: d.dmarc.phase,
+                dmarcTags: d.dmarc.negativeTags,
+                spfTags: d.spf.negativeTags,
+                dkimTags: d.dkim.negativeTags
+            }
+        """,
+        bind_vars=bind_vars,
+        batch_size=STREAM_BATCH_SIZE,
+        stream=True,
+    )
+    web_cursor = db.aql.execute(
+        """
+        FOR w IN web
+            FILTER w.domain != null AND w.timestamp >= @start AND w.timestamp < @end
+            SORT w.timestamp ASC
+            LET scans = (
+                FOR s IN 1..1 ANY w._id webToWebScans
+                    FILTER s.status == "complete"
+                    RETURN {
+                        https: s.results.connectionResults.httpsStatus,
+                        hsts: s.results.connectionResults.hstsStatus,
+                        ssl: s.results.tlsResult.sslStatus,
+                        tlsTags: s.results.tlsResult.negativeTags,
+                        connTags: s.results.connectionResults.negativeTags
+                    }
+            )
+            RETURN { domain: w.domain, timestamp: w.timestamp, scans: scans }
+        """,
+        bind_vars=bind_vars,
+        batch_size=STREAM_BATCH_SIZE,
+        stream=True,
+    )
+
+    scans = heapq.merge(
+        ((row, True) for row in dns_cursor),
+        ((row, False) for row in web_cursor),
+        key=lambda scan: scan[0]["timestamp"],
+    )
+    day = None
+    dns_rows = {}
+    web_rows = {}
+    for row, is_dns in scans:
+        try:
+            row_day = date.fromisoformat(row["timestamp"][:10])
+        except ValueError:
+            logging.warning(f"Skipping scan of {row['domain']} with unusable timestamp {row['timestamp']!r}")
             continue
-        entry = state.setdefault(row["domain"], new_state_entry())
-        entry["status"]["https"] = worst_status([s["https"] for s in scans])
-        entry["status"]["hsts"] = worst_status([s["hsts"] for s in scans])
-        entry["status"]["ssl"] = worst_status([s["ssl"] for s in scans])
-        web_tags = []
-        for s in scans:
-            web_tags.extend(s.get("tlsTags") or [])
-            web_tags.extend(s.get("connTags") or [])
-        entry["web_tags"] = web_tags
+        if row_day != day:
+            if day is not None:
+                yield day, list(dns_rows.values()), list(web_rows.values())
+            day = row_day
+            dns_rows = {}
+            web_rows = {}
+        if is_dns:
+            dns_rows[row["domain"]] = row
+        else:
+            web_rows[row["domain"]] = row
+    if day is not None:
+        yield day, list(dns_rows.values()), list(web_rows.values())
+
+
+def apply_dns_scan(state, row):
+    tags = (
+        (row.get("dmarcTags") or [])
+        + (row.get("spfTags") or [])
+        + (row.get("dkimTags") or [])
+    )
+    state.update_dns(
+        row["domain"],
+        rcode=row.get("rcode"),
+        phase=row.get("phase"),
+        dmarc=row.get("dmarc") or "info",
+        spf=row.get("spf") or "info",
+        dkim=row.get("dkim") or "info",
+        tags=tags,
+    )
+
+
+def apply_web_scan(state, row):
+    """Apply a web scan's completed results. Without any, the previous web status is carried forward."""
+    scans = row["scans"]
+    if not scans:
+        return
+    web_tags = []
+    for s in scans:
+        web_tags.extend(s.get("tlsTags") or [])
+        web_tags.extend(s.get("connTags") or [])
+    state.update_web(
+        row["domain"],
+        https=worst_status([s["https"] for s in scans]),
+        hsts=worst_status([s["hsts"] for s in scans]),
+        ssl=worst_status([s["ssl"] for s in scans]),
+        tags=web_tags,
+    )
+
+
+def load_checkpoint(path, target):
+    """Load the state saved after the last written day, or None to start from scratch."""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, "rb") as checkpoint_file:
+        checkpoint = pickle.load(checkpoint_file)
+    if checkpoint["target"] != target:
+        raise ValueError(
+            f"Checkpoint {path} was written for target {checkpoint['target']!r}, not {target!r}."
+        )
+    return checkpoint
+
+
+def save_checkpoint(path, target, day, state):
+    """Save the state after a written day, replacing the previous checkpoint atomically."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as checkpoint_file:
+        pickle.dump({"target": target, "day": day, "state": state}, checkpoint_file)
+    os.replace(tmp_path, path)
 
 
 def build_precomputed(db):
     """Load the domain, scope, and org lookups reused for every day."""
     domain_by_name = {}
-    scopes_by_domain_id = {}
     cursor = db.aql.execute(
         """
         FOR d IN domains
@@ -200,200 +537,23 @@ def build_precomputed(db):
     )
     for dom in cursor:
         domain_by_name[dom["domain"]] = dom
-        scopes_by_domain_id[dom["_id"]] = domain_scopes(dom, db)
 
-    id_to_name = {dom["_id"]: name for name, dom in domain_by_name.items()}
+    scopes_by_domain_id, orgs_by_domain_id = build_domain_index(db)
+
     orgs_by_domain_name = {}
-    for claim in db.collection("claims"):
-        if claim.get("assetState") != "approved":
-            continue
-        name = id_to_name.get(claim["_to"])
-        if name is None:
-            continue
-        orgs_by_domain_name.setdefault(name, []).append(claim["_from"])
+    for name, dom in domain_by_name.items():
+        org_ids = orgs_by_domain_id.get(dom["_id"])
+        if org_ids:
+            orgs_by_domain_name[name] = org_ids
 
     return domain_by_name, scopes_by_domain_id, orgs_by_domain_name
 
 
-def new_org_acc():
-    return {
-        "https": {"pass": 0, "fail": 0},
-        "dmarc": {"pass": 0, "fail": 0},
-        "web_connections": {"pass": 0, "fail": 0},
-        "ssl": {"pass": 0, "fail": 0},
-        "spf": {"pass": 0, "fail": 0},
-        "dkim": {"pass": 0, "fail": 0},
-        "web": {"pass": 0, "fail": 0},
-        "mail": {"pass": 0, "fail": 0},
-        "dmarc_phase": {"assess": 0, "deploy": 0, "enforce": 0, "maintain": 0},
-        "negative_tags": {},
-    }
-
-
-def accumulate_chart(chart_summaries, dmarc_phases, scopes, status, phase):
-    """Add one domain's result to the chart summaries for each of its scopes."""
-    for chart_type, scan_types in CHARTS.items():
-        category_status = [status.get(scan_type) for scan_type in scan_types]
-        if "fail" in category_status:
-            result = "fail"
-        elif (
-            chart_type == "mail"
-            and status.get("dkim") == "info"
-            and "pass" in category_status
-        ) or "info" not in category_status:
-            result = "pass"
-        else:
-            continue
-        for scope in scopes:
-            chart = chart_summaries[scope][chart_type]
-            chart[result] += 1
-            chart["total"] += 1
-
-    if phase is None or status.get("dmarc") == "info":
-        return
-    if phase in ("assess", "deploy", "enforce", "maintain"):
-        for scope in scopes:
-            dmarc_phases[scope][phase] += 1
-
-
-def accumulate_org(acc, status, phase, tags):
-    """Add one domain's result to its organization's running counters."""
-    https = status.get("https")
-    dmarc = status.get("dmarc")
-    hsts = status.get("hsts")
-    ssl = status.get("ssl")
-    spf = status.get("spf")
-    dkim = status.get("dkim")
-
-    if https == "pass":
-        acc["https"]["pass"] += 1
-    elif https == "fail":
-        acc["https"]["fail"] += 1
-    if dmarc == "pass":
-        acc["dmarc"]["pass"] += 1
-    elif dmarc == "fail":
-        acc["dmarc"]["fail"] += 1
-
-    if https == "pass" and hsts == "pass":
-        acc["web_connections"]["pass"] += 1
-    elif https == "fail" or hsts == "fail":
-        acc["web_connections"]["fail"] += 1
-    if ssl == "pass":
-        acc["ssl"]["pass"] += 1
-    elif ssl == "fail":
-        acc["ssl"]["fail"] += 1
-    if spf == "pass":
-        acc["spf"]["pass"] += 1
-    elif spf == "fail":
-        acc["spf"]["fail"] += 1
-    if dkim == "pass":
-        acc["dkim"]["pass"] += 1
-    elif dkim == "fail":
-        acc["dkim"]["fail"] += 1
-
-    if ssl == "pass" and https == "pass":
-        acc["web"]["pass"] += 1
-    elif ssl == "fail" or https == "fail":
-        acc["web"]["fail"] += 1
-    if dkim == "info":
-        if dmarc == "pass" and spf == "pass":
-            acc["mail"]["pass"] += 1
-        elif dmarc == "fail" or spf == "fail":
-            acc["mail"]["fail"] += 1
-    else:
-        if dmarc == "pass" and spf == "pass" and dkim == "pass":
-            acc["mail"]["pass"] += 1
-        elif dmarc == "fail" or spf == "fail" or dkim == "fail":
-            acc["mail"]["fail"] += 1
-
-    if phase is None or dmarc == "info":
-        return
-    if phase in ("assess", "deploy", "enforce", "maintain"):
-        acc["dmarc_phase"][phase] += 1
-    for tag in tags:
-        acc["negative_tags"][tag] = acc["negative_tags"].get(tag, 0) + 1
-
-
-def to_category(metric):
-    """Turn a pass/fail pair into a pass/fail/total block."""
-    return {
-        "pass": metric["pass"],
-        "fail": metric["fail"],
-        "total": metric["pass"] + metric["fail"],
-    }
-
-
-def build_org_doc(org_id, day_iso, acc):
-    """Shape one org's counters into a summary document."""
-    phases = acc["dmarc_phase"]
-    return {
-        "organization": org_id,
-        "date": day_iso,
-        "dmarc": to_category(acc["dmarc"]),
-        "web": to_category(acc["web"]),
-        "mail": to_category(acc["mail"]),
-        "dmarc_phase": {**phases, "total": sum(phases.values())},
-        "https": to_category(acc["https"]),
-        "ssl": to_category(acc["ssl"]),
-        "spf": to_category(acc["spf"]),
-        "dkim": to_category(acc["dkim"]),
-        "web_connections": to_category(acc["web_connections"]),
-        "negative_tags": acc["negative_tags"],
-    }
-
-
-def write_day(
-    chart_col,
-    org_col,
-    day,
-    state,
-    domain_by_name,
-    scopes_by_domain_id,
-    orgs_by_domain_name,
-):
+def write_day(chart_col, org_col, day, state):
     """Roll the day's state into chart + org summaries and save them."""
     day_iso = day.isoformat()
 
-    chart_summaries = {
-        scope: {
-            chart_type: {"scan_types": scan_types, "pass": 0, "fail": 0, "total": 0}
-            for chart_type, scan_types in CHARTS.items()
-        }
-        for scope in SCOPES
-    }
-    dmarc_phases = {
-        scope: {"assess": 0, "deploy": 0, "enforce": 0, "maintain": 0}
-        for scope in SCOPES
-    }
-    org_accs = {}
-
-    for name, entry in state.items():
-        domain = domain_by_name.get(name)
-        if domain is None:
-            continue
-        if ignore_domain(
-            {
-                "archived": domain.get("archived"),
-                "blocked": domain.get("blocked"),
-                "rcode": entry["rcode"],
-            }
-        ):
-            continue
-
-        status = entry["status"]
-        phase = entry["phase"]
-
-        scopes = scopes_by_domain_id.get(domain["_id"], set())
-        if scopes:
-            accumulate_chart(chart_summaries, dmarc_phases, scopes, status, phase)
-
-        tags = entry["dns_tags"] + entry["web_tags"]
-        for org_id in orgs_by_domain_name.get(name, []):
-            acc = org_accs.get(org_id)
-            if acc is None:
-                acc = new_org_acc()
-                org_accs[org_id] = acc
-            accumulate_org(acc, status, phase, tags)
+    chart_summaries, dmarc_phases, org_accs = state.rollup()
 
     chart_docs = []
     for scope in SCOPES:
@@ -416,6 +576,67 @@ def write_day(
         org_col.insert_many(org_docs, overwrite_mode="replace")
 
 
+def backfill_days(db, target, state, first_day, write_start, write_end, stream=False, checkpoint=None):
+    """Advance the state from first_day to write_end, writing the summaries of the days from write_start."""
+    chart_col = db.collection(CHART_TARGETS[target])
+    org_col = db.collection(ORG_TARGETS[target])
+
+    def finish_day(day):
+        if day < write_start:
+            return
+        write_day(chart_col, org_col, day, state)
+        if checkpoint:
+            save_checkpoint(checkpoint, target, day, state)
+        logging.info(f"Wrote summaries for {day.isoformat()} ({len(state)} domains in state).")
+
+    day = first_day
+    if stream:
+        scan_days = stream_days(
+            db, first_day.isoformat(), (write_end + timedelta(days=1)).isoformat()
+        )
+        for scan_day, dns_rows, web_rows in scan_days:
+            # Days without any scans carry the previous state forward
+            while day < scan_day:
+                finish_day(day)
+                day += timedelta(days=1)
+            for row in dns_rows:
+                apply_dns_scan(state, row)
+            for row in web_rows:
+                apply_web_scan(state, row)
+            finish_day(day)
+            day += timedelta(days=1)
+
+    while day <= write_end:
+        if not stream:
+            reconstruct_day(db, day, state)
+        finish_day(day)
+        day += timedelta(days=1)
+
+
+def backfill_chunk(host, name, user, password, target, earliest, chunk_start, chunk_end, stream):
+    """Write the summaries of one range of days, starting from the latest scans before it. Runs in a worker process."""
+    db = connect(host, name, user, password, pool_size=DB_POOL_SIZE)
+
+    state = ColumnarState(*build_precomputed(db))
+    seed_state(db, state, earliest.isoformat(), chunk_start.isoformat())
+    backfill_days(db, target, state, chunk_start, chunk_start, chunk_end, stream=stream)
+    return chunk_start, chunk_end
+
+
+def split_days(first_day, last_day, parts):
+    """Split the days from first_day to last_day into at most parts contiguous (start, end) ranges."""
+    total = (last_day - first_day).days + 1
+    parts = max(1, min(parts, total))
+    chunks = []
+    start = first_day
+    for part in range(parts):
+        length = total // parts + (1 if part < total % parts else 0)
+        end = start + timedelta(days=length - 1)
+        chunks.append((start, end))
+        start = end + timedelta(days=1)
+    return chunks
+
+
 def run_backfill(
     host=DB_URL,
     name=DB_NAME,
@@ -424,10 +645,21 @@ def run_backfill(
     target="shadow",
     start=None,
     end=None,
+    stream=False,
+    checkpoint=None,
+    workers=1,
 ):
-    """Rebuild summaries day by day, from the first scan up to the end date."""
-    client = ArangoClient(hosts=host)
-    db = client.db(name, username=user, password=password)
+    """Rebuild summaries day by day, from the first scan up to the end date.
+
+    With stream, dns and web are read once in timestamp order instead of with two queries per day. With a
+    checkpoint path, the state is saved after every written day and an interrupted backfill resumes from there.
+    With more than one worker, the days are split into ranges written in parallel by a process pool, each
+    range starting from a snapshot of the latest scans before it.
+    """
+    if workers > 1 and checkpoint:
+        raise ValueError("Checkpoints are only supported with a single worker.")
+
+    db = connect(host, name, user, password, pool_size=DB_POOL_SIZE)
 
     ensure_collections(db, target)
     warn_missing_source_indexes(db)
@@ -440,32 +672,54 @@ def run_backfill(
     write_start = datetime.strptime(start, "%Y-%m-%d").date() if start else earliest
     write_end = datetime.strptime(end, "%Y-%m-%d").date() if end else date.today()
 
-    chart_col = db.collection(CHART_TARGETS[target])
-    org_col = db.collection(ORG_TARGETS[target])
-    domain_by_name, scopes_by_domain_id, orgs_by_domain_name = build_precomputed(db)
+    if workers > 1:
+        chunks = split_days(max(write_start, earliest), write_end, workers)
+        logging.info(
+            f"Backfilling {CHART_TARGETS[target]}/{ORG_TARGETS[target]} "
+            f"from {chunks[0][0]} to {write_end} with {len(chunks)} workers..."
+        )
+        with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+            futures = [
+                executor.submit(
+                    backfill_chunk,
+                    host,
+                    name,
+                    user,
+                    password,
+                    target,
+                    earliest,
+                    chunk_start,
+                    chunk_end,
+                    stream,
+                )
+                for chunk_start, chunk_end in chunks
+            ]
+            for future in futures:
+                chunk_start, chunk_end = future.result()
+                logging.info(f"Finished backfilling {chunk_start} to {chunk_end}.")
+        logging.info("Backfill completed.")
+        return
+
+    saved = load_checkpoint(checkpoint, target)
+    if saved is not None:
+        state = saved["state"]
+        first_day = saved["day"] + timedelta(days=1)
+        logging.info(f"Resuming from checkpoint {checkpoint} after {saved['day'].isoformat()}.")
+    else:
+        state = ColumnarState(*build_precomputed(db))
+        first_day = earliest
 
     logging.info(
         f"Backfilling {CHART_TARGETS[target]}/{ORG_TARGETS[target]} "
-        f"from {write_start} to {write_end} (accumulating from {earliest})..."
+        f"from {max(write_start, first_day)} to {write_end} (accumulating from {first_day})..."
     )
 
-    state = {}
-    day = earliest
-    while day <= write_end:
-        reconstruct_day(db, day, state)
-        if day >= write_start:
-            write_day(
-                chart_col,
-                org_col,
-                day,
-                state,
-                domain_by_name,
-                scopes_by_domain_id,
-                orgs_by_domain_name,
-            )
-            logging.info(f"Wrote summaries for {day.isoformat()} ({len(state)} domains in state).")
-        day += timedelta(days=1)
+    backfill_days(
+        db, target, state, first_day, write_start, write_end, stream=stream, checkpoint=checkpoint
+    )
 
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
     logging.info("Backfill completed.")
 
 
@@ -474,10 +728,34 @@ def main():
     parser.add_argument("--target", choices=["shadow", "prod"], default="shadow")
     parser.add_argument("--start", help="First day to write (YYYY-MM-DD). Defaults to earliest scan.")
     parser.add_argument("--end", help="Last day to write (YYYY-MM-DD). Defaults to today.")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read dns and web once in timestamp order instead of querying every day.",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="File to save progress to after every written day, and to resume an interrupted backfill from.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes writing disjoint ranges of days in parallel.",
+    )
     args = parser.parse_args()
 
     logging.info("Scan-based summary backfill started")
-    run_backfill(target=args.target, start=args.start, end=args.end)
+    run_backfill(
+        target=args.target,
+        start=args.start,
+        end=args.end,
+        stream=args.stream,
+        checkpoint=args.checkpoint,
+        workers=args.workers,
+    )
+    # Workers have their own pools, only the requests of this process are counted
+    logging.info(f"Database connection pool statistics: {get_pool_stats()}")
     logging.info("Scan-based summary backfill shutting down...")
 
 
@@ -2,15 +2,18 @@ import os
 import sys
 import logging
 from datetime import date, timedelta
-from arango import ArangoClient
 from dotenv import load_dotenv
 
+from arango_pool import connect, get_pool_stats
+
 load_dotenv()
 
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 DB_NAME = os.getenv("DB_NAME")
 DB_URL = os.getenv("DB_URL")
+# Summaries send their queries one at a time, each process needs a single database connection per host
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 1))
 
 CHARTS = {
     # tier 1
@@ -28,32 +31,77 @@ CHARTS = {
 
 SCOPES = ["all", "verified", "psd", "pgs"]
 
+DMARC_PHASES = ("assess", "deploy", "enforce", "maintain")
+
+# Number of documents fetched per round trip when streaming claims and domains
+BATCH_SIZE = int(os.getenv("SUMMARIES_BATCH_SIZE", 1000))
+
+# "python" accumulates organization summaries client side, "aql" aggregates them in the database
+ORG_SUMMARY_ENGINE = os.getenv("ORG_SUMMARY_ENGINE", "python")
+
+# Negative findings of the latest DNS and web scans of domain `d`
+NEGATIVE_TAGS_AQL = """
+    LET emailTags = (
+        LET dnsScan = DOCUMENT(d.latestDnsScan)
+        FILTER dnsScan != null
+        RETURN FLATTEN([dnsScan.dmarc.negativeTags, dnsScan.dkim.negativeTags, dnsScan.spf.negativeTags])
+    )[0]
+    LET webTags = (
+        LET web = DOCUMENT(d.latestWebScan)
+        FILTER web != null
+        FOR webScan, webScanE IN 1 OUTBOUND web webToWebScans
+            RETURN FLATTEN([webScan.results.tlsResult.negativeTags, webScan.results.connectionResults.negativeTags])
+    )
+    FOR tag IN FLATTEN([emailTags, webTags], 2)
+        FILTER tag != null
+        RETURN tag
+"""
+
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
 
-def domain_scopes(domain, db):
+def org_scopes(org):
+    """Scopes a domain claimed by the organization counts towards."""
+    scopes = {"all"}
+    if org.get("verified") is True:
+        scopes.add("verified")
+    policies = org.get("policies") or {}
+    if policies.get("psd") is True:
+        scopes.add("psd")
+    if policies.get("pgs") is True:
+        scopes.add("pgs")
+    return scopes
+
+
+def build_domain_index(db):
+    """Load the scopes and approved claiming organizations of every domain in one query.
+
+    :param db: database to read claims and organizations from
+    :return: tuple of (scopes_by_domain_id, orgs_by_domain_id)
+    """
     cursor = db.aql.execute(
         """
-            FOR org, claim IN 1..1 INBOUND @domain_id claims
+            FOR claim IN claims
                 FILTER claim.assetState == "approved"
-                RETURN { verified: org.verified, policies: org.policies }
-            """,
-        bind_vars={"domain_id": domain["_id"]},
+                LET org = DOCUMENT(claim._from)
+                FILTER org != null
+                RETURN {
+                    domain_id: claim._to,
+                    org_id: claim._from,
+                    verified: org.verified,
+                    policies: org.policies
+                }
+        """,
+        batch_size=BATCH_SIZE,
+        stream=True,
     )
-    orgs = [org for org in cursor]
-    if len(orgs) == 0:
-        return set()
-
-    scopes = {"all"}
-    for org in orgs:
-        if org.get("verified") is True:
-            scopes.add("verified")
-        policies = org.get("policies") or {}
-        if policies.get("psd") is True:
-            scopes.add("psd")
-        if policies.get("pgs") is True:
-            scopes.add("pgs")
-    return scopes
+    scopes_by_domain_id = {}
+    orgs_by_domain_id = {}
+    for claim in cursor:
+        domain_id = claim["domain_id"]
+        scopes_by_domain_id.setdefault(domain_id, set()).update(org_scopes(claim))
+        orgs_by_domain_id.setdefault(domain_id, []).append(claim["org_id"])
+    return scopes_by_domain_id, orgs_by_domain_id
 
 
 def ignore_domain(domain):
@@ -71,40 +119,369 @@ def ignore_domain(domain):
     )
 
 
-def get_domain_negative_findings(db, domain):
+def new_chart_summaries():
+    """Blank chart counters, one set per scope."""
+    return {
+        scope: {
+            chart_type: {"scan_types": scan_types, "pass": 0, "fail": 0, "total": 0}
+            for chart_type, scan_types in CHARTS.items()
+        }
+        for scope in SCOPES
+    }
+
+
+def new_dmarc_phases():
+    """Blank DMARC phase counters, one set per scope."""
+    return {scope: {phase: 0 for phase in DMARC_PHASES} for scope in SCOPES}
+
+
+def new_org_acc():
+    return {
+        "https": {"pass": 0, "fail": 0},
+        "dmarc": {"pass": 0, "fail": 0},
+        "web_connections": {"pass": 0, "fail": 0},
+        "ssl": {"pass": 0, "fail": 0},
+        "spf": {"pass": 0, "fail": 0},
+        "dkim": {"pass": 0, "fail": 0},
+        "web": {"pass": 0, "fail": 0},
+        "mail": {"pass": 0, "fail": 0},
+        "dmarc_phase": {phase: 0 for phase in DMARC_PHASES},
+        "negative_tags": {},
+    }
+
+
+def accumulate_chart(chart_summaries, dmarc_phases, scopes, status, phase):
+    """Add one domain's result to the chart summaries for each of its scopes."""
+    for chart_type, scan_types in CHARTS.items():
+        category_status = [status.get(scan_type) for scan_type in scan_types]
+        if "fail" in category_status:
+            result = "fail"
+        elif (
+            chart_type == "mail"
+            and status.get("dkim") == "info"
+            and "pass" in category_status
+        ) or "info" not in category_status:
+            result = "pass"
+        else:
+            continue
+        for scope in scopes:
+            chart = chart_summaries[scope][chart_type]
+            chart[result] += 1
+            chart["total"] += 1
+
+    if phase is None or status.get("dmarc") == "info":
+        return
+    if phase in DMARC_PHASES:
+        for scope in scopes:
+            dmarc_phases[scope][phase] += 1
+
+
+def accumulate_org(acc, status, phase, tags):
+    """Add one domain's result to its organization's running counters."""
+    https = status.get("https")
+    dmarc = status.get("dmarc")
+    hsts = status.get("hsts")
+    ssl = status.get("ssl")
+    spf = status.get("spf")
+    dkim = status.get("dkim")
+
+    if https == "pass":
+        acc["https"]["pass"] += 1
+    elif https == "fail":
+        acc["https"]["fail"] += 1
+    if dmarc == "pass":
+        acc["dmarc"]["pass"] += 1
+    elif dmarc == "fail":
+        acc["dmarc"]["fail"] += 1
+
+    if https == "pass" and hsts == "pass":
+        acc["web_connections"]["pass"] += 1
+    elif https == "fail" or hsts == "fail":
+        acc["web_connections"]["fail"] += 1
+    if ssl == "pass":
+        acc["ssl"]["pass"] += 1
+    elif ssl == "fail":
+        acc["ssl"]["fail"] += 1
+    if spf == "pass":
+        acc["spf"]["pass"] += 1
+    elif spf == "fail":
+        acc["spf"]["fail"] += 1
+    if dkim == "pass":
+        acc["dkim"]["pass"] += 1
+    elif dkim == "fail":
+        acc["dkim"]["fail"] += 1
+
+    if ssl == "pass" and https == "pass":
+        acc["web"]["pass"] += 1
+    elif ssl == "fail" or https == "fail":
+        acc["web"]["fail"] += 1
+    if dkim == "info":
+        if dmarc == "pass" and spf == "pass":
+            acc["mail"]["pass"] += 1
+        elif dmarc == "fail" or spf == "fail":
+            acc["mail"]["fail"] += 1
+    else:
+        if dmarc == "pass" and spf == "pass" and dkim == "pass":
+            acc["mail"]["pass"] += 1
+        elif dmarc == "fail" or spf == "fail" or dkim == "fail":
+            acc["mail"]["fail"] += 1
+
+    if phase is None or dmarc == "info":
+        return
+    if phase in DMARC_PHASES:
+        acc["dmarc_phase"][phase] += 1
+    for tag in tags:
+        acc["negative_tags"][tag] = acc["negative_tags"].get(tag, 0) + 1
+
+
+def to_category(metric):
+    """Turn a pass/fail pair into a pass/fail/total block."""
+    return {
+        "pass": metric["pass"],
+        "fail": metric["fail"],
+        "total": metric["pass"] + metric["fail"],
+    }
+
+
+def build_org_doc(org_id, day_iso, acc):
+    """Shape one org's counters into a summary document."""
+    phases = acc["dmarc_phase"]
+    return {
+        "organization": org_id,
+        "date": day_iso,
+        "dmarc": to_category(acc["dmarc"]),
+        "web": to_category(acc["web"]),
+        "mail": to_category(acc["mail"]),
+        "dmarc_phase": {**phases, "total": sum(phases.values())},
+        "https": to_category(acc["https"]),
+        "ssl": to_category(acc["ssl"]),
+        "spf": to_category(acc["spf"]),
+        "dkim": to_category(acc["dkim"]),
+        "web_connections": to_category(acc["web_connections"]),
+        "negative_tags": acc["negative_tags"],
+    }
+
+
+def stream_domain_statuses(db, with_negative_tags=True):
+    """Stream the status of every domain that isn't ignored, with its negative findings.
+
+    Negative findings are only gathered for domains with a DMARC phase, the only ones they are counted for.
+
+    :param db: database to read domains and scans from
+    :param with_negative_tags: False to skip gathering negative findings
+    :return: cursor of { _id, domain, status, phase, negativeTags }
+    """
+    return db.aql.execute(
+        f"""
+            FOR d IN domains
+                FILTER d.archived != true AND d.blocked != true AND d.rcode != "NXDOMAIN"
+                LET negativeTags = (!@with_negative_tags OR d.phase == null OR d.status.dmarc == "info") ? [] : (
+                    {NEGATIVE_TAGS_AQL}
+                )
+                RETURN {{
+                    _id: d._id,
+                    domain: d.domain,
+                    status: d.status,
+                    phase: d.phase,
+                    negativeTags: negativeTags
+                }}
+        """,
+        bind_vars={"with_negative_tags": with_negative_tags},
+        batch_size=BATCH_SIZE,
+        stream=True,
+    )
+
+
+def compute_summaries(db, with_orgs=True):
+    """Compute chart and organization summaries in a single pass over the domains.
+
+    :param db: database to read from
+    :param with_orgs: False to only compute chart summaries, org_accs is then empty
+    :return: tuple of (chart_summaries, dmarc_phases, org_accs), org_accs being keyed by organization _id
+    """
+    scopes_by_domain_id, orgs_by_domain_id = build_domain_index(db)
+
+    chart_summaries = new_chart_summaries()
+    dmarc_phases = new_dmarc_phases()
+    org_accs = {}
+
+    for domain in stream_domain_statuses(db, with_negative_tags=with_orgs):
+        org_ids = orgs_by_domain_id.get(domain["_id"])
+        if not org_ids:
+            continue
+
+        try:
+            status = domain.get("status") or {}
+            phase = domain.get("phase")
+            if phase is None or status.get("dmarc") == "info":
+                logging.info(
+                    f"No DMARC scan data available for domain \"{domain['domain']}\"."
+                )
+
+            accumulate_chart(
+                chart_summaries,
+                dmarc_phases,
+                scopes_by_domain_id[domain["_id"]],
+                status,
+                phase,
+            )
+            if not with_orgs:
+                continue
+            for org_id in org_ids:
+                acc = org_accs.get(org_id)
+                if acc is None:
+                    acc = new_org_acc()
+                    org_accs[org_id] = acc
+                accumulate_org(acc, status, phase, domain.get("negativeTags") or [])
+        except Exception as e:
+            logging.error(f"Error processing domain {domain['_id']}: {e}")
+            continue
+
+    return chart_summaries, dmarc_phases, org_accs
+
+
+def aggregate_org_summaries(db):
+    """Aggregate the organization summary counters in the database.
+
+    Counts the same way as accumulate_org, but only the counters are sent back.
+
+    :param db: database to read from
+    :return: org_accs keyed by organization _id, shaped like new_org_acc()
+    """
     cursor = db.aql.execute(
-        """
-            LET emailTags = (
-                LET dnsScan = DOCUMENT(@latest_dns_scan)
-                FILTER dnsScan != null
-                RETURN FLATTEN([dnsScan.dmarc.negativeTags, dnsScan.dkim.negativeTags, dnsScan.spf.negativeTags])
-            )[0]
-            LET webTags = (
-                LET web = DOCUMENT(@latest_web_scan)
-                FILTER web != null
-                FOR webScan, webScanE IN 1 OUTBOUND web webToWebScans
-                    RETURN FLATTEN([webScan.results.tlsResult.negativeTags, webScan.results.connectionResults.negativeTags])
+        f"""
+            LET claimed = (
+                FOR claim IN claims
+                    FILTER claim.assetState == "approved" AND DOCUMENT(claim._from) != null
+                    LET d = DOCUMENT(claim._to)
+                    FILTER d != null AND d.archived != true AND d.blocked != true AND d.rcode != "NXDOMAIN"
+                    LET s = d.status || {{}}
+                    RETURN {{
+                        org: claim._from,
+                        d: d,
+                        s: s,
+                        hasPhase: d.phase != null AND s.dmarc != "info",
+                        mailPass: s.dmarc == "pass" AND s.spf == "pass" AND (s.dkim == "info" OR s.dkim == "pass")
+                    }}
             )
-            FOR tag IN FLATTEN([emailTags, webTags], 2)
-                FILTER tag != null
-                RETURN tag
-        """,
-        bind_vars={
-            "latest_dns_scan": domain.get("latestDnsScan"),
-            "latest_web_scan": domain.get("latestWebScan"),
-        },
+            LET counters = (
+                FOR c IN claimed
+                    LET s = c.s
+                    COLLECT org = c.org AGGREGATE
+                        httpsPass = SUM(s.https == "pass" ? 1 : 0),
+                        httpsFail = SUM(s.https == "fail" ? 1 : 0),
+                        dmarcPass = SUM(s.dmarc == "pass" ? 1 : 0),
+                        dmarcFail = SUM(s.dmarc == "fail" ? 1 : 0),
+                        webConnectionsPass = SUM(s.https == "pass" AND s.hsts == "pass" ? 1 : 0),
+                        webConnectionsFail = SUM(!(s.https == "pass" AND s.hsts == "pass") AND (s.https == "fail" OR s.hsts == "fail") ? 1 : 0),
+                        sslPass = SUM(s.ssl == "pass" ? 1 : 0),
+                        sslFail = SUM(s.ssl == "fail" ? 1 : 0),
+                        spfPass = SUM(s.spf == "pass" ? 1 : 0),
+                        spfFail = SUM(s.spf == "fail" ? 1 : 0),
+                        dkimPass = SUM(s.dkim == "pass" ? 1 : 0),
+                        dkimFail = SUM(s.dkim == "fail" ? 1 : 0),
+                        webPass = SUM(s.ssl == "pass" AND s.https == "pass" ? 1 : 0),
+                        webFail = SUM(!(s.ssl == "pass" AND s.https == "pass") AND (s.ssl == "fail" OR s.https == "fail") ? 1 : 0),
+                        mailPass = SUM(c.mailPass ? 1 : 0),
+                        mailFail = SUM(!c.mailPass AND (s.dmarc == "fail" OR s.spf == "fail" OR s.dkim == "fail") ? 1 : 0),
+                        assess = SUM(c.hasPhase AND c.d.phase == "assess" ? 1 : 0),
+                        deploy = SUM(c.hasPhase AND c.d.phase == "deploy" ? 1 : 0),
+                        enforce = SUM(c.hasPhase AND c.d.phase == "enforce" ? 1 : 0),
+                        maintain = SUM(c.hasPhase AND c.d.phase == "maintain" ? 1 : 0)
+                    RETURN {{
+                        org,
+                        https: {{ pass: httpsPass, fail: httpsFail }},
+                        dmarc: {{ pass: dmarcPass, fail: dmarcFail }},
+                        web_connections: {{ pass: webConnectionsPass, fail: webConnectionsFail }},
+                        ssl: {{ pass: sslPass, fail: sslFail }},
+                        spf: {{ pass: spfPass, fail: spfFail }},
+                        dkim: {{ pass: dkimPass, fail: dkimFail }},
+                        web: {{ pass: webPass, fail: webFail }},
+                        mail: {{ pass: mailPass, fail: mailFail }},
+                        dmarc_phase: {{ assess, deploy, enforce, maintain }}
+                    }}
+            )
+            LET tagCounts = (
+                FOR c IN claimed
+                    FILTER c.hasPhase
+                    LET d = c.d
+                    FOR foundTag IN (
+                        {NEGATIVE_TAGS_AQL}
+                    )
+                        COLLECT org = c.org, negativeTag = foundTag WITH COUNT INTO count
+                        RETURN {{ org, tag: negativeTag, count }}
+            )
+            RETURN {{ counters, tagCounts }}
+        """
     )
-    if cursor.empty():
-        return []
-    return [tag for tag in cursor]
+    result = cursor.next()
 
+    org_accs = {}
+    for counters in result["counters"]:
+        org_id = counters.pop("org")
+        org_accs[org_id] = {**counters, "negative_tags": {}}
+    for tag_count in result["tagCounts"]:
+        org_accs[tag_count["org"]]["negative_tags"][tag_count["tag"]] = tag_count["count"]
+    return org_accs
 
-def update_chart_summaries(host=DB_URL, name=DB_NAME, user=DB_USER, password=DB_PASS):
-    logging.info(f"Updating chart summaries...")
 
-    # Establish DB connection
-    client = ArangoClient(hosts=host)
-    db = client.db(name, username=user, password=password)
+def write_org_summaries_bulk(db, org_accs):
+    """Write today's summary of every organization with one bulk request per collection."""
+    org_summaries_col = db.collection("organizationSummaries")
+    organizations_col = db.collection("organizations")
+
+    today_iso = date.today().isoformat()
+
+    # Replace summaries already written today in place
+    existing_keys = {
+        summary["organization"]: summary["_key"]
+        for summary in db.aql.execute(
+            """
+                FOR summary IN organizationSummaries
+                    FILTER summary.date == @date
+                    RETURN { organization: summary.organization, _key: summary._key }
+            """,
+            bind_vars={"date": today_iso},
+        )
+    }
+
+    summary_docs = []
+    org_updates = []
+    for org in organizations_col:
+        # One-time migration: inline `summaries` -> organizationSummaries doc
+        if org.get("latestSummaryId") is None and org.get("summaries"):
+            try:
+                org_summaries_col.insert({"organization": org["_id"], **org["summaries"]})
+            except Exception as e:
+                logging.error(f"Error migrating summaries of organization {org['_id']}: {e}")
+
+        summary_key = existing_keys.get(org["_id"], f"{today_iso}:{org['_key']}")
+        summary_docs.append(
+            {
+                "_key": summary_key,
+                **build_org_doc(
+                    org["_id"], today_iso, org_accs.get(org["_id"]) or new_org_acc()
+                ),
+            }
+        )
+        org_updates.append(
+            {
+                "_key": org["_key"],
+                "latestSummaryId": f"organizationSummaries/{summary_key}",
+                "summaries": None,
+            }
+        )
+
+    for collection, results in (
+        (org_summaries_col, org_summaries_col.insert_many(summary_docs, overwrite_mode="replace")),
+        (organizations_col, organizations_col.update_many(org_updates, keep_none=False)),
+    ):
+        for result in results:
+            if isinstance(result, Exception):
+                logging.error(f"Error writing organization summaries to {collection.name}: {result}")
+
+
+def write_chart_summaries(db, chart_summaries, dmarc_phases):
     chartSummariesCol = db.collection("chartSummaries")
 
     # TODO: remove this once all summaries have been migrated to the new format
@@ -116,67 +493,6 @@ def update_chart_summaries(host=DB_URL, name=DB_NAME, user=DB_USER, password=DB_
         """
     )
 
-    # Gather summaries from domain statuses, one accumulator per scope.
-    chartSummaries = {}
-    dmarc_phases = {}
-    for scope in SCOPES:
-        chartSummaries[scope] = {
-            chart_type: {
-                "scan_types": scan_types,
-                "pass": 0,
-                "fail": 0,
-                "total": 0,
-            }
-            for chart_type, scan_types in CHARTS.items()
-        }
-        # DMARC phases: assess, deploy, enforce, maintain
-        dmarc_phases[scope] = {
-            "assess": 0,
-            "deploy": 0,
-            "enforce": 0,
-            "maintain": 0,
-        }
-
-    for domain in db.collection("domains"):
-        if ignore_domain(domain) is True:
-            continue
-
-        scopes = domain_scopes(domain, db)
-        if len(scopes) == 0:
-            continue
-
-        # Update chart summaries
-        for chart_type, scan_types in CHARTS.items():
-            category_status = []
-            for scan_type in scan_types:
-                category_status.append(domain.get("status", {}).get(scan_type))
-            if "fail" in category_status:
-                result = "fail"
-            elif (
-                chart_type == "mail"
-                and domain.get("status", {}).get("dkim") == "info"
-                and "pass" in category_status
-            ) or "info" not in category_status:
-                result = "pass"
-            else:
-                continue
-            for scope in scopes:
-                chart = chartSummaries[scope][chart_type]
-                chart[result] += 1
-                chart["total"] += 1
-
-        # Update DMARC phase summaries
-        phase = domain.get("phase")
-        if phase is None or domain.get("status", {}).get("dmarc") == "info":
-            logging.info(
-                f"No DMARC scan data available for domain \"{domain['domain']}\"."
-            )
-            continue
-
-        if phase in ("assess", "deploy", "enforce", "maintain"):
-            for scope in scopes:
-                dmarc_phases[scope][phase] += 1
-
     # Write one document per date, scope
     today_iso = date.today().isoformat()
     for scope in SCOPES:
@@ -191,7 +507,7 @@ def update_chart_summaries(host=DB_URL, name=DB_NAME, user=DB_USER, password=DB_
                 {
                     "date": today_iso,
                     "scope": scope,
-                    **chartSummaries[scope],
+                    **chart_summaries[scope],
                     "dmarc_phase": dmarc_phase_summary,
                 }
             )
@@ -202,19 +518,13 @@ def update_chart_summaries(host=DB_URL, name=DB_NAME, user=DB_USER, password=DB_
             chartSummariesCol.update_match(
                 {"date": today_iso, "scope": scope},
                 {
-                    **chartSummaries[scope],
+                    **chart_summaries[scope],
                     "dmarc_phase": dmarc_phase_summary,
                 },
             )
-    logging.info(f"Chart summary update completed.")
-
 
-def update_org_summaries(host=DB_URL, name=DB_NAME, user=DB_USER, password=DB_PASS):
-    logging.info(f"Updating organization summary values...")
 
-    # Establish DB connection
-    client = ArangoClient(hosts=host)
-    db = client.db(name, username=user, password=password)
+def write_org_summaries(db, org_accs):
     org_summaries_col = db.collection("organizationSummaries")
     organizations_col = db.collection("organizations")
 
@@ -239,206 +549,10 @@ def update_org_summaries(host=DB_URL, name=DB_NAME, user=DB_USER, password=DB_PA
                     keep_none=False,
                 )
 
-            # tier 1
-            https_fail = 0
-            https_pass = 0
-            dmarc_pass = 0
-            dmarc_fail = 0
-
-            # tier 2
-            web_connections_fail = 0
-            web_connections_pass = 0
-            ssl_fail = 0
-            ssl_pass = 0
-            spf_fail = 0
-            spf_pass = 0
-            dkim_fail = 0
-            dkim_pass = 0
-
-            # tier 3
-            web_fail = 0
-            web_pass = 0
-            mail_fail = 0
-            mail_pass = 0
-
-            # dmarc phase
-            dmarc_phase_assess = 0
-            dmarc_phase_deploy = 0
-            dmarc_phase_enforce = 0
-            dmarc_phase_maintain = 0
-
-            negative_tags = {}
-
-            claims_cursor = db.collection("claims").find({"_from": org["_id"]})
-            claims = [claim for claim in claims_cursor]
-            for claim in claims:
-                domain = db.collection("domains").get({"_id": claim["_to"]})
-                try:
-                    domain_status = domain.get("status", {})
-                    if (
-                        ignore_domain(domain) is False
-                        and claim.get("assetState") == "approved"
-                    ):
-                        # tier 1
-                        # https
-                        https_status = domain_status.get("https")
-                        if https_status == "pass":
-                            https_pass = https_pass + 1
-                        elif https_status == "fail":
-                            https_fail = https_fail + 1
-                        # dmarc
-                        dmarc_status = domain_status.get("dmarc")
-                        if dmarc_status == "pass":
-                            dmarc_pass = dmarc_pass + 1
-                        elif dmarc_status == "fail":
-                            dmarc_fail = dmarc_fail + 1
-
-                        # tier 2
-                        # web connections
-                        hsts_status = domain_status.get("hsts")
-                        if https_status == "pass" and hsts_status == "pass":
-                            web_connections_pass = web_connections_pass + 1
-                        elif https_status == "fail" or hsts_status == "fail":
-                            web_connections_fail = web_connections_fail + 1
-                        # ssl/tls
-                        ssl_status = domain_status.get("ssl")
-                        if ssl_status == "pass":
-                            ssl_pass = ssl_pass + 1
-                        elif ssl_status == "fail":
-                            ssl_fail = ssl_fail + 1
-                        # spf
-                        spf_status = domain_status.get("spf")
-                        if spf_status == "pass":
-                            spf_pass = spf_pass + 1
-                        elif spf_status == "fail":
-                            spf_fail = spf_fail + 1
-                        # dkim
-                        dkim_status = domain_status.get("dkim")
-                        if dkim_status == "pass":
-                            dkim_pass = dkim_pass + 1
-                        elif dkim_status == "fail":
-                            dkim_fail = dkim_fail + 1
-
-                        # tier 3
-                        # web
-                        if ssl_status == "pass" and https_status == "pass":
-                            web_pass = web_pass + 1
-                        elif ssl_status == "fail" or https_status == "fail":
-                            web_fail = web_fail + 1
-                        # mail
-                        if dkim_status == "info":
-                            if dmarc_status == "pass" and spf_status == "pass":
-                                mail_pass = mail_pass + 1
-                            elif dmarc_status == "fail" or spf_status == "fail":
-                                mail_fail = mail_fail + 1
-                        else:
-                            if (
-                                dmarc_status == "pass"
-                                and spf_status == "pass"
-                                and dkim_status == "pass"
-                            ):
-                                mail_pass = mail_pass + 1
-                            elif (
-                                dmarc_status == "fail"
-                                or spf_status == "fail"
-                                or dkim_status == "fail"
-                            ):
-                                mail_fail = mail_fail + 1
-
-                        # dmarc phase
-                        phase = domain.get("phase")
-                        if phase is None or dmarc_status == "info":
-                            logging.info(
-                                f"No DMARC scan data available for domain \"{domain['domain']}\"."
-                            )
-                            continue
-
-                        if phase == "assess":
-                            dmarc_phase_assess = dmarc_phase_assess + 1
-                        elif phase == "deploy":
-                            dmarc_phase_deploy = dmarc_phase_deploy + 1
-                        elif phase == "enforce":
-                            dmarc_phase_enforce = dmarc_phase_enforce + 1
-                        elif phase == "maintain":
-                            dmarc_phase_maintain = dmarc_phase_maintain + 1
-
-                        # Negative tags
-                        domain_negative_tags = get_domain_negative_findings(
-                            db, domain
-                        )
-                        for tag in domain_negative_tags:
-                            if tag in negative_tags:
-                                negative_tags[tag] += 1
-                            else:
-                                negative_tags[tag] = 1
-                except Exception as e:
-                    logging.error(f"Error processing domain {domain['_id']}: {e}")
-                    continue
-
-            dmarc_phase_total = (
-                dmarc_phase_assess
-                + dmarc_phase_deploy
-                + dmarc_phase_enforce
-                + dmarc_phase_maintain
+            summary_data = build_org_doc(
+                org["_id"], today_iso, org_accs.get(org["_id"]) or new_org_acc()
             )
 
-            summary_data = {
-                "organization": org["_id"],
-                "date": today_iso,
-                "dmarc": {
-                    "pass": dmarc_pass,
-                    "fail": dmarc_fail,
-                    "total": dmarc_pass + dmarc_fail,
-                },
-                "web": {
-                    "pass": web_pass,
-                    "fail": web_fail,
-                    "total": web_pass + web_fail,
-                    # Don't count non web-hosting domains
-                },
-                "mail": {
-                    "pass": mail_pass,
-                    "fail": mail_fail,
-                    "total": mail_pass + mail_fail,
-                },
-                "dmarc_phase": {
-                    "assess": dmarc_phase_assess,
-                    "deploy": dmarc_phase_deploy,
-                    "enforce": dmarc_phase_enforce,
-                    "maintain": dmarc_phase_maintain,
-                    "total": dmarc_phase_total,
-                },
-                "https": {
-                    "pass": https_pass,
-                    "fail": https_fail,
-                    "total": https_pass + https_fail,
-                    # Don't count non web-hosting domains
-                },
-                "ssl": {
-                    "pass": ssl_pass,
-                    "fail": ssl_fail,
-                    "total": ssl_pass + ssl_fail,
-                    # Don't count non web-hosting domains
-                },
-                "spf": {
-                    "pass": spf_pass,
-                    "fail": spf_fail,
-                    "total": spf_pass + spf_fail,
-                },
-                "dkim": {
-                    "pass": dkim_pass,
-                    "fail": dkim_fail,
-                    "total": dkim_pass + dkim_fail,
-                },
-                "web_connections": {
-                    "pass": web_connections_pass,
-                    "fail": web_connections_fail,
-                    "total": web_connections_pass + web_connections_fail,
-                    # Don't count non web-hosting domains
-                },
-                "negative_tags": negative_tags,
-            }
-
             existing_today = org_summaries_col.find(
                 {"organization": org["_id"], "date": today_iso}
             )
@@ -462,11 +576,57 @@ def update_org_summaries(host=DB_URL, name=DB_NAME, user=DB_USER, password=DB_PA
             logging.error(f"Error processing organization {org['_id']}: {e}")
             continue
 
+
+def update_chart_summaries(host=DB_URL, name=DB_NAME, user=DB_USER, password=DB_PASS):
+    logging.info(f"Updating chart summaries...")
+
+    # Establish DB connection
+    db = connect(host, name, user, password, pool_size=DB_POOL_SIZE)
+
+    chart_summaries, dmarc_phases, _ = compute_summaries(db, with_orgs=False)
+    write_chart_summaries(db, chart_summaries, dmarc_phases)
+    logging.info(f"Chart summary update completed.")
+
+
+def update_org_summaries(
+    host=DB_URL, name=DB_NAME, user=DB_USER, password=DB_PASS, engine=ORG_SUMMARY_ENGINE
+):
+    logging.info(f"Updating organization summary values...")
+
+    # Establish DB connection
+    db = connect(host, name, user, password, pool_size=DB_POOL_SIZE)
+
+    if engine == "aql":
+        write_org_summaries_bulk(db, aggregate_org_summaries(db))
+    else:
+        _, _, org_accs = compute_summaries(db)
+        write_org_summaries(db, org_accs)
+    logging.info(f"Organization summary value update completed.")
+
+
+def update_summaries(
+    host=DB_URL, name=DB_NAME, user=DB_USER, password=DB_PASS, engine=ORG_SUMMARY_ENGINE
+):
+    """Update chart and organization summaries from a single pass over the domains."""
+    logging.info(f"Updating chart and organization summaries...")
+
+    # Establish DB connection
+    db = connect(host, name, user, password, pool_size=DB_POOL_SIZE)
+
+    chart_summaries, dmarc_phases, org_accs = compute_summaries(
+        db, with_orgs=engine != "aql"
+    )
+    write_chart_summaries(db, chart_summaries, dmarc_phases)
+    logging.info(f"Chart summary update completed.")
+    if engine == "aql":
+        write_org_summaries_bulk(db, aggregate_org_summaries(db))
+    else:
+        write_org_summaries(db, org_accs)
     logging.info(f"Organization summary value update completed.")
 
 
 if __name__ == "__main__":
     logging.info("Summary service started")
-    update_chart_summaries()
-    update_org_summaries()
+    update_summaries()
+    logging.info(f"Database connection pool statistics: {get_pool_stats()}")
     logging.info(f"Summary service shutting down...")
@@ -0,0 +1,226 @@
+import os
+
+import pytest
+from datetime import date
+from arango import ArangoClient
+from dotenv import load_dotenv
+
+from incremental_summaries import apply_status_changes, ensure_applied_events_collection
+from summaries import SCOPES, build_org_doc, compute_summaries, update_summaries
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "test.env"))
+
+DB_URL = os.getenv("DB_URL", "http://localhost:8530")
+DB_USER = os.getenv("DB_USER", "root")
+DB_PASS = os.getenv("DB_PASS", "test")
+
+
+def snapshot(status, phase, negative_tags=None, ignored=False):
+    return {
+        "status": status,
+        "phase": phase,
+        "negative_tags": negative_tags or [],
+        "ignored": ignored,
+    }
+
+
+class TestIncrementalSummaries:
+    @pytest.fixture
+    def arango_db(self):
+        arango_client = ArangoClient(hosts=DB_URL)
+        sys_db = arango_client.db("_system", username=DB_USER, password=DB_PASS)
+
+        db_name = os.path.basename(__file__).split(".")[0]
+        if sys_db.has_database(db_name):
+            sys_db.delete_database(db_name)
+        sys_db.create_database(db_name)
+
+        db = arango_client.db(db_name, username=DB_USER, password=DB_PASS)
+        db.create_collection("chartSummaries")
+        db.create_collection("organizationSummaries")
+        db.create_collection("dns")
+        db.create_collection("web")
+        db.create_collection("webScan")
+        ensure_applied_events_collection(db)
+        graph = db.create_graph("compliance")
+        domains = graph.create_vertex_collection("domains")
+        orgs = graph.create_vertex_collection("organizations")
+        claims = graph.create_edge_definition(
+            edge_collection="claims",
+            from_vertex_collections=["organizations"],
+            to_vertex_collections=["domains"],
+        )
+        graph.create_edge_definition(
+            edge_collection="webToWebScans",
+            from_vertex_collections=["web"],
+            to_vertex_collections=["webScan"],
+        )
+
+        org = orgs.insert(
+            {
+                "_key": "testorg",
+                "verified": True,
+                "policies": {"psd": True, "pgs": False},
+                "orgDetails": {"en": {"name": "Test Org"}},
+            }
+        )
+        for key, status, phase in (
+            ("domain1", {"https": "pass", "ssl": "pass", "dmarc": "pass", "spf": "pass", "dkim": "fail"}, "deploy"),
+            ("domain2", {"https": "fail", "ssl": "fail", "dmarc": "fail", "spf": "fail", "dkim": "fail"}, "assess"),
+        ):
+            domain = domains.insert(
+                {"_key": key, "domain": f"{key}.gc.ca", "status": status, "phase": phase, "archived": False}
+            )
+            claims.insert({"_from": org["_id"], "_to": domain["_id"], "assetState": "approved"})
+
+        yield db
+
+        sys_db.delete_database(db_name)
+
+    def test_apply_status_changes_matches_full_computation(self, arango_db):
+        db_name = os.path.basename(__file__).split(".")[0]
+        update_summaries(host=DB_URL, name=db_name, user=DB_USER, password=DB_PASS)
+
+        domains = arango_db.collection("domains")
+        old_domain2 = domains.get("domain2")
+        new_status = {"https": "pass", "hsts": "pass", "ssl": "pass", "dmarc": "pass", "spf": "pass", "dkim": "pass"}
+        domains.update({"_key": "domain2", "status": new_status, "phase": "maintain"})
+        domains.update({"_key": "domain1", "archived": True})
+        old_domain1 = domains.get("domain1")
+
+        apply_status_changes(
+            arango_db,
+            [
+                {
+                    "domain_id": "domains/domain2",
+                    "domain": "domain2.gc.ca",
+                    "org_ids": ["organizations/testorg"],
+                    "old": snapshot(old_domain2["status"], old_domain2["phase"]),
+                    "new": snapshot(new_status, "maintain"),
+                },
+                {
+                    "domain_id": "domains/domain1",
+                    "domain": "domain1.gc.ca",
+                    "org_ids": ["organizations/testorg"],
+                    "old": snapshot(old_domain1["status"], old_domain1["phase"]),
+                    "new": snapshot(old_domain1["status"], old_domain1["phase"], ignored=True),
+                },
+            ],
+        )
+
+        chart_summaries, dmarc_phases, org_accs = compute_summaries(arango_db)
+        today_iso = date.today().isoformat()
+        for scope in SCOPES:
+            summary = arango_db.collection("chartSummaries").find({"date": today_iso, "scope": scope}).next()
+            for chart_type, chart in chart_summaries[scope].items():
+                assert summary[chart_type] == chart
+            assert summary["dmarc_phase"] == {
+                **dmarc_phases[scope],
+                "total": sum(dmarc_phases[scope].values()),
+            }
+
+        organization = arango_db.collection("organizations").get("testorg")
+        summary = arango_db.collection("organizationSummaries").get(organization["latestSummaryId"])
+        for k in ("_id", "_key", "_rev"):
+            summary.pop(k, None)
+        assert summary == build_org_doc(
+            "organizations/testorg", today_iso, org_accs["organizations/testorg"]
+        )
+
+    def test_apply_status_changes_carries_forward_latest_summary(self, arango_db):
+        arango_db.collection("chartSummaries").insert(
+            {
+                "date": "2000-01-01",
+                "scope": "all",
+                "dmarc": {"scan_types": ["dmarc"], "pass": 1, "fail": 1, "total": 2},
+            }
+        )
+
+        apply_status_changes(
+            arango_db,
+            [
+                {
+                    "domain_id": "domains/domain2",
+                    "domain": "domain2.gc.ca",
+                    "org_ids": ["organizations/testorg"],
+                    "old": snapshot({"dmarc": "fail"}, None),
+                    "new": snapshot({"dmarc": "pass"}, None),
+                }
+            ],
+        )
+
+        summary = (
+            arango_db.collection("chartSummaries")
+            .find({"date": date.today().isoformat(), "scope": "all"})
+            .next()
+        )
+        assert summary["dmarc"] == {"scan_types": ["dmarc"], "pass": 2, "fail": 0, "total": 2}
+        assert arango_db.collection("chartSummaries").find({"date": "2000-01-01"}).count() == 1
+
+    def test_apply_status_changes_counts_tags_of_each_web_scan(self, arango_db):
+        db_name = os.path.basename(__file__).split(".")[0]
+        update_summaries(host=DB_URL, name=db_name, user=DB_USER, password=DB_PASS)
+
+        # Both web scans of the domain report the same tag, the full computation counts it twice
+        web = arango_db.collection("web").insert({"domain": "domain1.gc.ca"})
+        for tls_tags, connection_tags in ((["ssl2"], ["https9"]), (["ssl2"], [])):
+            web_scan = arango_db.collection("webScan").insert(
+                {
+                    "status": "complete",
+                    "results": {
+                        "tlsResult": {"negativeTags": tls_tags},
+                        "connectionResults": {"negativeTags": connection_tags},
+                    },
+                }
+            )
+            arango_db.collection("webToWebScans").insert({"_from": web["_id"], "_to": web_scan["_id"]})
+        domains = arango_db.collection("domains")
+        domains.update({"_key": "domain1", "latestWebScan": web["_id"]})
+        domain1 = domains.get("domain1")
+
+        apply_status_changes(
+            arango_db,
+            [
+                {
+                    "domain_id": "domains/domain1",
+                    "domain": "domain1.gc.ca",
+                    "org_ids": ["organizations/testorg"],
+                    "old": snapshot(domain1["status"], domain1["phase"]),
+                    # As the web processor builds it, one tag per web scan reporting it
+                    "new": snapshot(domain1["status"], domain1["phase"], ["https9", "ssl2", "ssl2"]),
+                }
+            ],
+        )
+
+        org_accs = compute_summaries(arango_db)[2]
+        today_iso = date.today().isoformat()
+        organization = arango_db.collection("organizations").get("testorg")
+        summary = arango_db.collection("organizationSummaries").get(organization["latestSummaryId"])
+        for k in ("_id", "_key", "_rev"):
+            summary.pop(k, None)
+        assert summary == build_org_doc(
+            "organizations/testorg", today_iso, org_accs["organizations/testorg"]
+        )
+        assert summary["negative_tags"]["ssl2"] == 2
+
+    def test_apply_status_changes_skips_redelivered_events(self, arango_db):
+        events = [
+            {
+                "domain_id": "domains/domain2",
+                "domain": "domain2.gc.ca",
+                "org_ids": ["organizations/testorg"],
+                "old": snapshot({"dmarc": "fail"}, None),
+                "new": snapshot({"dmarc": "pass"}, None),
+            }
+        ]
+        apply_status_changes(arango_db, events, ["1"])
+        # Redelivered after the summaries were committed, e.g. when the acknowledgement was lost
+        apply_status_changes(arango_db, events, ["1"])
+
+        summary = (
+            arango_db.collection("chartSummaries")
+            .find({"date": date.today().isoformat(), "scope": "all"})
+            .next()
+        )
+        assert summary["dmarc"] == {"scan_types": ["dmarc"], "pass": 1, "fail": 0, "total": 1}
+        assert arango_db.collection("appliedStatusChanges").count() == 1
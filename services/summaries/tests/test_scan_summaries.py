@@ -5,7 +5,7 @@ from datetime import date, timedelta
 from arango import ArangoClient
 from dotenv import load_dotenv
 
-from scan_summaries import run_backfill
+from scan_summaries import ColumnarState, backfill_days, load_checkpoint, run_backfill
 
 load_dotenv(os.path.join(os.path.dirname(__file__), "test.env"))
 
@@ -38,6 +38,21 @@ def web_scan_results(https, hsts, ssl):
     }
 
 
+def rebuilt(db):
+    """Documents written to the shadow summaries, keyed by _id."""
+    docs = {}
+    for name in ("chartSummaries_rebuild", "organizationSummaries_rebuild"):
+        for doc in db.collection(name).all():
+            doc.pop("_rev")
+            docs[doc["_id"]] = doc
+    return docs
+
+
+def clear_rebuilt(db):
+    for name in ("chartSummaries_rebuild", "organizationSummaries_rebuild"):
+        db.collection(name).truncate()
+
+
 class TestScanSummaries:
     @pytest.fixture
     def arango_db(self):
@@ -162,6 +177,38 @@ class TestScanSummaries:
             "negative_tags": {},
         }
 
+    def test_stream_rebuild_matches_daily_rebuild(self, arango_db, tmp_path):
+        db_name = os.path.basename(__file__).split(".")[0]
+
+        run_backfill(host=DB_URL, name=db_name, user=DB_USER, password=DB_PASS, target="shadow")
+        daily = rebuilt(arango_db)
+        clear_rebuilt(arango_db)
+
+        checkpoint = tmp_path / "backfill.checkpoint"
+        run_backfill(
+            host=DB_URL,
+            name=db_name,
+            user=DB_USER,
+            password=DB_PASS,
+            target="shadow",
+            stream=True,
+            checkpoint=str(checkpoint),
+        )
+
+        assert rebuilt(arango_db) == daily
+        assert not checkpoint.exists()
+
+    def test_parallel_rebuild_matches_sequential_rebuild(self, arango_db):
+        db_name = os.path.basename(__file__).split(".")[0]
+
+        run_backfill(host=DB_URL, name=db_name, user=DB_USER, password=DB_PASS, target="shadow")
+        sequential = rebuilt(arango_db)
+        clear_rebuilt(arango_db)
+
+        run_backfill(host=DB_URL, name=db_name, user=DB_USER, password=DB_PASS, target="shadow", workers=2)
+
+        assert rebuilt(arango_db) == sequential
+
 
 YESTERDAY = (date.today() - timedelta(days=1)).isoformat()
 
@@ -254,3 +301,192 @@ class TestCarryForwardWebStatus:
             "dmarc_phase": {"assess": 0, "deploy": 0, "enforce": 0, "maintain": 1, "total": 1},
             "negative_tags": {},
         }
+
+
+class FakeCollection:
+    def __init__(self, db, docs):
+        self.db = db
+        self.docs = docs
+
+    def insert_many(self, docs, overwrite_mode=None):
+        if self.db.fail_after is not None:
+            if self.db.fail_after == 0:
+                raise RuntimeError("Backfill interrupted")
+            self.db.fail_after -= 1
+        for doc in docs:
+            self.docs[doc["_key"]] = doc
+
+
+class FakeAQL:
+    """Answers the scan queries of the backfill from in-memory dns and web documents."""
+
+    def __init__(self, dns, web):
+        self.dns = dns
+        self.web = web
+
+    def scans_between(self, docs, bind_vars):
+        return sorted(
+            (doc for doc in docs if bind_vars["start"] <= doc["timestamp"] < bind_vars["end"]),
+            key=lambda doc: doc["timestamp"],
+        )
+
+    def latest_by_domain(self, docs):
+        return {doc["domain"]: doc for doc in docs}.values()
+
+    def dns_row(self, doc):
+        return {
+            "domain": doc["domain"],
+            "timestamp": doc["timestamp"],
+            "rcode": doc["rcode"],
+            "dmarc": doc["dmarc"]["status"],
+            "spf": doc["spf"]["status"],
+            "dkim": doc["dkim"]["status"],
+            "phase": doc["dmarc"]["phase"],
+            "dmarcTags": doc["dmarc"]["negativeTags"],
+            "spfTags": doc["spf"]["negativeTags"],
+            "dkimTags": doc["dkim"]["negativeTags"],
+        }
+
+    def web_row(self, doc):
+        scans = [
+            {
+                "https": scan["results"]["connectionResults"]["httpsStatus"],
+                "hsts": scan["results"]["connectionResults"]["hstsStatus"],
+                "ssl": scan["results"]["tlsResult"]["sslStatus"],
+                "tlsTags": scan["results"]["tlsResult"]["negativeTags"],
+                "connTags": scan["results"]["connectionResults"]["negativeTags"],
+            }
+            for scan in doc["scans"]
+            if scan["status"] == "complete"
+        ]
+        return {"domain": doc["domain"], "timestamp": doc["timestamp"], "scans": scans}
+
+    def execute(self, query, bind_vars=None, **kwargs):
+        if "FOR d IN dns" in query:
+            scans = self.scans_between(self.dns, bind_vars)
+            if "SORT d.timestamp ASC" not in query:
+                scans = self.latest_by_domain(scans)
+            return iter([self.dns_row(doc) for doc in scans])
+        if "FOR w IN web" in query:
+            scans = self.scans_between(self.web, bind_vars)
+            if "SORT w.timestamp ASC" not in query:
+                scans = self.latest_by_domain(scans)
+            return iter([self.web_row(doc) for doc in scans])
+        raise AssertionError(f"Unexpected query: {query}")
+
+
+class FakeDB:
+    def __init__(self, dns, web, fail_after=None):
+        self.aql = FakeAQL(dns, web)
+        self.written = {}
+        self.fail_after = fail_after
+
+    def collection(self, name):
+        return FakeCollection(self, self.written.setdefault(name, {}))
+
+
+class TestBackfillDays:
+    """The backfill modes give the same summaries without a database, answering its queries from memory."""
+
+    FIRST_DAY = date(2024, 1, 1)
+    LAST_DAY = date(2024, 1, 6)
+
+    @pytest.fixture
+    def scans(self):
+        def at(day, time="12:00:00"):
+            return f"{self.FIRST_DAY + timedelta(days=day)} {time}.000000+00:00"
+
+        def web_doc(name, timestamp, *scans):
+            return {"domain": name, "timestamp": timestamp, "scans": list(scans)}
+
+        tagged = web_scan_results("fail", "pass", "fail")
+        tagged["results"]["tlsResult"]["negativeTags"] = ["ssl2"]
+        pending = web_scan_results("pass", "pass", "pass") | {"status": "pending"}
+
+        dns = [
+            dns_doc("a.gc.ca", "pass", "pass", "pass", "maintain") | {"timestamp": at(0)},
+            dns_doc("b.gc.ca", "fail", "pass", "fail", "assess") | {"timestamp": at(0)},
+            # Later scan of the same day replaces the earlier one
+            dns_doc("a.gc.ca", "fail", "fail", "pass", "deploy") | {"timestamp": at(1, "08:00:00")},
+            dns_doc("a.gc.ca", "pass", "fail", "pass", "enforce") | {"timestamp": at(1, "20:00:00")},
+            # No scans on the third day, the state is carried forward
+            dns_doc("b.gc.ca", "pass", "pass", "pass", "maintain") | {"timestamp": at(3)},
+            dns_doc("c.gc.ca", "pass", "pass", "pass", "maintain") | {"timestamp": at(4)},
+        ]
+        web = [
+            web_doc("a.gc.ca", at(0), web_scan_results("pass", "pass", "pass")),
+            web_doc("b.gc.ca", at(0), tagged, tagged),
+            web_doc("a.gc.ca", at(3), web_scan_results("fail", "fail", "pass"), pending),
+            # Without completed results the previous web status is carried forward
+            web_doc("b.gc.ca", at(4), pending),
+            web_doc("c.gc.ca", at(5), web_scan_results("pass", "fail", "pass")),
+        ]
+        return dns, web
+
+    def new_state(self):
+        domain_by_name = {
+            name: {"_id": f"domains/{name}", "domain": name, "archived": False, "blocked": False}
+            for name in ("a.gc.ca", "b.gc.ca", "c.gc.ca")
+        }
+        scopes_by_domain_id = {
+            "domains/a.gc.ca": {"all", "verified"},
+            "domains/b.gc.ca": {"all", "verified", "psd"},
+            "domains/c.gc.ca": {"all"},
+        }
+        orgs_by_domain_name = {
+            "a.gc.ca": ["organizations/tbs"],
+            "b.gc.ca": ["organizations/tbs", "organizations/ssc"],
+            "c.gc.ca": ["organizations/ssc"],
+        }
+        return ColumnarState(domain_by_name, scopes_by_domain_id, orgs_by_domain_name)
+
+    def backfill(self, db, stream=False, checkpoint=None, state=None, first_day=None, write_start=None):
+        backfill_days(
+            db,
+            "shadow",
+            state or self.new_state(),
+            first_day or self.FIRST_DAY,
+            write_start or self.FIRST_DAY,
+            self.LAST_DAY,
+            stream=stream,
+            checkpoint=checkpoint,
+        )
+        return db.written
+
+    def test_stream_matches_daily(self, scans):
+        daily = self.backfill(FakeDB(*scans))
+        assert len(daily["chartSummaries_rebuild"]) == 6 * 4
+        assert daily["organizationSummaries_rebuild"]["2024-01-01:ssc"]["negative_tags"] == {"ssl2": 2}
+
+        assert self.backfill(FakeDB(*scans), stream=True) == daily
+
+    def test_stream_matches_daily_with_later_write_start(self, scans):
+        write_start = self.FIRST_DAY + timedelta(days=2)
+        daily = self.backfill(FakeDB(*scans), write_start=write_start)
+        assert min(daily["chartSummaries_rebuild"]) == "2024-01-03:all"
+
+        assert self.backfill(FakeDB(*scans), stream=True, write_start=write_start) == daily
+
+    @pytest.mark.parametrize("stream", [False, True])
+    def test_resumed_backfill_matches_uninterrupted_backfill(self, scans, tmp_path, stream):
+        uninterrupted = self.backfill(FakeDB(*scans), stream=stream)
+
+        checkpoint = str(tmp_path / "backfill.checkpoint")
+        # Each day writes its chart and organization summaries, stop during the fourth day
+        interrupted_db = FakeDB(*scans, fail_after=7)
+        with pytest.raises(RuntimeError):
+            self.backfill(interrupted_db, stream=stream, checkpoint=checkpoint)
+
+        saved = load_checkpoint(checkpoint, "shadow")
+        assert saved["day"] == self.FIRST_DAY + timedelta(days=2)
+
+        resumed_db = FakeDB(*scans)
+        resumed_db.written = interrupted_db.written
+        resumed = self.backfill(
+            resumed_db,
+            stream=stream,
+            checkpoint=checkpoint,
+            state=saved["state"],
+            first_day=saved["day"] + timedelta(days=1),
+        )
+        assert resumed == uninterrupted
@@ -4,7 +4,12 @@ import pytest
 from datetime import date
 from arango import ArangoClient
 from dotenv import load_dotenv
-from summaries import update_chart_summaries, update_org_summaries
+from summaries import (
+    aggregate_org_summaries,
+    compute_summaries,
+    update_chart_summaries,
+    update_org_summaries,
+)
 
 load_dotenv(os.path.join(os.path.dirname(__file__), "test.env"))
 
@@ -283,3 +288,56 @@ class TestSummaries:
             },
             "negative_tags": {},
         }
+
+    def test_aggregate_org_summaries_parity(self, arango_db):
+        dns = arango_db.collection("dns").insert(
+            {
+                "dmarc": {"negativeTags": ["dmarc2", "dmarc7"]},
+                "dkim": {"negativeTags": ["dkim1"]},
+                "spf": {"negativeTags": []},
+            }
+        )
+        domain = arango_db.collection("domains").find({"domain": "cyber3.gc.ca"}).next()
+        arango_db.collection("domains").update(
+            {"_key": domain["_key"], "latestDnsScan": dns["_id"]}
+        )
+
+        _, _, org_accs = compute_summaries(arango_db)
+
+        assert aggregate_org_summaries(arango_db) == org_accs
+        assert org_accs["organizations/testorg"]["negative_tags"] == {
+            "dmarc2": 1,
+            "dmarc7": 1,
+            "dkim1": 1,
+        }
+
+    def test_update_org_summaries_aql_engine(self, arango_db):
+        db_name = os.path.basename(__file__).split(".")[0]
+
+        def latest_summary():
+            organization = arango_db.collection("organizations").get(
+                {"_key": "testorg"}
+            )
+            summary = arango_db.collection("organizationSummaries").get(
+                {"_id": organization["latestSummaryId"]}
+            )
+            for k in ("_id", "_key", "_rev"):
+                summary.pop(k, None)
+            return summary
+
+        update_org_summaries(
+            host=DB_URL, name=db_name, user=DB_USER, password=DB_PASS, engine="aql"
+        )
+        aql_summary = latest_summary()
+
+        update_org_summaries(
+            host=DB_URL, name=db_name, user=DB_USER, password=DB_PASS, engine="python"
+        )
+
+        assert aql_summary == latest_summary()
+        assert (
+            arango_db.collection("organizationSummaries")
+            .find({"organization": "organizations/testorg", "date": date.today().isoformat()})
+            .count()
+            == 1
+        )
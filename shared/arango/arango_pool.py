@@ -0,0 +1,146 @@
+import threading
+import time
+
+from arango import ArangoClient
+from arango.http import HTTPClient
+from arango.response import Response
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+# Seconds before a request to the database times out, as in python-arango
+REQUEST_TIMEOUT = 60
+
+
+class PoolWaitStats:
+    """Time requests spent waiting for a free connection, shared by every pool in the process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, seconds):
+        with self.lock:
+            self.requests += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "total_wait_seconds": round(self.total_wait, 3),
+                "mean_wait_ms": round(self.total_wait / self.requests * 1000, 3)
+                if self.requests
+                else None,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+            }
+
+
+pool_wait_stats = PoolWaitStats()
+
+
+class TimedPoolMixin:
+    def _get_conn(self, timeout=None):
+        start = time.perf_counter()
+        try:
+            return super()._get_conn(timeout=timeout)
+        finally:
+            pool_wait_stats.record(time.perf_counter() - start)
+
+
+class TimedHTTPConnectionPool(TimedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class TimedHTTPSConnectionPool(TimedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+
+class PooledHTTPClient(HTTPClient):
+    """
+    HTTP client keeping up to pool_size keep-alive connections open to each host.
+
+    The requests default pool holds 10 connections and opens a throwaway
+    connection whenever more threads than that send requests at once. This
+    pool blocks instead, so requests wait for a connection to be returned
+    and sockets are reused.
+    """
+
+    def __init__(self, pool_size):
+        self.pool_size = pool_size
+
+    def create_session(self, host):
+        retry_strategy = Retry(
+            total=3,
+            backoff_factor=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["HEAD", "GET", "OPTIONS"],
+        )
+        http_adapter = PooledHTTPAdapter(
+            max_retries=retry_strategy,
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            pool_block=True,
+        )
+
+        session = Session()
+        session.mount("https://", http_adapter)
+        session.mount("http://", http_adapter)
+        return session
+
+    def send_request(
+        self, session, method, url, headers=None, params=None, data=None, auth=None
+    ):
+        response = session.request(
+            method=method,
+            url=url,
+            params=params,
+            data=data,
+            headers=headers,
+            auth=auth,
+            timeout=REQUEST_TIMEOUT,
+        )
+        return Response(
+            method=method,
+            url=response.url,
+            headers=response.headers,
+            status_code=response.status_code,
+            status_text=response.reason,
+            raw_body=response.text,
+        )
+
+
+def connect(hosts, name, username, password, pool_size):
+    """
+    Connect to a database through pooled keep-alive connections
+    :param hosts: Comma separated coordinator URLs, requests are sent to each in turn
+    :param pool_size: Maximum number of connections to each host, usually the number of threads using the database
+    :return: The database
+    """
+    client = ArangoClient(
+        hosts=hosts.split(","),
+        host_resolver="roundrobin",
+        http_client=PooledHTTPClient(pool_size),
+    )
+    return client.db(name, username=username, password=password)
+
+
+def get_pool_stats():
+    """
+    Get the time requests waited for a free database connection
+    :return: Dict with requests, total_wait_seconds, mean_wait_ms and max_wait_ms
+    """
+    return pool_wait_stats.snapshot()
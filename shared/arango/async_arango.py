@@ -0,0 +1,190 @@
+import itertools
+import json
+import logging
+import time
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class ArangoError(Exception):
+    def __init__(self, http_code, error_num, message):
+        super().__init__(f"[HTTP {http_code}][ERR {error_num}] {message}")
+        self.http_code = http_code
+        self.error_num = error_num
+
+
+def to_error(http_code, body):
+    return ArangoError(
+        http_code, body.get("errorNum"), body.get("errorMessage", "Unknown error")
+    )
+
+
+def with_errors(http_code, results):
+    # Bulk document requests report a failed document in place of its result
+    return [
+        to_error(http_code, result)
+        if isinstance(result, dict) and result.get("error")
+        else result
+        for result in results
+    ]
+
+
+class PoolWaitStats:
+    """Time requests spent waiting for a free connection."""
+
+    def __init__(self):
+        self.requests = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def on_request_start(self, session, context, params):
+        self.requests += 1
+
+    async def on_connection_queued_start(self, session, context, params):
+        context.queued_at = time.monotonic()
+
+    async def on_connection_queued_end(self, session, context, params):
+        wait = time.monotonic() - context.queued_at
+        self.waited += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def trace_config(self):
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self.on_request_start)
+        trace_config.on_connection_queued_start.append(self.on_connection_queued_start)
+        trace_config.on_connection_queued_end.append(self.on_connection_queued_end)
+        return trace_config
+
+    def snapshot(self):
+        return {
+            "requests": self.requests,
+            "waited": self.waited,
+            "total_wait_seconds": round(self.total_wait, 3),
+            "mean_wait_ms": round(self.total_wait / self.requests * 1000, 3)
+            if self.requests
+            else None,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+
+
+class AsyncArangoDatabase:
+    """
+    Minimal asyncio client for the parts of the ArangoDB HTTP API used by the
+    processor: AQL cursors and single and bulk document requests.
+
+    Every request goes through one aiohttp session, so connections are kept
+    alive and reused, and at most pool_size requests are sent at once. Other
+    requests wait for a free connection instead of opening new sockets.
+    url can list several coordinators separated by commas, requests are sent
+    to each in turn. Document results follow python-arango: bulk requests
+    return an ArangoError in place of each document that failed.
+    """
+
+    def __init__(self, url, name, username, password, pool_size=100):
+        self.base_urls = [f"{host.rstrip('/')}/_db/{name}/_api" for host in url.split(",")]
+        self.next_base_url = itertools.cycle(self.base_urls).__next__
+        self.auth = aiohttp.BasicAuth(username or "", password or "")
+        self.pool_size = pool_size
+        self.pool_wait_stats = PoolWaitStats()
+        self.session = None
+
+    async def connect(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            auth=self.auth,
+            json_serialize=json.dumps,
+            raise_for_status=False,
+            trace_configs=[self.pool_wait_stats.trace_config()],
+        )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def pool_stats(self):
+        """
+        Get the time requests waited for a free database connection
+        :return: Dict with requests, waited, total_wait_seconds, mean_wait_ms and max_wait_ms
+        """
+        return self.pool_wait_stats.snapshot()
+
+    async def request(self, method, path, params=None, body=None, base_url=None):
+        if base_url is None:
+            base_url = self.next_base_url()
+        async with self.session.request(
+            method, f"{base_url}{path}", params=params, json=body
+        ) as response:
+            result = await response.json(content_type=None)
+            if response.status >= 400:
+                raise to_error(response.status, result or {})
+            return response.status, result
+
+    async def aql(self, query, bind_vars=None, batch_size=1000):
+        # Cursors live on the coordinator that created them
+        base_url = self.next_base_url()
+        status, cursor = await self.request(
+            "POST",
+            "/cursor",
+            body={"query": query, "bindVars": bind_vars or {}, "batchSize": batch_size},
+            base_url=base_url,
+        )
+        results = cursor["result"]
+        while cursor.get("hasMore"):
+            status, cursor = await self.request(
+                "PUT", f"/cursor/{cursor['id']}", base_url=base_url
+            )
+            results.extend(cursor["result"])
+        return results
+
+    async def get(self, collection, key):
+        try:
+            status, result = await self.request("GET", f"/document/{collection}/{key}")
+        except ArangoError as e:
+            # Missing documents are None
+            if e.http_code == 404:
+                return None
+            raise
+        return result
+
+    async def get_many(self, collection, keys):
+        status, results = await self.request(
+            "PUT", f"/document/{collection}", params={"onlyget": "true"}, body=keys
+        )
+        # Missing documents are left out
+        return [result for result in results if not result.get("error")]
+
+    async def insert(self, collection, document):
+        status, result = await self.request(
+            "POST", f"/document/{collection}", body=document
+        )
+        return result
+
+    async def insert_many(self, collection, documents):
+        status, results = await self.request(
+            "POST", f"/document/{collection}", body=documents
+        )
+        return with_errors(status, results)
+
+    async def update(self, collection, document):
+        status, result = await self.request(
+            "PATCH", f"/document/{collection}/{document['_key']}", body=document
+        )
+        return result
+
+    async def ensure_index(self, collection, index):
+        # Returns the existing index if one with the same definition is already there
+        status, result = await self.request(
+            "POST", "/index", params={"collection": collection}, body=index
+        )
+        return result
+
+    async def update_many(self, collection, documents):
+        status, results = await self.request(
+            "PATCH", f"/document/{collection}", body=documents
+        )
+        return with_errors(status, results)
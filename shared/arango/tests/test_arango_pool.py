@@ -0,0 +1,63 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import arango_pool
+
+
+class CursorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.client_ports.add(self.client_address[1])
+        time.sleep(0.01)
+        body = json.dumps(
+            {"result": [self.server.server_port], "hasMore": False, "error": False, "code": 201}
+        ).encode()
+        self.send_response(201)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def coordinators():
+    servers = []
+    for _ in range(2):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), CursorHandler)
+        server.client_ports = set()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    yield servers
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_connections_are_reused_and_spread_across_hosts(coordinators):
+    hosts = ",".join(f"http://127.0.0.1:{server.server_port}" for server in coordinators)
+    db = arango_pool.connect(hosts, "tracker", "user", "password", pool_size=2)
+    requests_before = arango_pool.get_pool_stats()["requests"]
+
+    def query(_):
+        return next(db.aql.execute("RETURN 1"))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        ports = list(executor.map(query, range(32)))
+
+    for server in coordinators:
+        assert ports.count(server.server_port) == 16
+        assert len(server.client_ports) <= 2
+
+    stats = arango_pool.get_pool_stats()
+    assert stats["requests"] - requests_before == 32
+    assert stats["max_wait_ms"] > 0